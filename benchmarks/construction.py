@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# compares the generated per-class constructors of typed.Node against
+# the old per-instance reflection path
+
+import timeit
+import util.typed as typed
+import midend.ir as ir
+
+def reflective_init(node, **kwargs):
+	""" the constructor as it used to be: schema derived on every call """
+	fields = typed.get_fields(type(node))
+	field_names = [ff[0] for ff in fields]
+	for name, value in fields:
+		if not name in kwargs and not isinstance(value, typed.Optional):
+			raise TypeError("Missing value for field `{}`".format(name))
+	types = {ff[0]: ff[1] for ff in fields}
+	for name, value in kwargs.items():
+		if not typed._local_isinstance(value, types[name]):
+			raise TypeError("Field `{}` requires values of type `{}` not `{}`".format(
+				name, types[name], type(value)))
+	for name in field_names:
+		object.__setattr__(node, name, kwargs.get(name, None))
+	object.__setattr__(node, "_fields", field_names)
+	object.__setattr__(node, "_typed_fields", fields)
+
+def construct(cls, kwargs, reflective):
+	if reflective:
+		node = cls.__new__(cls)
+		reflective_init(node, **kwargs)
+		return node
+	return cls(**kwargs)
+
+def cases():
+	ch = ir.Channel(width=1)
+	tok = ir.Token(width=8, has_duration=False)
+	s0, s1 = ir.State(), ir.State()
+	ev = ir.ExternalEvent(edge=ir.Edge.Rising, channel=ch)
+	actions = [ir.Start(token=tok), ir.Append(token=tok, channel=ch), ir.Emit(token=tok)]
+	tran = ir.Transition(source=s0, destination=s1, trigger=ev, actions=actions)
+	yield ir.Channel, dict(width=1)
+	yield ir.High, dict(channel=ch)
+	yield ir.InternalEvent, dict(trigger=ev)
+	yield ir.Transition, dict(source=s0, destination=s1, trigger=ev, actions=actions)
+	yield ir.DFA, dict(start=s0, states=[s0, s1], transitions=[tran] * 32)
+
+def main(number=20000):
+	print("{:<16} {:>13} {:>13} {:>8}".format("class", "reflect [us]", "compiled [us]", "speedup"))
+	for cls, kwargs in cases():
+		times = [min(timeit.repeat(lambda: construct(cls, kwargs, reflective),
+		                           number=number, repeat=3)) / number * 1e6
+		         for reflective in (True, False)]
+		print("{:<16} {:>13.3f} {:>13.3f} {:>7.1f}x".format(
+			cls.__name__, times[0], times[1], times[0] / times[1]))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# seeded random IR generators for benchmarks
+
+import random
+
+def random_decoder(ir, dfas=100, states=20, transitions=4, inputs=8, outputs=4, seed=0,
+                   delayed=0.0, compound=0.0):
+	""" Decoder with `dfas` DFAs of `states` states with `transitions`
+	    outgoing transitions each. Only half of the tokens are outputs,
+	    thus dead code elimination has something to remove.
+	    A fraction `delayed` of the triggers waits for a DelayedEvent
+	    instead of an edge and a fraction `compound` of the guards and
+	    triggers is a ConditionBinOp/ConstantCondition or a Sample. """
+	rnd = random.Random(seed)
+	channels = [ir.Channel(width=rnd.choice([1, 1, 1, 8]), name="in{}".format(ii))
+	            for ii in range(inputs)]
+	tokens = [ir.Token(width=rnd.choice([1, 8, 16]), has_duration=rnd.random() < 0.5)
+	          for _ in range(2 * outputs)]
+	def level():
+		cls = rnd.choice([ir.High, ir.Low])
+		return cls(channel=rnd.choice(channels))
+	def condition():
+		if compound and rnd.random() < compound:
+			if rnd.random() < 0.2: return ir.ConstantCondition(value=rnd.random() < 0.5)
+			return ir.ConditionBinOp(op=ir.Bop.And, left=level(), right=level())
+		return level()
+	def trigger():
+		if delayed and rnd.random() < delayed:
+			event = ir.DelayedEvent(cycles=rnd.randint(1, 4))
+		else:
+			event = ir.ExternalEvent(edge=rnd.choice(list(ir.Edge)), channel=rnd.choice(channels))
+		if rnd.random() < 0.5:
+			event = ir.InternalEvent(trigger=event, guard=condition())
+		if compound and rnd.random() < compound:
+			event = ir.Sample(trigger=event, channel=rnd.choice(channels))
+		return event
+	def action(token):
+		cls = rnd.choice([ir.Start, ir.Append, ir.Append, ir.Emit, ir.Reset])
+		if cls is ir.Append: return cls(token=token, channel=rnd.choice(channels))
+		return cls(token=token)
+	result = []
+	for dd in range(dfas):
+		dfa_states = [ir.State(name="s{}_{}".format(dd, ss)) for ss in range(states)]
+		# most DFAs only work on a single token
+		dfa_tokens = rnd.sample(tokens, 1 if rnd.random() < 0.7 else 2)
+		trans = []
+		for source in dfa_states:
+			for _ in range(transitions):
+				actions = [action(rnd.choice(dfa_tokens)) for _ in range(rnd.randint(0, 3))]
+				trans.append(ir.Transition(source=source, destination=rnd.choice(dfa_states),
+				                           trigger=trigger(), actions=actions))
+		result.append(ir.DFA(start=dfa_states[0], states=dfa_states, transitions=trans))
+	return ir.Decoder(inputs=channels, outputs=tokens[:outputs], dfas=result)
+
+def random_trace(channels, samples=1000, toggle=0.1, seed=0):
+	""" one list of `samples` values per channel, every value changes with
+	    probability `toggle` and fits into the width of its channel """
+	rnd = random.Random(seed)
+	columns = []
+	for ch in channels:
+		value, column = 0, []
+		for _ in range(samples):
+			if rnd.random() < toggle:
+				if ch.width == 1: value = 1 - value
+				else: value = 0 if rnd.random() < 0.3 else rnd.randrange(1 << ch.width)
+			column.append(value)
+		columns.append(column)
+	return columns
+
+def random_funcdef(ir, width=100, depth=3, expr_depth=4, nesting=0.2, seed=0):
+	""" FuncDef with `width` statements per block, blocks nested up to
+	    `depth` levels (through If and For) and expressions of up to
+	    `expr_depth` levels, which type checks without errors.
+	    A fraction `nesting` of the statements opens a nested block, the
+	    last statement of every block above `depth` always does. """
+	rnd = random.Random(seed)
+	# names of scalars that are declared before the current statement
+	scalars = ["b", "c", "flag"]
+	counter = [0]
+	def leaf():
+		kind = rnd.random()
+		if kind < 0.2: return ir.IntConst(val=rnd.randint(-10, 10))
+		if kind < 0.3: return ir.FloatConst(val=rnd.random())
+		if kind < 0.4: return ir.BoolConst(val=rnd.random() < 0.5)
+		if kind < 0.6: return ir.Ref(name="a", index=ir.IntConst(val=rnd.randint(0, 15)))
+		return ir.Ref(name=rnd.choice(scalars))
+	def expr(depth):
+		if depth <= 0 or rnd.random() < 0.2: return leaf()
+		kind = rnd.random()
+		if kind < 0.15: return ir.UnOp(op=rnd.choice(list(ir.Uop)), e=expr(depth - 1))
+		if kind < 0.3: return ir.CmpOp(op=rnd.choice(list(ir.Cop)), left=expr(depth - 1), right=leaf())
+		if kind < 0.4:
+			# And/Or are not defined on Float, thus only combine comparisons
+			compare = lambda: ir.CmpOp(op=rnd.choice(list(ir.Cop)), left=expr(depth - 2), right=leaf())
+			return ir.BinOp(op=rnd.choice([ir.Bop.And, ir.Bop.Or]), left=compare(), right=compare())
+		op = rnd.choice([ir.Bop.Add, ir.Bop.Sub, ir.Bop.Mul])
+		return ir.BinOp(op=op, left=expr(depth - 1), right=expr(depth - 1) if rnd.random() < 0.3 else leaf())
+	def assign():
+		if rnd.random() < 0.2:
+			# `a` is an IntArray, thus only Int values can be stored
+			index = ir.CastToInt(expr=leaf())
+			return ir.Assign(ref=ir.Ref(name="a", index=index), val=ir.CastToInt(expr=expr(expr_depth)))
+		# every scalar is assigned exactly once, thus it can have any type
+		counter[0] += 1
+		name = "v{}".format(counter[0])
+		stmt = ir.Assign(ref=ir.Ref(name=name), val=expr(expr_depth))
+		scalars.append(name)
+		return stmt
+	def block(level):
+		body = []
+		for ii in range(width):
+			kind = rnd.random()
+			if level < depth and kind < nesting / 2:
+				body.append(ir.If(cond=ir.CmpOp(op=rnd.choice(list(ir.Cop)), left=expr(2), right=leaf()),
+				                  body=block(level + 1),
+				                  elseBody=block(level + 1) if rnd.random() < 0.5 else None))
+			elif level < depth and (kind < nesting or ii == width - 1):
+				body.append(ir.For(var="i", min=ir.IntConst(val=0), max=ir.Ref(name="b"),
+				                   body=block(level + 1)))
+			else:
+				body.append(assign())
+		return ir.Block(body=body)
+	body = block(0)
+	body = body.set(body=body.body + [ir.Return(val=ir.CastToInt(expr=expr(expr_depth)))])
+	return ir.FuncDef(name="f", args=["a", "b", "c", "flag"],
+	                  arg_types=[ir.Type.IntArray, ir.Type.Int, ir.Type.Float, ir.Type.Bool],
+	                  body=body, return_type=ir.Type.Int)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# measures the memory footprint of a large ir.Decoder with __dict__ based,
+# compact (slot based) and compact + interned node storage
+
+import tracemalloc, types, typing
+import util.typed as typed
+import midend.ir as ir
+
+def clone_ir(module, compact, interned):
+	""" recreates all Node classes of `module` with the given storage mode,
+	    `interned` keeps the interning settings of `module` if True """
+	clones = {}
+	def remap(tt):
+		if isinstance(tt, typed.Optional): return typed.Optional(remap(tt.field_type))
+		if typed._is_list_type(tt): return typing.List[remap(typed._get_list_element_type(tt))]
+		if typed._is_set_type(tt): return typing.Set[remap(typed._get_list_element_type(tt))]
+		return clones.get(tt, tt)
+	for name, cls in vars(module).items():
+		if not isinstance(cls, type) or not issubclass(cls, typed.Node) or cls is typed.Node:
+			continue
+		bases = tuple(clones.get(b, b) for b in cls.__bases__)
+		namespace = {n: remap(tt) for n, tt in typed.get_fields_of_class(cls)}
+		namespace['__module__'] = cls.__module__
+		clones[cls] = typed.NodeMeta(name, bases, namespace, compact=compact,
+		                             interned=interned and cls._interned)
+	ns = types.SimpleNamespace(**{cls.__name__: cc for cls, cc in clones.items()})
+	ns.Edge = module.Edge
+	return ns
+
+def make_decoder(ir, dfa_count=200, state_count=20, transitions_per_state=4):
+	inputs = [ir.Channel(width=1, name="in{}".format(ii)) for ii in range(8)]
+	outputs = [ir.Token(width=8, has_duration=False) for _ in range(4)]
+	dfas = []
+	for dd in range(dfa_count):
+		states = [ir.State() for _ in range(state_count)]
+		transitions = []
+		for ss, state in enumerate(states):
+			for tt in range(transitions_per_state):
+				ch = inputs[(dd + ss + tt) % len(inputs)]
+				tok = outputs[tt % len(outputs)]
+				trigger = ir.InternalEvent(
+					trigger=ir.ExternalEvent(edge=ir.Edge.Rising, channel=ch),
+					guard=ir.High(channel=ch))
+				actions = [ir.Append(token=tok, channel=ch), ir.Emit(token=tok)]
+				transitions.append(ir.Transition(source=state,
+					destination=states[(ss + tt + 1) % state_count],
+					trigger=trigger, actions=actions))
+		dfas.append(ir.DFA(start=states[0], states=states, transitions=transitions))
+	return ir.Decoder(inputs=inputs, outputs=outputs, dfas=dfas)
+
+def measure(ir):
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	decoder = make_decoder(ir)
+	size = tracemalloc.get_traced_memory()[0] - before
+	tracemalloc.stop()
+	return size, decoder
+
+def count_nodes(node):
+	seen = set()
+	todo = [node]
+	while todo:
+		nn = todo.pop()
+		if id(nn) in seen: continue
+		seen.add(id(nn))
+		for name in nn._fields:
+			value = getattr(nn, name)
+			values = value if isinstance(value, list) else [value]
+			todo += [vv for vv in values if isinstance(vv, typed.Node)]
+	return len(seen)
+
+def main():
+	modes = [("dict", False, False), ("compact", True, False), ("interned", True, True)]
+	baseline = None
+	for label, compact, interned in modes:
+		size, decoder = measure(clone_ir(ir, compact, interned))
+		baseline = baseline or size
+		nodes = count_nodes(decoder)
+		print("{:<8} {:>8} nodes {:>10.1f} KiB {:>8.1f} B/node  saved {:5.1f}%".format(
+			label, nodes, size / 1024, size / nodes, 100 * (1 - size / baseline)))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# rewrites a large FuncDef in which only a few constants change and
+# compares copy-on-write `map` against rebuilding every node
+
+import ast, time, tracemalloc
+import irtypes as ir
+
+def make_funcdef(statements=20000):
+	body = []
+	for ii in range(statements):
+		val = ir.BinOp(op=ir.Bop.Add,
+			left=ir.Ref(name="a", index=ir.IntConst(val=ii)),
+			right=ir.BinOp(op=ir.Bop.Mul, left=ir.Ref(name="b"), right=ir.IntConst(val=ii + 1)))
+		body.append(ir.Assign(ref=ir.Ref(name="x{}".format(ii % 64)), val=val))
+	return ir.FuncDef(name="f", args=["a", "b"], arg_types=[ir.Type.IntArray, ir.Type.Int],
+	                  body=ir.Block(body=body), return_type=ir.Type.Void)
+
+class ReplaceConst(ast.NodeVisitor):
+	""" replaces every IntConst(`old`) with IntConst(`new`) """
+	def __init__(self, old, new, rebuild):
+		self.old, self.new, self.rebuild = old, new, rebuild
+	def visit_IntConst(self, node):
+		return ir.IntConst(val=self.new) if node.val == self.old else node
+	def generic_visit(self, node):
+		new = node.map(self.visit, [ir.Stmt, ir.Expr])
+		if self.rebuild:
+			# what `map` used to do: always construct a new node
+			new = new.__class__(**{name: getattr(new, name) for name in new._fields})
+		return new
+
+def count_nodes(node, seen=None):
+	seen = set() if seen is None else seen
+	if id(node) in seen: return seen
+	seen.add(id(node))
+	for _, value in ast.iter_fields(node):
+		for vv in (value if isinstance(value, list) else [value]):
+			if isinstance(vv, ast.AST): count_nodes(vv, seen)
+	return seen
+
+def run(fun, rebuild):
+	tracemalloc.start()
+	start = time.perf_counter()
+	result = ReplaceConst(old=7, new=8, rebuild=rebuild).visit(fun)
+	duration = time.perf_counter() - start
+	allocated = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return result, duration, allocated
+
+def main():
+	fun = make_funcdef()
+	before = count_nodes(fun)
+	print("{} nodes".format(len(before)))
+	for rebuild in (True, False):
+		result, duration, allocated = run(fun, rebuild)
+		new_nodes = len(count_nodes(result) - before)
+		print("{:<14} {:8.1f} ms {:10.1f} KiB peak {:8} new nodes".format(
+			"rebuild" if rebuild else "copy-on-write", duration * 1e3, allocated / 1024, new_nodes))
+
+if __name__ == '__main__':
+	import sys
+	sys.setrecursionlimit(10000)
+	main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# times construction, rewriting and the passes on seeded random IR
+#
+#   suite.py --size small --output before.json
+#   suite.py --size small --output after.json --compare before.json
+#
+# Every benchmark reports the best and the median of `--repeat` runs and the
+# peak memory allocated by one additional run (traced by tracemalloc).
+
+import argparse, json, os, platform, statistics, subprocess, sys, time, tracemalloc
+import util.typed as typed
+import midend.ir as dsl
+import midend.passes as passes
+import irtypes as ir
+import typed as kast
+from typechecker import TypeChecker
+from simplify import Simplifier
+from dataflow import DeadAssignmentElimination
+from loops import LoopOptimizer
+from generators import random_decoder, random_funcdef
+
+sizes = {
+	'small':  {'dfas':  20, 'states': 10, 'transitions': 3, 'width':  10, 'depth': 2, 'expr_depth': 3, 'nested': 100},
+	'medium': {'dfas': 100, 'states': 20, 'transitions': 4, 'width':  16, 'depth': 3, 'expr_depth': 4, 'nested': 300},
+	'large':  {'dfas': 400, 'states': 40, 'transitions': 4, 'width':  24, 'depth': 3, 'expr_depth': 6, 'nested': 600},
+}
+
+class IdentityTransformer(typed.Transformer):
+	# rebuilds nothing, measures the cost of a full copy-on-write traversal
+	pass
+
+class NegateConsts(kast.Transformer):
+	def visit_IntConst(self, node):
+		return node.set(val=-node.val)
+
+def benchmarks(size, seed):
+	""" name -> (setup, run), `run` receives the result of `setup` """
+	dd = dict(dfas=size['dfas'], states=size['states'], transitions=size['transitions'], seed=seed)
+	ff = dict(width=size['width'], depth=size['depth'], expr_depth=size['expr_depth'], seed=seed)
+	def decoder(): return random_decoder(dsl, **dd)
+	def funcdef(): return random_funcdef(ir, **ff)
+	def with_state():
+		dec = decoder()
+		return dec, passes.StateInfoPass(dec)
+	def wide(): return random_funcdef(ir, **dict(ff, width=ff['width'] * 20, depth=0))
+	def deep(): return random_funcdef(ir, **dict(ff, width=2, depth=size['nested'], nesting=0))
+	def checked(): return TypeChecker.analyze(funcdef())[0]
+	def checked_wide(): return TypeChecker.analyze(wide())
+	def set_all(root):
+		# replaces the name of every node by itself
+		for node in typed.walk(root):
+			node.set(name=node.name)
+	return {
+		'construct.decoder':     (lambda: None, lambda _: decoder()),
+		'construct.funcdef':     (lambda: None, lambda _: funcdef()),
+		'rewrite.set_noop':      (decoder, set_all),
+		'rewrite.map_identity':  (decoder, lambda dec: IdentityTransformer().visit(dec)),
+		'rewrite.map_consts':    (checked, lambda fun: NegateConsts().visit(fun)),
+		'pass.state_info':       (decoder, lambda dec: passes.StateInfoPass(dec)),
+		'pass.dead_code':        (with_state, lambda args: passes.DeadCodeEliminationPass(*args)),
+		'pass.minimize':         (with_state, lambda args: passes.MinimizeDFAPass(*args)),
+		'pass.simplify':         (checked, Simplifier.run),
+		'pass.loops':            (checked, LoopOptimizer.run),
+		'pass.dead_assignments': (checked_wide, lambda args: DeadAssignmentElimination.run(*args)),
+		'typecheck.funcdef':     (funcdef, TypeChecker.analyze),
+		'typecheck.wide':        (wide, TypeChecker.analyze),
+		'typecheck.deep':        (deep, TypeChecker.analyze),
+	}
+
+def measure(setup, run, repeat):
+	times = []
+	for _ in range(repeat):
+		arg = setup()
+		start = time.perf_counter()
+		run(arg)
+		times.append(time.perf_counter() - start)
+	arg = setup()
+	tracemalloc.start()
+	try:
+		run(arg)
+		peak = tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+	return {'best': min(times), 'median': statistics.median(times), 'peak_bytes': peak, 'repeat': repeat}
+
+def git_commit():
+	try:
+		out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+		                     cwd=os.path.dirname(os.path.abspath(__file__)))
+	except OSError:
+		return None
+	return out.stdout.strip() or None
+
+def run_suite(size='small', seed=0, repeat=5, select=None):
+	results = {}
+	for name, (setup, run) in benchmarks(sizes[size], seed).items():
+		if select and not any(ss in name for ss in select): continue
+		results[name] = measure(setup, run, repeat)
+		print("{:<24} {:10.2f} ms {:10.2f} ms {:10.1f} KiB".format(
+			name, results[name]['best'] * 1e3, results[name]['median'] * 1e3,
+			results[name]['peak_bytes'] / 1024), file=sys.stderr)
+	return {'commit': git_commit(), 'python': platform.python_version(),
+	        'size': size, 'seed': seed, 'results': results}
+
+def compare(new, old, out=sys.stderr):
+	""" prints the ratio new/old of the best times and the peak memory """
+	if (new['size'], new['seed']) != (old['size'], old['seed']):
+		print("warning: comparing size {} seed {} to size {} seed {}".format(
+			new['size'], new['seed'], old['size'], old['seed']), file=out)
+	print("{:<24} {:>10} {:>10}   ({} vs {})".format("", "time", "memory", new['commit'], old['commit']), file=out)
+	for name, nn in new['results'].items():
+		oo = old['results'].get(name)
+		if oo is None:
+			print("{:<24} {:>10}".format(name, "new"), file=out)
+			continue
+		print("{:<24} {:9.2f}x {:9.2f}x".format(name, nn['best'] / oo['best'],
+			nn['peak_bytes'] / oo['peak_bytes'] if oo['peak_bytes'] else float('nan')), file=out)
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--size', choices=sorted(sizes), default='small')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--repeat', type=int, default=5)
+	parser.add_argument('--select', action='append', help="only run benchmarks containing this string")
+	parser.add_argument('--output', help="write the results as JSON to this file")
+	parser.add_argument('--compare', help="JSON results of an earlier run")
+	args = parser.parse_args()
+	report = run_suite(args.size, args.seed, args.repeat, args.select)
+	if args.output:
+		with open(args.output, 'w') as ff:
+			json.dump(report, ff, indent=1, sort_keys=True)
+	else:
+		json.dump(report, sys.stdout, indent=1, sort_keys=True)
+		print()
+	if args.compare:
+		with open(args.compare) as ff:
+			compare(report, json.load(ff))
+
+if __name__ == '__main__':
+	main()
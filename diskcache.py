@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# persistent, content addressed cache for the results of passes
+#
+#	cache = DiskCache(".ircache", max_bytes=1 << 30)
+#	new_root = cache.cached('simplify', 1, root, lambda: simplify(root))
+#
+# The key of an entry is a hash over the typed.content_hash of the input
+# tree, the name of the pass and its version, thus a pass needs a new
+# version whenever its output changes. Every entry is a file in
+# `directory` named after its key. Entries are written to a temporary file
+# first and then renamed, thus other processes only ever see complete
+# entries. If several processes store the same entry, the last one wins,
+# which does not matter since they all computed the same result.
+# Loading an entry updates its modification time and the least recently
+# used entries are removed whenever the cache grows beyond `max_bytes`.
+# Results are stored in the format of serialize by default, which keeps
+# shared subtrees shared and handles trees of any depth, other results
+# need their own `encode` and `decode`.
+
+import enum, hashlib, os, tempfile, weakref
+import util.typed as typed
+import util.serialize as serialize
+
+class Mode(enum.Enum):
+	Use = 'use'
+	# neither load nor store entries
+	Bypass = 'bypass'
+	# always recompute and raise a CacheMismatch if a stored entry differs
+	Verify = 'verify'
+
+class CacheMismatch(Exception):
+	pass
+
+def _load_root(data):
+	return serialize.loads(data).root
+
+def _is_key(name):
+	return len(name) == 64 and all(cc in '0123456789abcdef' for cc in name)
+
+class DiskCache:
+	""" `mode` is a Mode or its value, e.g. taken from the command line """
+	def __init__(self, directory, max_bytes=1 << 30, mode=Mode.Use):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.mode = Mode(mode)
+		self.hits = 0
+		self.misses = 0
+		self.verified = 0
+		# nodes never change, thus their hashes can be kept
+		self._hashes = weakref.WeakKeyDictionary()
+		os.makedirs(directory, exist_ok=True)
+		# estimate, other processes may add and remove entries at any time
+		self._size = self.size()
+		if self._size > self.max_bytes:
+			self.evict()
+
+	def content_hash(self, root):
+		digest = self._hashes.get(root)
+		if digest is None:
+			digest = self._hashes[root] = typed.content_hash(root)
+		return digest
+
+	def key(self, root, name, version, extra=()):
+		""" key of the result of pass `name` in `version` on `root`, `extra`
+		    can hold further (repr-stable) arguments of the pass """
+		parts = [self.content_hash(root), name, str(version)] + [repr(ee) for ee in extra]
+		return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+	def _path(self, key):
+		return os.path.join(self.directory, key)
+
+	def _entries(self):
+		""" (path, size, mtime) of all entries """
+		entries = []
+		for entry in os.scandir(self.directory):
+			if not _is_key(entry.name): continue
+			try:
+				st = entry.stat()
+			except FileNotFoundError:
+				continue
+			entries.append((entry.path, st.st_size, st.st_mtime))
+		return entries
+
+	def size(self):
+		return sum(size for _, size, _ in self._entries())
+
+	def load(self, key):
+		""" data stored under `key` or None """
+		path = self._path(key)
+		try:
+			with open(path, 'rb') as ff:
+				data = ff.read()
+			os.utime(path)
+		except FileNotFoundError:
+			return None
+		return data
+
+	def store(self, key, data):
+		fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+		try:
+			with os.fdopen(fd, 'wb') as ff:
+				ff.write(data)
+			os.replace(tmp, self._path(key))
+		except BaseException:
+			os.unlink(tmp)
+			raise
+		self._size += len(data)
+		if self._size > self.max_bytes:
+			self.evict()
+
+	def evict(self):
+		""" removes the least recently used entries until the cache fits """
+		entries = sorted(self._entries(), key=lambda ee: ee[2])
+		total = sum(size for _, size, _ in entries)
+		for path, size, _ in entries:
+			if total <= self.max_bytes: break
+			try:
+				os.unlink(path)
+			except FileNotFoundError:
+				pass
+			total -= size
+		self._size = total
+
+	def clear(self):
+		for path, _, _ in self._entries():
+			try:
+				os.unlink(path)
+			except FileNotFoundError:
+				pass
+		self._size = 0
+
+	def cached(self, name, version, root, compute, encode=serialize.dumps, decode=_load_root, extra=()):
+		""" result of `compute()`, the result of pass `name` on `root`, which
+		    is loaded from the cache if possible """
+		if self.mode == Mode.Bypass:
+			return compute()
+		key = self.key(root, name, version, extra)
+		data = self.load(key)
+		if self.mode == Mode.Verify:
+			result = compute()
+			fresh = encode(result)
+			if data is not None:
+				if data != fresh:
+					raise CacheMismatch("cached result of {} (version {}) differs, entry {}".format(
+						name, version, self._path(key)))
+				self.verified += 1
+			else:
+				self.store(key, fresh)
+			return result
+		if data is not None:
+			try:
+				result = decode(data)
+			except Exception:
+				# e.g. written by an incompatible version of the IR classes,
+				# the entry is replaced below
+				pass
+			else:
+				self.hits += 1
+				return result
+		self.misses += 1
+		result = compute()
+		self.store(key, encode(result))
+		return result
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# generates specialized Python code for online decoding, one sample at a time
+#
+#	step = compile_decoder(decoder)
+#	for sample in live_samples():
+#		for token in step(sample):
+#			print(token)
+#
+# `step` receives the values of all channels in `decoder.inputs` and
+# returns the list of tokens emitted at this sample. The semantics are the
+# ones of midend.simulate. Every dfa becomes one `if` per state with one
+# branch per outgoing transition and the events and conditions are inlined
+# as expressions over the current and previous channel values. All state
+# lives in local variables of a closure: the current state and the time it
+# was entered per dfa and the value and start time per token. Token values
+# are masked to the token width after every Append, thus they never grow.
+
+import midend.ir as ir
+import util.typed as typed
+from midend.simulate import Emitted, _delay
+
+def decoder_hash(decoder):
+	""" hash of the structure of `decoder`, equal for equal decoders """
+	return typed.content_hash(decoder)
+
+def _states(dfa):
+	states = list(dfa.states)
+	for tran in dfa.transitions:
+		for state in (tran.source, tran.destination):
+			if not any(state is ss for ss in states): states.append(state)
+	return states
+
+class DecoderCodegen:
+	""" Python source of a module that defines `make(Emitted, tokens, initial)`,
+	    which returns a new `step` function """
+	def __init__(self, decoder):
+		assert isinstance(decoder, ir.Decoder)
+		self.decoder = decoder
+		self.inputs = {ch: ii for ii, ch in enumerate(decoder.inputs)}
+		# token -> index into the `tokens` argument of make
+		self.tokens = {}
+		self.lines = []
+
+	def channel(self, channel):
+		if channel not in self.inputs:
+			raise KeyError("channel {} is not an input of the decoder".format(channel))
+		return self.inputs[channel]
+
+	def token(self, token):
+		return self.tokens.setdefault(token, len(self.tokens))
+
+	def emit(self, indent, line):
+		self.lines.append("\t" * indent + line)
+
+	def event(self, event, dd):
+		if isinstance(event, ir.ExternalEvent):
+			cc = self.channel(event.channel)
+			if event.edge == ir.Edge.Rising:
+				return "(c{0} and not p{0})".format(cc)
+			return "(p{0} and not c{0})".format(cc)
+		if isinstance(event, ir.DelayedEvent):
+			_delay(event)
+			return "(now - e{} == {})".format(dd, event.cycles)
+		if isinstance(event, ir.InternalEvent):
+			if event.guard is None: return self.event(event.trigger, dd)
+			return "({} and {})".format(self.event(event.trigger, dd), self.condition(event.guard))
+		if isinstance(event, ir.Sample):
+			return self.event(event.trigger, dd)
+		raise NotImplementedError("cannot generate code for events of type {}".format(type(event)))
+
+	def condition(self, cond):
+		if isinstance(cond, ir.High): return "c{}".format(self.channel(cond.channel))
+		if isinstance(cond, ir.Low): return "(not c{})".format(self.channel(cond.channel))
+		if isinstance(cond, ir.ConstantCondition): return repr(cond.value)
+		if isinstance(cond, ir.ConditionBinOp):
+			assert cond.op == ir.Bop.And
+			return "({} and {})".format(self.condition(cond.left), self.condition(cond.right))
+		raise NotImplementedError("cannot generate code for conditions of type {}".format(type(cond)))
+
+	def action(self, indent, action):
+		tt = self.token(action.token)
+		mask = (1 << action.token.width) - 1
+		if isinstance(action, ir.Append):
+			width = action.channel.width
+			self.emit(indent, "if b{0} is None: b{0} = now".format(tt))
+			self.emit(indent, "v{0} = ((v{0} << {1}) | (c{2} & {3})) & {4}".format(
+				tt, width, self.channel(action.channel), (1 << width) - 1, mask))
+		elif isinstance(action, ir.Emit):
+			self.emit(indent, "out.append(Emitted(t{0}, v{0}, now if b{0} is None else b{0}, now))".format(tt))
+			self.emit(indent, "v{0} = 0; b{0} = None".format(tt))
+		elif isinstance(action, ir.Start):
+			self.emit(indent, "v{0} = 0; b{0} = now".format(tt))
+		elif isinstance(action, ir.Reset):
+			self.emit(indent, "v{0} = 0; b{0} = None".format(tt))
+		else:
+			raise NotImplementedError("cannot generate code for actions of type {}".format(type(action)))
+
+	def dfa(self, indent, dd, dfa):
+		states = _states(dfa)
+		index = {id(ss): ii for ii, ss in enumerate(states)}
+		outgoing = [[] for _ in states]
+		for tran in dfa.transitions:
+			outgoing[index[id(tran.source)]].append(tran)
+		# the time a state was entered only matters for DelayedEvents
+		timed = any(_delay(tran.trigger) is not None for tran in dfa.transitions)
+		keyword = "if"
+		for ss, transitions in enumerate(outgoing):
+			if not transitions: continue
+			self.emit(indent, "{} s{} == {}:".format(keyword, dd, ss))
+			keyword = "elif"
+			for ii, tran in enumerate(transitions):
+				self.emit(indent + 1, "{} {}:".format("if" if ii == 0 else "elif", self.event(tran.trigger, dd)))
+				self.emit(indent + 2, "s{} = {}".format(dd, index[id(tran.destination)]) +
+				          ("; e{} = now".format(dd) if timed else ""))
+				for action in tran.actions:
+					self.action(indent + 2, action)
+
+	def generate(self):
+		""" returns the source code """
+		decoder = self.decoder
+		channels = range(len(decoder.inputs))
+		dfas = range(len(decoder.dfas))
+		body = []
+		self.lines, lines = body, self.lines
+		for dd, dfa in enumerate(decoder.dfas):
+			self.emit(2, "# dfa {}{}".format(dd, "" if dfa.name is None else " " + dfa.name))
+			self.dfa(2, dd, dfa)
+		self.lines = lines
+		tokens = range(len(self.tokens))
+		local = (["now"] + ["p{}".format(cc) for cc in channels] + ["s{}".format(dd) for dd in dfas] +
+		         ["e{}".format(dd) for dd in dfas] + ["v{}".format(tt) for tt in tokens] +
+		         ["b{}".format(tt) for tt in tokens])
+		starts = [_states(dfa).index(dfa.start) for dfa in decoder.dfas]
+		self.emit(0, "def make(Emitted, tokens, initial):")
+		for tt in tokens:
+			self.emit(1, "t{} = tokens[{}]".format(tt, tt))
+		self.emit(1, "now = -1")
+		for cc in channels:
+			self.emit(1, "p{} = initial[{}]".format(cc, cc))
+		for dd in dfas:
+			self.emit(1, "s{} = {}; e{} = 0".format(dd, starts[dd], dd))
+		for tt in tokens:
+			self.emit(1, "v{} = 0; b{} = None".format(tt, tt))
+		self.emit(1, "def step(samples):")
+		self.emit(2, "nonlocal {}".format(", ".join(local)))
+		if channels:
+			unpack = ", ".join("c{}".format(cc) for cc in channels)
+			self.emit(2, "{}{} = samples".format(unpack, "," if len(channels) == 1 else ""))
+		self.emit(2, "now += 1")
+		self.emit(2, "out = []")
+		self.lines += body
+		for cc in channels:
+			self.emit(2, "p{0} = c{0}".format(cc))
+		self.emit(2, "return out")
+		self.emit(1, "return step")
+		return "\n".join(self.lines) + "\n"
+
+class DecoderCompiler:
+	""" compiles decoders to `step` functions
+
+	The generated code is cached by `decoder_hash`, thus it is only
+	generated and compiled once for structurally equal decoders. Every call
+	of `compile` returns a new `step` function with its own state.
+	"""
+	codegen = DecoderCodegen
+	def __init__(self):
+		self.cache = {}
+		self.compiled = 0
+	def source(self, decoder):
+		return self.codegen(decoder).generate()
+	def _make(self, decoder):
+		key = decoder_hash(decoder)
+		entry = self.cache.get(key)
+		if entry is None:
+			gen = self.codegen(decoder)
+			code = compile(gen.generate(), "<decoder {}>".format(key[:12]), "exec")
+			namespace = {}
+			exec(code, namespace)
+			entry = self.cache[key] = (namespace['make'], gen)
+			self.compiled += 1
+		return entry
+	def compile(self, decoder, initial=None):
+		""" `step` function that starts in the start states, with all
+		    channels at `initial` (default: 0) before the first sample """
+		make, gen = self._make(decoder)
+		# the cached code may belong to an equal decoder with other Token objects
+		tokens = [None] * len(gen.tokens)
+		for dfa, own in zip(gen.decoder.dfas, decoder.dfas):
+			for tran, own_tran in zip(dfa.transitions, own.transitions):
+				for action, own_action in zip(tran.actions, own_tran.actions):
+					tokens[gen.tokens[action.token]] = own_action.token
+		initial = [0] * len(decoder.inputs) if initial is None else list(initial)
+		if len(initial) != len(decoder.inputs):
+			raise ValueError("expected {} initial values, got {}".format(len(decoder.inputs), len(initial)))
+		return make(Emitted, tokens, initial)
+	def clear(self):
+		self.cache.clear()
+
+default_compiler = DecoderCompiler()
+
+def compile_decoder(decoder, initial=None):
+	""" `step(samples)` function that decodes one sample at a time """
+	return default_compiler.compile(decoder, initial)
@@ -17,7 +17,7 @@ class DebugInfo:
 		self.col = col
 
 
-class Node(typed.Node):
+class Node(typed.Node, compact=True):
 	name = typed.Optional(str)
 	dbg = typed.Optional(DebugInfo)
 
@@ -27,7 +27,9 @@ class Channel(Node):
 	width = int
 
 ################################################################################
-class Condition(Node):
+# conditions, external events and actions are plain values and thus
+# shared between all structurally equal instances
+class Condition(Node, interned=True):
 	pass
 class High(Condition):
 	channel = Channel
@@ -59,7 +61,7 @@ class Edge(Enum):
 	Rising = 0
 	Falling = 1
 
-class ExternalEvent(Event):
+class ExternalEvent(Event, interned=True):
 	edge = Edge
 	channel = Channel
 
@@ -80,7 +82,7 @@ class Token(Node):
 	width = int
 	has_duration = bool
 
-class Action(Node):
+class Action(Node, interned=True):
 	token = Token
 
 class Start(Action): pass
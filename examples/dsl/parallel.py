@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# runs the per-DFA parts of midend passes in a process pool
+#
+# The decoder is sent to every worker once, in the util.serialize format.
+# Workers only materialize the DFAs they are asked to process. Results are
+# pickled with all nodes of the original decoder replaced by their index,
+# thus only new nodes are transferred and the merged result refers to the
+# original nodes, exactly like the result of the serial pass.
+
+import concurrent.futures, io, pickle
+import util.typed as typed
+import util.serialize as serialize
+import midend.ir as ir
+import midend.passes as passes
+
+class _NodePickler(pickle.Pickler):
+	def __init__(self, file, index_of):
+		super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+		self.index_of = index_of
+	def persistent_id(self, obj):
+		if isinstance(obj, typed.Node):
+			return self.index_of(obj)
+		return None
+
+class _NodeUnpickler(pickle.Unpickler):
+	def __init__(self, file, nodes):
+		super().__init__(file)
+		self.nodes = nodes
+	def persistent_load(self, pid):
+		return self.nodes[pid]
+
+def _dumps(obj, index_of):
+	out = io.BytesIO()
+	_NodePickler(out, index_of).dump(obj)
+	return out.getvalue()
+
+def _loads(data, nodes):
+	return _NodeUnpickler(io.BytesIO(data), nodes).load()
+
+# state of a worker process
+_reader = None
+
+def _init_worker(data):
+	global _reader
+	_reader = serialize.loads(data)
+
+def _run_chunk(fun, dfa_indices, args):
+	dfas = [_reader.node(ii) for ii in dfa_indices]
+	result = fun(dfas, _reader.view(), *args)
+	return _dumps(result, _reader.index_of)
+
+class ParallelDriver:
+	""" maps a function over chunks of the dfas of a decoder
+
+	`fun(dfas, decoder, *args)` receives a list of consecutive dfas and the
+	decoder, which in a worker is a serialize.NodeView (use
+	serialize.materialize to obtain nodes from it). It needs to be a module
+	level function and its result needs to be picklable.
+	With `max_workers=1` everything runs in the calling process.
+	"""
+	def __init__(self, max_workers=None, chunk_size=64):
+		self.max_workers = max_workers
+		self.chunk_size = chunk_size
+
+	def _chunks(self, items):
+		return [items[ii:ii + self.chunk_size] for ii in range(0, len(items), self.chunk_size)]
+
+	def map_dfas(self, decoder, fun, *args):
+		""" returns the results of `fun` for all chunks, in order """
+		assert isinstance(decoder, ir.Decoder)
+		if self.max_workers == 1:
+			return [fun(chunk, decoder, *args) for chunk in self._chunks(decoder.dfas)]
+		nodes = serialize.node_order(decoder)
+		index = {id(node): ii for ii, node in enumerate(nodes)}
+		data = serialize.dumps(decoder)
+		chunks = self._chunks([index[id(dfa)] for dfa in decoder.dfas])
+		with concurrent.futures.ProcessPoolExecutor(
+				max_workers=self.max_workers, initializer=_init_worker, initargs=(data,)) as pool:
+			futures = [pool.submit(_run_chunk, fun, chunk, args) for chunk in chunks]
+			return [_loads(ff.result(), nodes) for ff in futures]
+
+################################################################################
+# parallel versions of the midend passes
+
+def _state_info_chunk(dfas, decoder):
+	return passes.StateInfoPass.analyze_dfas(dfas)
+
+def _dead_code_chunk(dfas, decoder):
+	outputs = [serialize.materialize(tok) for tok in decoder.outputs]
+	return passes.DeadCodeEliminationPass.eliminate_dfas(dfas, outputs)
+
+def state_info(decoder, driver):
+	results = driver.map_dfas(decoder, _state_info_chunk)
+	return passes.StateInfoPass(decoder, dfa_results=[rr for chunk in results for rr in chunk])
+
+def dead_code_elimination(decoder, driver, state=None):
+	if state is None: state = state_info(decoder, driver)
+	results = driver.map_dfas(decoder, _dead_code_chunk)
+	return passes.DeadCodeEliminationPass(decoder, state, dfa_results=results)
@@ -8,57 +8,129 @@
 
 # some midend passes
 
-import ast, re
+import pickle, re
 import util.typed as typed
 import util.meta as meta
+import util.passmanager as passmanager
 import midend.ir as ir
 from typing import List, Set
 
-class StateInfoPass(ast.NodeVisitor):
+class StateInfoPass(typed.Visitor):
 	# tags transitions with their source state
-	def __init__(self, start_node):
-		self.outgoing = meta.MetaDataField('outgoing', ir.State, List[ir.Transition], readonly=False)
-		self.incoming = meta.MetaDataField('incoming', ir.State, List[ir.Transition], readonly=False)
-		self.dfa      = meta.MetaDataField('dfa', ir.State, ir.DFA, readonly=False)
-		self.visit(start_node)
+	# `dfa_results` are the results of `analyze_dfas` for all dfas of the
+	# decoder `start_node`, e.g. computed by midend.parallel
+	def __init__(self, start_node, dfa_results=None):
+		# the entries refer back to their states, thus they are stored weakly
+		self.outgoing = meta.MetaDataField('outgoing', ir.State, List[ir.Transition], readonly=False, storage='weak')
+		self.incoming = meta.MetaDataField('incoming', ir.State, List[ir.Transition], readonly=False, storage='weak')
+		self.dfa      = meta.MetaDataField('dfa', ir.State, ir.DFA, readonly=False, storage='weak')
+		if dfa_results is None:
+			self.visit(start_node)
+		else:
+			assert len(dfa_results) == len(start_node.dfas)
+			for dfa, states in zip(start_node.dfas, dfa_results):
+				self._record(dfa, states)
 		self.outgoing.readonly = True
 		self.incoming.readonly = True
 		self.dfa.readonly = True
+	@staticmethod
+	def analyze_dfas(dfas):
+		""" part of the analysis that only depends on a single DFA: returns a
+		    list of (state, outgoing, incoming) for every dfa """
+		return [StateInfoPass._analyze(dfa) for dfa in dfas]
+	@staticmethod
+	def _analyze(dfa):
+		assert dfa.start in dfa.states
+		states = {id(state): (state, [], []) for state in dfa.states}
+		for tran in dfa.transitions:
+			states.setdefault(id(tran.source), (tran.source, [], []))[1].append(tran)
+			states.setdefault(id(tran.destination), (tran.destination, [], []))[2].append(tran)
+		return list(states.values())
+	def encode(self, decoder):
+		""" bytes that `decode` turns back into this analysis of `decoder`,
+		    nodes are stored as indices into the dfas """
+		dfas = []
+		for dfa in decoder.dfas:
+			transitions = {id(tran): ii for ii, tran in enumerate(dfa.transitions)}
+			# states that are not in dfa.states are found through their transitions
+			where = {id(ss): ('s', ii) for ii, ss in reversed(list(enumerate(dfa.states)))}
+			for ii, tran in enumerate(dfa.transitions):
+				where.setdefault(id(tran.source), ('src', ii))
+				where.setdefault(id(tran.destination), ('dst', ii))
+			dfas.append([(where[id(state)], [transitions[id(tt)] for tt in outgoing],
+			              [transitions[id(tt)] for tt in incoming])
+			             for state, outgoing, incoming in self._analyze(dfa)])
+		return pickle.dumps(dfas, protocol=4)
+	@staticmethod
+	def decode(data, decoder):
+		dfa_results = []
+		for dfa, states in zip(decoder.dfas, pickle.loads(data)):
+			trs = dfa.transitions
+			lookup = {'s': lambda ii: dfa.states[ii], 'src': lambda ii: trs[ii].source,
+			          'dst': lambda ii: trs[ii].destination}
+			dfa_results.append([(lookup[kind](ii), [trs[tt] for tt in outgoing], [trs[tt] for tt in incoming])
+			                    for (kind, ii), outgoing, incoming in states])
+		return StateInfoPass(decoder, dfa_results)
+	def _record(self, dfa, states):
+		for state, outgoing, incoming in states:
+			if outgoing: self.outgoing.set(state, outgoing)
+			if incoming: self.incoming.set(state, incoming)
+		self.dfa.set_many(dfa.states, [dfa] * len(dfa.states))
 	def visit_Decoder(self, node):
 		for dfa in node.dfas:
 			self.visit(dfa)
 	def visit_DFA(self, node):
-		for tran in node.transitions:
-			self.visit(tran)
-		assert node.start in node.states
-		for state in node.states:
-			self.dfa.set(state, node)
-	def visit_Transition(self, node):
-		self.outgoing.add(node.source, node)
-		self.incoming.add(node.destination, node)
+		self._record(node, self._analyze(node))
 
 def filter_none(ll): return [ee for ee in ll if ee is not None]
 
-class DeadCodeEliminationPass(ast.NodeVisitor):
+class DeadCodeEliminationPass(typed.Visitor):
 	# Remove all actions that reference tokens that are not outpus.
 	# Remove all dfas that do not contain any actions.
 	# Remove all inputs that are not used any action.
 	# Keep all inputs that trigger transitions.
-	def __init__(self, decoder, state=None):
+	# triggers and actions are shared between transitions, only visit them once
+	memoize = True
+	# validation level for the nodes built by this pass (None: keep current)
+	validation = None
+	# `dfa_results` are the results of `eliminate_dfas` for consecutive
+	# chunks of the dfas of `decoder`, e.g. computed by midend.parallel
+	def __init__(self, decoder, state=None, dfa_results=None):
 		assert isinstance(decoder, ir.Decoder)
 		if state is None: state = StateInfoPass(decoder)
 		assert isinstance(state, StateInfoPass)
 		self.state = state
 		#
 		self.used_tokens = set(decoder.outputs)
-		self.used_inputs = set()
-		used_dfas = filter_none([self.visit(dfa) for dfa in decoder.dfas])
+		if dfa_results is None:
+			dfa_results = [self.eliminate_dfas(decoder.dfas, decoder.outputs)]
+		used_dfas = filter_none(dfa for dfas, _ in dfa_results for dfa in dfas)
+		# inputs are kept in their original order, followed by channels that
+		# are not inputs in the order in which they were found
+		used = dict.fromkeys(ch for _, inputs in dfa_results for ch in inputs)
+		self.used_inputs = set(used)
+		inputs = [ch for ch in decoder.inputs if ch in self.used_inputs]
+		inputs += [ch for ch in used if ch not in set(decoder.inputs)]
+		with typed.validation(self.validation):
+			self.decoder = decoder.set(inputs=inputs, dfas=used_dfas)
+	@classmethod
+	def eliminate_dfas(cls, dfas, outputs):
+		""" part of the pass that only depends on the dfas and the outputs:
+		    returns the rewritten dfas (None for removed ones) and the inputs
+		    used by them """
+		dce = cls.__new__(cls)
+		dce.used_tokens = set(outputs)
+		dce.used_inputs = {}
+		with typed.validation(cls.validation):
+			new_dfas = [dce._eliminate(dfa) for dfa in dfas]
+		return new_dfas, list(dce.used_inputs)
+	def _eliminate(self, dfa):
+		new_dfa = self.visit(dfa)
 		# keep triggers
-		for dfa in used_dfas:
-			for tran in dfa.transitions:
+		if new_dfa is not None:
+			for tran in new_dfa.transitions:
 				self.visit(tran.trigger)
-		self.decoder = decoder.set(inputs=list(self.used_inputs),
-		                           dfas=used_dfas)
+		return new_dfa
 	def visit_DFA(self, dfa):
 		transitions = [self.visit(tran) for tran in dfa.transitions]
 		action_count = sum(len(tran.actions) for tran in transitions)
@@ -68,26 +140,157 @@ class DeadCodeEliminationPass(ast.NodeVisitor):
 		return tran.set(actions=filter_none(self.visit(action) for action in tran.actions))
 	def visit_Append(self, append):
 		if append.token in self.used_tokens:
-			self.used_inputs.add(append.channel)
+			self.used_inputs[append.channel] = None
 			return append
-	def visit_Start(self, action):
-		if action.token in self.used_tokens:
-			return action
-	def visit_Emit(self, action):
-		if action.token in self.used_tokens:
-			return action
-	def visit_Reset(self, action):
+	def visit_Action(self, action):
+		# Start, Emit and Reset
 		if action.token in self.used_tokens:
 			return action
 	def visit_InternalEvent(self, event):
 		self.visit(event.guard)
 		self.visit(event.trigger)
 	def visit_ExternalEvent(self, event):
-		self.used_inputs.add(event.channel)
+		self.used_inputs[event.channel] = None
 	def visit_Low(self, condition):
-		self.used_inputs.add(condition.channel)
+		self.used_inputs[condition.channel] = None
 	def visit_High(self, condition):
-		self.used_inputs.add(condition.channel)
-	def visit_NoneType(self, none): pass
-	def generic_visit(self, node):
-		raise NotImplementedError("TODO: handle nodes of type {}".format(type(node)))
+		self.used_inputs[condition.channel] = None
+	def visit_Sample(self, event):
+		self.used_inputs[event.channel] = None
+		self.visit(event.trigger)
+	def visit_ConditionBinOp(self, condition):
+		self.visit(condition.left)
+		self.visit(condition.right)
+	def visit_DelayedEvent(self, event): pass
+	def visit_ConstantCondition(self, condition): pass
+	# other nodes fall back to typed.Visitor.generic_visit
+
+def _event_label(event):
+	""" hashable key that is equal for structurally equal events """
+	if isinstance(event, ir.InternalEvent):
+		return (ir.InternalEvent, _event_label(event.trigger), event.guard)
+	if isinstance(event, ir.Sample):
+		return (ir.Sample, _event_label(event.trigger), event.channel)
+	if isinstance(event, ir.DelayedEvent):
+		return (ir.DelayedEvent, event.cycles)
+	# external events are interned
+	return event
+
+class MinimizeDFAPass(typed.Visitor):
+	# Remove all states that cannot be reached from the start state.
+	# Merge states that behave the same: a state takes the first of its
+	# outgoing transitions whose trigger fires, thus two states are
+	# equivalent if the i-th outgoing transition of both has the same
+	# trigger and actions and leads to equivalent states, for all i.
+	# The partition is refined with Hopcroft's algorithm, the letters are
+	# (i, trigger, actions).
+	def __init__(self, decoder, state=None):
+		assert isinstance(decoder, ir.Decoder)
+		if state is None: state = StateInfoPass(decoder)
+		assert isinstance(state, StateInfoPass)
+		self.state = state
+		# per dfa: (states, reachable states, states after minimization)
+		self.counts = []
+		self.decoder = self.visit(decoder)
+
+	@property
+	def states_before(self): return sum(cc[0] for cc in self.counts)
+	@property
+	def states_after(self): return sum(cc[2] for cc in self.counts)
+
+	def report(self):
+		unreachable = sum(cc[0] - cc[1] for cc in self.counts)
+		merged = sum(cc[1] - cc[2] for cc in self.counts)
+		return "{} dfas: {} states -> {} ({} unreachable, {} merged)".format(
+			len(self.counts), self.states_before, self.states_after, unreachable, merged)
+
+	def _states(self, dfa):
+		states = dict.fromkeys(dfa.states)
+		for tran in dfa.transitions:
+			states[tran.source] = None
+			states[tran.destination] = None
+		return list(states)
+
+	def _reachable(self, dfa):
+		found, todo = {dfa.start: None}, [dfa.start]
+		while todo:
+			for tran in self.state.outgoing.get(todo.pop()):
+				if tran.destination not in found:
+					found[tran.destination] = None
+					todo.append(tran.destination)
+		return found
+
+	def _letters(self, states):
+		""" transition -> letter, for the outgoing transitions of `states` """
+		letters = {}
+		for state in states:
+			for ii, tran in enumerate(self.state.outgoing.get(state)):
+				letters[tran] = (ii, _event_label(tran.trigger), tuple(tran.actions))
+		return letters
+
+	def _partition(self, states, letters):
+		""" list of blocks (lists of states) of equivalent states """
+		# states with the same sequence of outgoing letters start out together
+		initial = {}
+		for state in states:
+			key = tuple(letters[tran] for tran in self.state.outgoing.get(state))
+			initial.setdefault(key, []).append(state)
+		blocks = [set(bb) for bb in initial.values()]
+		block_of = {state: ii for ii, bb in enumerate(blocks) for state in bb}
+		todo = list(range(len(blocks)))
+		while todo:
+			splitter = todo.pop()
+			# letter -> states with a transition on it into the splitter
+			predecessors = {}
+			for state in list(blocks[splitter]):
+				for tran in self.state.incoming.get(state):
+					if tran.source in block_of:
+						predecessors.setdefault(letters[tran], set()).add(tran.source)
+			for sources in predecessors.values():
+				for bb in {block_of[ss] for ss in sources}:
+					inside = blocks[bb] & sources
+					if len(inside) == len(blocks[bb]): continue
+					outside = blocks[bb] - inside
+					# the smaller half becomes the new block
+					small, large = (inside, outside) if len(inside) <= len(outside) else (outside, inside)
+					blocks[bb] = large
+					blocks.append(small)
+					new = len(blocks) - 1
+					for ss in small: block_of[ss] = new
+					# if `bb` is still waiting both halves are now, otherwise
+					# refining by the smaller half is enough
+					todo.append(new)
+		order = {state: ii for ii, state in enumerate(states)}
+		return [sorted(bb, key=order.get) for bb in blocks]
+
+	def visit_Decoder(self, node):
+		return node.set(dfas=[self.visit(dfa) for dfa in node.dfas])
+
+	def visit_DFA(self, dfa):
+		states = self._states(dfa)
+		reachable = self._reachable(dfa)
+		reachable = [ss for ss in states if ss in reachable]
+		letters = self._letters(reachable)
+		# every state is replaced by the first state of its block
+		representative = {}
+		for block in self._partition(reachable, letters):
+			for ss in block: representative[ss] = block[0]
+		self.counts.append((len(states), len(reachable), len(set(representative.values()))))
+		transitions = [tran.set(destination=representative[tran.destination])
+		               for tran in dfa.transitions if representative.get(tran.source) is tran.source]
+		kept = [ss for ss in dfa.states if representative.get(ss) is ss]
+		return dfa.set(start=representative[dfa.start], states=kept, transitions=transitions)
+
+def create_pass_manager(**kwargs):
+	""" pass manager with all midend analyses and transformations registered """
+	pm = passmanager.PassManager(**kwargs)
+	# versions identify the results of the passes in a disk cache
+	pm.add_analysis('state_info', StateInfoPass, version=1,
+		encode=StateInfoPass.encode, decode=StateInfoPass.decode)
+	pm.add_transformation('dead_code_elimination',
+		lambda decoder, state_info: DeadCodeEliminationPass(decoder, state_info).decoder,
+		requires=['state_info'], invalidates=['state_info'], version=1)
+	pm.add_transformation('minimize_dfas',
+		lambda decoder, state_info: MinimizeDFAPass(decoder, state_info).decoder,
+		requires=['state_info'], invalidates=['state_info'], version=1)
+	return pm
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# executes a Decoder on recorded channel traces
+#
+# Semantics, one step per sample:
+#  * ExternalEvent: Rising fires when the channel changes from zero to
+#    non-zero, Falling when it changes from non-zero to zero.
+#    Before the first sample all channels are zero (see `initial`).
+#  * High/Low: the channel is non-zero/zero in the current sample.
+#  * InternalEvent fires if its trigger fires and its guard holds,
+#    Sample fires with its trigger.
+#  * DelayedEvent fires `cycles` samples after the dfa entered its state.
+#  * every dfa takes the first of the outgoing transitions of its state
+#    (in the order of `dfa.transitions`) whose trigger fires.
+#  * actions run in the order of the dfas in the decoder and of the
+#    actions in the transition. Start clears a token, Append shifts in the
+#    current value of a channel, Emit outputs the token (truncated to its
+#    width) and clears it, Reset clears it.
+#
+# Dfas only depend on the inputs and never on tokens, thus the dfas are
+# advanced over a whole chunk of samples before any action runs: all events
+# and conditions are evaluated for the whole chunk with NumPy and the dfas
+# only step through the samples at which any of their triggers fires.
+# Dfas without DelayedEvents take these steps together, with a few vector
+# operations per step, dfas with DelayedEvents one by one. Afterwards the
+# actions of all taken transitions run in time order.
+
+import collections
+import numpy as np
+import midend.ir as ir
+
+Emitted = collections.namedtuple('Emitted', ['token', 'value', 'start', 'end'])
+
+_START, _APPEND, _EMIT, _RESET = range(4)
+
+def _delay(event):
+	""" (cycles, guards) if `event` is a (guarded) DelayedEvent, else None """
+	if isinstance(event, ir.DelayedEvent):
+		if event.cycles < 1:
+			raise ValueError("DelayedEvent needs to wait at least one cycle, not {}".format(event.cycles))
+		return event.cycles, []
+	if isinstance(event, ir.InternalEvent):
+		inner = _delay(event.trigger)
+		if inner is None: return None
+		return inner[0], inner[1] + ([event.guard] if event.guard is not None else [])
+	if isinstance(event, ir.Sample):
+		return _delay(event.trigger)
+	return None
+
+def _event_key(event):
+	""" structurally equal events fire at the same samples and share a key """
+	if isinstance(event, ir.InternalEvent):
+		return (_event_key(event.trigger), id(event.guard))
+	if isinstance(event, ir.Sample):
+		return _event_key(event.trigger)
+	return id(event)
+
+class DFATable:
+	""" dense integer tables of a dfa """
+	def __init__(self, dfa, column, tokens):
+		states = list(dfa.states)
+		for tran in dfa.transitions:
+			for state in (tran.source, tran.destination):
+				if not any(state is ss for ss in states): states.append(state)
+		index = {id(ss): ii for ii, ss in enumerate(states)}
+		self.dfa = dfa
+		self.states = states
+		self.start = index[id(dfa.start)]
+		self.destination = [index[id(tran.destination)] for tran in dfa.transitions]
+		# per state: outgoing transitions by priority
+		self.outgoing = [[] for _ in states]
+		for ii, tran in enumerate(dfa.transitions):
+			self.outgoing[index[id(tran.source)]].append(ii)
+		# triggers of transitions that do not depend on the time in a state
+		self.events = {}
+		# per state: (transition, cycles, guards) of delayed transitions
+		self.delayed = [[] for _ in states]
+		for ii, tran in enumerate(dfa.transitions):
+			delay = _delay(tran.trigger)
+			if delay is None:
+				self.events[ii] = tran.trigger
+			else:
+				self.delayed[index[id(tran.source)]].append((ii, delay[0], delay[1]))
+		self.actions = [[self._action(aa, column, tokens) for aa in tran.actions] for tran in dfa.transitions]
+		self.has_delayed = any(self.delayed)
+
+	@staticmethod
+	def _action(action, column, tokens):
+		token = tokens.setdefault(action.token, len(tokens))
+		if isinstance(action, ir.Append):
+			return (_APPEND, token, column(action.channel), action.channel.width)
+		kind = {ir.Start: _START, ir.Emit: _EMIT, ir.Reset: _RESET}[type(action)]
+		return (kind, token, None, None)
+
+class _Masks:
+	""" event and condition masks of a chunk, computed once per node """
+	def __init__(self, columns, prev, column):
+		self.columns = columns
+		self.prev = prev
+		self.column = column
+		self.cache = {}
+	def _previous(self, ch):
+		cc = self.column(ch)
+		values = self.columns[cc]
+		shifted = np.empty_like(values)
+		shifted[0] = self.prev[cc]
+		shifted[1:] = values[:-1]
+		return shifted
+	def _get(self, key, node, compute):
+		entry = self.cache.get(key)
+		if entry is None:
+			entry = self.cache[key] = (node, compute(node))
+		return entry[1]
+	def event(self, event):
+		return self._get(_event_key(event), event, self._event)
+	def condition(self, cond):
+		return self._get(id(cond), cond, self._condition)
+	def _event(self, event):
+		if isinstance(event, ir.ExternalEvent):
+			now = self.columns[self.column(event.channel)] != 0
+			before = self._previous(event.channel) != 0
+			return (now & ~before) if event.edge == ir.Edge.Rising else (before & ~now)
+		if isinstance(event, ir.InternalEvent):
+			fired = self.event(event.trigger)
+			return fired if event.guard is None else fired & self.condition(event.guard)
+		if isinstance(event, ir.Sample):
+			return self.event(event.trigger)
+		raise NotImplementedError("cannot simulate events of type {}".format(type(event)))
+	def _condition(self, cond):
+		if isinstance(cond, ir.High): return self.columns[self.column(cond.channel)] != 0
+		if isinstance(cond, ir.Low): return self.columns[self.column(cond.channel)] == 0
+		if isinstance(cond, ir.ConstantCondition):
+			return np.full(len(self.columns[0]), cond.value, dtype=bool)
+		if isinstance(cond, ir.ConditionBinOp):
+			assert cond.op == ir.Bop.And
+			return self.condition(cond.left) & self.condition(cond.right)
+		raise NotImplementedError("cannot simulate conditions of type {}".format(type(cond)))
+
+class _Lockstep:
+	""" joint tables of all dfas without DelayedEvents
+
+	The outgoing transitions ("rows") of all states of all these dfas are
+	numbered consecutively, as are the states. `candidates[state]` lists
+	the rows of a state by priority, padded with -1 rows that never fire.
+	"""
+	def __init__(self, tables):
+		self.dfas = [dd for dd, table in enumerate(tables) if not table.has_delayed]
+		self.offsets, rows, outgoing, states = [], [], [], 0
+		for kk, dd in enumerate(self.dfas):
+			table = tables[dd]
+			self.offsets.append(states)
+			for out in table.outgoing:
+				outgoing.append(list(range(len(rows), len(rows) + len(out))))
+				rows += [(kk, tr) for tr in out]
+			states += len(table.states)
+		events = {}
+		for kk, tr in rows:
+			ev = tables[self.dfas[kk]].events[tr]
+			events.setdefault(_event_key(ev), ev)
+		self.events = list(events.values())
+		event_index = {key: ii for ii, key in enumerate(events)}
+		row_event = [event_index[_event_key(tables[self.dfas[kk]].events[tr])] for kk, tr in rows]
+		self.row_dfa = np.array([self.dfas[kk] for kk, _ in rows], dtype=np.int64)
+		self.row_transition = np.array([tr for _, tr in rows], dtype=np.int64)
+		self.row_destination = np.array([self.offsets[kk] + tables[self.dfas[kk]].destination[tr]
+		                                 for kk, tr in rows], dtype=np.int64)
+		self.row_actions = np.array([bool(tables[self.dfas[kk]].actions[tr]) for kk, tr in rows], dtype=bool)
+		width = max([len(out) for out in outgoing] + [1])
+		self.candidates = np.full((states, width), -1, dtype=np.int64)
+		# event of every candidate, the padding refers to an extra event that never fires
+		self.candidate_event = np.full((states, width), len(self.events), dtype=np.int64)
+		for ss, out in enumerate(outgoing):
+			self.candidates[ss, :len(out)] = out
+			self.candidate_event[ss, :len(out)] = [row_event[rr] for rr in out]
+
+class Simulator:
+	""" runs a Decoder over consecutive chunks of samples
+
+	Samples are a 2d array with one column per channel in `decoder.inputs`,
+	a list of these columns or a dict from channel to column. Dfa states,
+	partially built tokens and the last sample are kept between calls of
+	`run`, thus a long trace can be fed in pieces.
+	"""
+	def __init__(self, decoder, initial=None):
+		assert isinstance(decoder, ir.Decoder)
+		self.decoder = decoder
+		self.inputs = list(decoder.inputs)
+		self._columns = {ch: ii for ii, ch in enumerate(self.inputs)}
+		# token -> dense id
+		self._tokens = {}
+		self.tables = [DFATable(dfa, self.column, self._tokens) for dfa in decoder.dfas]
+		self.tokens = list(self._tokens)
+		self.lockstep = _Lockstep(self.tables)
+		self.initial = [0] * len(self.inputs) if initial is None else list(initial)
+		self.reset()
+
+	def column(self, channel):
+		if channel not in self._columns:
+			raise KeyError("channel {} is not an input of the decoder".format(channel))
+		return self._columns[channel]
+
+	def reset(self):
+		self.time = 0
+		self.prev = list(self.initial)
+		self.state = [tt.start for tt in self.tables]
+		self.entered = [0] * len(self.tables)
+		# per token: [value, start] with start None while it is empty
+		self.buffers = [[0, None] for _ in self.tokens]
+
+	def _split(self, samples):
+		if isinstance(samples, dict):
+			columns = [samples[ch] for ch in self.inputs]
+		elif isinstance(samples, np.ndarray) and samples.ndim == 2:
+			columns = [samples[:, ii] for ii in range(samples.shape[1])]
+		else:
+			columns = list(samples)
+		if len(columns) != len(self.inputs):
+			raise ValueError("expected {} channels, got {}".format(len(self.inputs), len(columns)))
+		columns = [np.asarray(cc, dtype=np.int64) for cc in columns]
+		if len({len(cc) for cc in columns}) > 1:
+			raise ValueError("all channels need to have the same number of samples")
+		return columns
+
+	def run(self, samples, chunk_size=1 << 16):
+		""" advances by all `samples` and returns the emitted tokens """
+		columns = self._split(samples)
+		length = len(columns[0]) if columns else 0
+		emitted = []
+		for start in range(0, length, chunk_size):
+			emitted += self._chunk([cc[start:start + chunk_size] for cc in columns])
+		return emitted
+
+	def _chunk(self, columns):
+		base, length = self.time, len(columns[0])
+		masks = _Masks(columns, self.prev, self.column)
+		taken = self._advance_lockstep(masks, base, length)
+		for dd, table in enumerate(self.tables):
+			if table.has_delayed:
+				taken += [(tt, dd, tr) for tt, tr in self._scan(dd, table, masks, base, length)]
+		taken.sort()
+		emitted = self._execute(taken, columns, base)
+		self.prev = [int(cc[-1]) for cc in columns]
+		self.time = base + length
+		return emitted
+
+	def _advance_lockstep(self, masks, base, length):
+		""" advances all dfas without DelayedEvents together, one step per
+		    sample at which any of their triggers fires, returns
+		    (time, dfa, transition) of the taken transitions with actions """
+		ls = self.lockstep
+		if not ls.events: return []
+		any_fired = np.zeros(length, dtype=bool)
+		for ev in ls.events:
+			any_fired |= masks.event(ev)
+		steps = np.flatnonzero(any_fired)
+		# fired[step, event], with an extra event that never fires
+		fired = np.zeros((len(steps), len(ls.events) + 1), dtype=bool)
+		for ii, ev in enumerate(ls.events):
+			fired[:, ii] = masks.event(ev)[steps]
+		current = np.array([ls.offsets[kk] + self.state[dd] for kk, dd in enumerate(ls.dfas)], dtype=np.int64)
+		dfas = np.arange(len(ls.dfas))
+		# rows[step, dfa]: row taken by the dfa or -1
+		rows = np.empty((len(steps), len(ls.dfas)), dtype=np.int64)
+		for jj in range(len(steps)):
+			hit = fired[jj][ls.candidate_event[current]]
+			first = hit.argmax(axis=1)
+			row = np.where(hit[dfas, first], ls.candidates[current, first], -1)
+			rows[jj] = row
+			current = np.where(row >= 0, ls.row_destination[row], current)
+		rows = rows.T
+		kk, jj = np.nonzero(rows >= 0)
+		row = rows[kk, jj]
+		times = steps[jj] + base
+		# np.nonzero returns the steps of every dfa in order
+		last = np.flatnonzero(np.append(kk[1:] != kk[:-1], True)) if len(kk) else []
+		for ii in last:
+			self.entered[ls.dfas[kk[ii]]] = int(times[ii])
+		keep = ls.row_actions[row]
+		taken = list(zip(times[keep].tolist(), ls.row_dfa[row[keep]].tolist(), ls.row_transition[row[keep]].tolist()))
+		for kk, dd in enumerate(ls.dfas):
+			self.state[dd] = int(current[kk] - ls.offsets[kk])
+		return taken
+
+	def _scan(self, dd, table, masks, base, length):
+		""" advances dfa `dd`, which may contain DelayedEvents, over the chunk,
+		    returns (time, transition) of all taken transitions with actions """
+		fired = np.zeros((len(table.destination), length), dtype=bool)
+		for tr, event in table.events.items():
+			fired[tr] = masks.event(event)
+		steps = np.flatnonzero(fired.any(axis=0))
+		fired = fired[:, steps]
+		# transition taken by every state at every step, -1 for none
+		choice = np.full((len(table.states), len(steps)), -1, dtype=np.int64)
+		for state, outgoing in enumerate(table.outgoing):
+			candidates = [tr for tr in outgoing if tr in table.events]
+			if not candidates: continue
+			cc = fired[candidates]
+			choice[state] = np.where(cc.any(axis=0), np.array(candidates)[cc.argmax(axis=0)], -1)
+		choice, steps = choice.tolist(), (steps + base).tolist()
+		state, entered = self.state[dd], self.entered[dd]
+		end, pos, jj = base + length, base, 0
+		taken = []
+		while True:
+			now = steps[jj] if jj < len(steps) else end
+			delayed = table.delayed[state]
+			if delayed:
+				due = [entered + cycles for _, cycles, _ in delayed if pos <= entered + cycles <= now]
+				due = min(due) if due else None
+				if due is not None and due < end:
+					tr = self._first(table, state, entered, due, masks, base, fired, jj if due == now else None)
+					pos = due + 1
+					if due == now: jj += 1
+					if tr is not None:
+						state, entered = table.destination[tr], due
+						if table.actions[tr]: taken.append((due, tr))
+					continue
+			if jj >= len(steps): break
+			tr = choice[state][jj]
+			if tr >= 0:
+				state, entered = table.destination[tr], now
+				if table.actions[tr]: taken.append((now, tr))
+			pos = now + 1
+			jj += 1
+		self.state[dd], self.entered[dd] = state, entered
+		return taken
+
+	def _first(self, table, state, entered, now, masks, base, fired, step):
+		""" first transition of `state` that fires at `now`, considering
+		    delayed transitions, `step` is the index of `now` in `fired` """
+		delayed = {tr: (cycles, guards) for tr, cycles, guards in table.delayed[state]}
+		for tr in table.outgoing[state]:
+			if tr in delayed:
+				cycles, guards = delayed[tr]
+				if entered + cycles == now and all(masks.condition(gg)[now - base] for gg in guards):
+					return tr
+			elif step is not None and fired[tr, step]:
+				return tr
+		return None
+
+	def _execute(self, taken, columns, base):
+		emitted, buffers, tables = [], self.buffers, self.tables
+		for now, dd, tr in taken:
+			for kind, token, column, width in tables[dd].actions[tr]:
+				buf = buffers[token]
+				if kind == _APPEND:
+					if buf[1] is None: buf[1] = now
+					value = int(columns[column][now - base]) & ((1 << width) - 1)
+					buf[0] = (buf[0] << width) | value
+				elif kind == _EMIT:
+					tok = self.tokens[token]
+					start = now if buf[1] is None else buf[1]
+					emitted.append(Emitted(tok, buf[0] & ((1 << tok.width) - 1), start, now))
+					buf[0], buf[1] = 0, None
+				elif kind == _START:
+					buf[0], buf[1] = 0, now
+				else:
+					buf[0], buf[1] = 0, None
+		return emitted
+
+def simulate(decoder, samples, chunk_size=1 << 16):
+	""" tokens emitted by `decoder` for the trace `samples` """
+	return Simulator(decoder).run(samples, chunk_size)
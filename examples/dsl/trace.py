@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# streams channel traces from memory mapped files through a Simulator
+#
+# A trace file is a headerless sequence of packed records, one per sample,
+# with one little endian unsigned integer per channel in the order of
+# `decoder.inputs`. Every channel uses the smallest of 1, 2, 4 or 8 bytes
+# that holds `channel.width` bits, bits above the width are ignored.
+#
+#	for token in stream(decoder, "capture.bin"):
+#		print(token)
+#
+# Only one window of samples is mapped and converted at a time, thus the
+# memory used does not depend on the length of the trace.
+
+import os
+import numpy as np
+import midend.ir as ir
+from midend.simulate import Simulator
+
+def _field(width):
+	for size in (1, 2, 4, 8):
+		if width <= size * 8: return '<u{}'.format(size)
+	raise ValueError("channels can be at most 64 bit wide, not {}".format(width))
+
+def sample_dtype(channels):
+	""" numpy dtype of one record of a trace of `channels` """
+	return np.dtype([('ch{}'.format(ii), _field(ch.width)) for ii, ch in enumerate(channels)])
+
+def _channels(channels):
+	return list(channels.inputs) if isinstance(channels, ir.Decoder) else list(channels)
+
+class TraceFile:
+	""" read only view of a trace file of `channels` (or of the inputs of a decoder) """
+	def __init__(self, filename, channels):
+		self.filename = filename
+		self.channels = _channels(channels)
+		self.dtype = sample_dtype(self.channels)
+		size = os.path.getsize(filename)
+		if size % self.dtype.itemsize != 0:
+			raise ValueError("{}: size {} is not a multiple of the record size {}".format(
+				filename, size, self.dtype.itemsize))
+		self.samples = size // self.dtype.itemsize
+
+	def __len__(self):
+		return self.samples
+
+	def read(self, start, count):
+		""" list of int64 columns of samples [start, start + count) """
+		count = max(0, min(count, self.samples - start))
+		if count == 0: return [np.zeros(0, dtype=np.int64) for _ in self.channels]
+		records = np.memmap(self.filename, dtype=self.dtype, mode='r',
+		                    offset=start * self.dtype.itemsize, shape=(count,))
+		columns = []
+		for name, ch in zip(self.dtype.names, self.channels):
+			column = records[name].astype(np.int64)
+			if ch.width < records.dtype[name].itemsize * 8:
+				column &= (1 << ch.width) - 1
+			columns.append(column)
+		# closes the mapping
+		del records
+		return columns
+
+	def windows(self, size, start=0):
+		""" columns of consecutive windows of `size` samples """
+		if size < 1: raise ValueError("window size needs to be positive, not {}".format(size))
+		for first in range(start, self.samples, size):
+			yield self.read(first, size)
+
+def write_trace(filename, channels, samples, append=False):
+	""" writes `samples` (one column per channel, like Simulator.run) to a trace file """
+	channels = _channels(channels)
+	if isinstance(samples, dict):
+		columns = [samples[ch] for ch in channels]
+	elif isinstance(samples, np.ndarray) and samples.ndim == 2:
+		columns = [samples[:, ii] for ii in range(samples.shape[1])]
+	else:
+		columns = list(samples)
+	if len(columns) != len(channels):
+		raise ValueError("expected {} channels, got {}".format(len(channels), len(columns)))
+	dtype = sample_dtype(channels)
+	records = np.zeros(len(columns[0]) if columns else 0, dtype=dtype)
+	for name, ch, column in zip(dtype.names, channels, columns):
+		records[name] = np.asarray(column).astype(np.uint64) & np.uint64((1 << ch.width) - 1)
+	with open(filename, 'ab' if append else 'wb') as ff:
+		records.tofile(ff)
+
+def stream(decoder, filename, window=1 << 16, start=0, simulator=None):
+	""" generator of the tokens that `decoder` emits for the trace in `filename`
+
+	The trace is fed to a Simulator `window` samples at a time, dfa states,
+	partial tokens and the time spent in the current state carry over from
+	one window to the next. Pass a `simulator` to continue where it
+	stopped, e.g. to resume at sample `start` of a trace.
+	"""
+	sim = Simulator(decoder) if simulator is None else simulator
+	trace = TraceFile(filename, sim.inputs)
+	for columns in trace.windows(window, start):
+		yield from sim.run(columns, chunk_size=window)
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# control flow graphs and bitset dataflow analyses for type checked FuncDefs
+#
+# Every simple statement becomes a node of the CFG:
+#  * Assign and Return,
+#  * the condition of an If,
+#  * three nodes per For: one that evaluates the bounds, the loop test and
+#    one that assigns the loop variable at the start of every iteration,
+#  * and the entry and exit of the function.
+# Variables are numbered densely and sets of variables (or definitions)
+# are Python ints used as bitsets, thus transfer functions are a few
+# bitwise operations no matter how many variables a function has.
+# Statements are interned, thus nodes refer to statements by their
+# position: the n-th Assign in program order has `cfg.assigns[n]` as node.
+
+import collections
+import typed as kast
+import irtypes as ir
+from pycompile import local_types, restore_locals
+from simplify import _cannot_fail
+
+class VariableIndex:
+	""" dense numbering of variable names, e.g. of TypeChecker.symbols """
+	def __init__(self, symbols):
+		self.names = sorted(symbols)
+		self.types = [symbols[name] for name in self.names]
+		self.index = {name: ii for ii, name in enumerate(self.names)}
+	@staticmethod
+	def of(fun):
+		""" arguments and locals of a type checked `fun` """
+		symbols = dict(zip(fun.args, fun.arg_types))
+		symbols.update(local_types(fun))
+		return VariableIndex(symbols)
+	def __len__(self):
+		return len(self.names)
+	def bit(self, name):
+		return 1 << self.index[name]
+	def bits(self, names):
+		bits = 0
+		for name in names: bits |= 1 << self.index[name]
+		return bits
+	def names_of(self, bits):
+		return [name for ii, name in enumerate(self.names) if bits >> ii & 1]
+
+class CFG:
+	""" statement level control flow graph """
+	def __init__(self, fun, variables=None):
+		assert isinstance(fun, ir.FuncDef)
+		self.fun = fun
+		self.variables = VariableIndex.of(fun) if variables is None else variables
+		# per node
+		self.kinds = []
+		self.stmts = []
+		self.succ = []
+		self.pred = []
+		# bitsets of the variables that a node reads and (completely) writes
+		self.uses = []
+		self.defs = []
+		# node of every Assign, in program order
+		self.assigns = []
+		self._reads = {}
+		self.entry = self.add('entry', None, 0, self.variables.bits(fun.args))
+		self.exit = self.add('exit', None, 0, 0)
+		exits = _CFGBuilder(self).visit(fun.body)
+		for nn in exits: self.edge(nn, self.exit)
+
+	def add(self, kind, stmt, uses, defs):
+		self.kinds.append(kind)
+		self.stmts.append(stmt)
+		self.succ.append([])
+		self.pred.append([])
+		self.uses.append(uses)
+		self.defs.append(defs)
+		return len(self.kinds) - 1
+
+	def edge(self, src, dst):
+		self.succ[src].append(dst)
+		self.pred[dst].append(src)
+
+	def reads(self, expr):
+		""" bitset of the variables read by `expr` """
+		if expr is None: return 0
+		bits = self._reads.get(expr)
+		if bits is None:
+			names = {nn.name for nn in kast.walk(expr) if isinstance(nn, ir.Ref)}
+			bits = self._reads[expr] = self.variables.bits(names)
+		return bits
+
+	def __len__(self):
+		return len(self.kinds)
+
+	def postorder(self):
+		""" nodes reachable from the entry in postorder """
+		order, seen = [], {self.entry}
+		stack = [(self.entry, iter(self.succ[self.entry]))]
+		while stack:
+			nn, it = stack[-1]
+			for ss in it:
+				if ss not in seen:
+					seen.add(ss)
+					stack.append((ss, iter(self.succ[ss])))
+					break
+			else:
+				stack.pop()
+				order.append(nn)
+		return order
+
+class _CFGBuilder(kast.IterativeTransformer):
+	# handlers return the nodes whose successor is the next statement,
+	# the first node of a statement is found through `self.pending`
+	def __init__(self, cfg):
+		super().__init__()
+		self.cfg = cfg
+		# nodes that continue with the next node that is added
+		self.pending = [cfg.entry]
+	def _node(self, kind, stmt, uses, defs):
+		nn = self.cfg.add(kind, stmt, uses, defs)
+		for pp in self.pending: self.cfg.edge(pp, nn)
+		self.pending = [nn]
+		return nn
+	def visit_Assign(self, node):
+		cfg = self.cfg
+		if node.ref.index is None:
+			nn = self._node('assign', node, cfg.reads(node.val), cfg.variables.bit(node.ref.name))
+		else:
+			# an array element: the array is read (and kept) as well
+			nn = self._node('assign', node, cfg.reads(node.val) | cfg.reads(node.ref), 0)
+		cfg.assigns.append(nn)
+		return self.pending
+	def visit_Return(self, node):
+		nn = self._node('return', node, self.cfg.reads(node.val), 0)
+		self.cfg.edge(nn, self.cfg.exit)
+		self.pending = []
+		return self.pending
+	def visit_Block(self, node):
+		for stmt in node.body:
+			yield stmt
+		return self.pending
+	def visit_If(self, node):
+		branch = self._node('if', node, self.cfg.reads(node.cond), 0)
+		after = yield node.body
+		self.pending = [branch]
+		if node.elseBody is not None:
+			yield node.elseBody
+		self.pending = after + self.pending
+		return self.pending
+	def visit_For(self, node):
+		cfg = self.cfg
+		self._node('for', node, cfg.reads(node.min) | cfg.reads(node.max), 0)
+		test = self._node('loop', node, 0, 0)
+		self._node('loopvar', node, 0, cfg.variables.bit(node.var))
+		yield node.body
+		for pp in self.pending: cfg.edge(pp, test)
+		self.pending = [test]
+		return self.pending
+	def generic_visit(self, node):
+		raise NotImplementedError("unexpected statement {}".format(type(node)))
+
+class BitsetAnalysis:
+	""" worklist solver for analyses over bitsets whose meet is the union
+
+	`before[n]` and `after[n]` are the values in front of and behind node
+	`n` in program order. Subclasses define the direction, the value at the
+	entry (forward) or exit (backward) and the transfer function, which by
+	default is `gen[n] | (value & ~kill[n])`.
+	"""
+	forward = True
+	def __init__(self, cfg):
+		self.cfg = cfg
+		self.gen = [0] * len(cfg)
+		self.kill = [0] * len(cfg)
+		self.iterations = 0
+	def boundary(self):
+		return 0
+	def transfer(self, nn, value):
+		return self.gen[nn] | (value & ~self.kill[nn])
+	def solve(self):
+		cfg = self.cfg
+		order = cfg.postorder()
+		if self.forward:
+			order.reverse()
+			inputs, start = cfg.pred, cfg.entry
+		else:
+			inputs, start = cfg.succ, cfg.exit
+		# nodes that cannot be reached from the entry come last
+		reached = set(order)
+		order += [nn for nn in range(len(cfg)) if nn not in reached]
+		# values at the input and output of every node in flow direction
+		flow_in, flow_out = [0] * len(cfg), [0] * len(cfg)
+		outputs = cfg.succ if self.forward else cfg.pred
+		worklist = collections.deque(order)
+		queued = set(order)
+		while worklist:
+			nn = worklist.popleft()
+			queued.discard(nn)
+			self.iterations += 1
+			value = self.boundary() if nn == start else 0
+			for pp in inputs[nn]:
+				value |= flow_out[pp]
+			flow_in[nn] = value
+			out = self.transfer(nn, value)
+			if out != flow_out[nn]:
+				flow_out[nn] = out
+				for ss in outputs[nn]:
+					if ss not in queued:
+						queued.add(ss)
+						worklist.append(ss)
+		if self.forward:
+			self.before, self.after = flow_in, flow_out
+		else:
+			self.before, self.after = flow_out, flow_in
+		return self
+
+class Liveness(BitsetAnalysis):
+	""" variables that may be read before they are written again, arrays
+	    are arguments whose contents are visible to the caller """
+	forward = False
+	def __init__(self, cfg):
+		super().__init__(cfg)
+		self.gen, self.kill = list(cfg.uses), list(cfg.defs)
+		self.solve()
+	def boundary(self):
+		variables = self.cfg.variables
+		return variables.bits(name for name, tt in zip(variables.names, variables.types) if tt.is_array())
+
+class ReachingDefinitions(BitsetAnalysis):
+	""" definitions that may reach a node, definitions are the nodes that
+	    write a variable and the implicit one of every variable at the entry
+	    (arguments and zero initialized locals) """
+	def __init__(self, cfg):
+		super().__init__(cfg)
+		variables = cfg.variables
+		# definition -> (node, variable)
+		self.definitions = [(cfg.entry, ii) for ii in range(len(variables))]
+		for nn, defs in enumerate(cfg.defs):
+			if nn != cfg.entry and defs:
+				self.definitions.append((nn, defs.bit_length() - 1))
+		per_variable = [0] * len(variables)
+		for dd, (_, vv) in enumerate(self.definitions):
+			per_variable[vv] |= 1 << dd
+		for dd, (nn, vv) in enumerate(self.definitions):
+			if nn == cfg.entry: continue
+			self.gen[nn] = 1 << dd
+			self.kill[nn] = per_variable[vv] & ~(1 << dd)
+		self.gen[cfg.entry] = (1 << len(variables)) - 1
+		self.solve()
+	def reaching(self, nn, name=None):
+		""" (node, variable name) of the definitions that reach node `nn` """
+		names = self.cfg.variables.names
+		return [(node, names[vv]) for dd, (node, vv) in enumerate(self.definitions)
+		        if self.before[nn] >> dd & 1 and (name is None or names[vv] == name)]
+
+class _FaintVariables(Liveness):
+	# liveness where the reads of an assignment only count if the assigned
+	# variable is live, thus chains of dead assignments are found at once
+	def __init__(self, cfg, essential):
+		self.essential = essential
+		super().__init__(cfg)
+	def transfer(self, nn, value):
+		uses = self.gen[nn] if self.essential[nn] or value & self.kill[nn] else 0
+		return uses | (value & ~self.kill[nn])
+
+class DeadAssignmentElimination:
+	""" removes assignments to scalars whose value is never read, as long as
+	    evaluating the assigned value cannot fail """
+	@staticmethod
+	def run(fun, symbols=None):
+		""" returns the new `fun` and the number of removed assignments,
+		    `symbols` are the TypeChecker.symbols of `fun` """
+		cfg = CFG(fun, None if symbols is None else VariableIndex(symbols))
+		essential = [True] * len(cfg)
+		for nn in cfg.assigns:
+			stmt = cfg.stmts[nn]
+			essential[nn] = stmt.ref.index is not None or not _cannot_fail(stmt.val)
+		essential[cfg.entry] = essential[cfg.exit] = False
+		faint = _FaintVariables(cfg, essential)
+		dead = {ii for ii, nn in enumerate(cfg.assigns)
+		        if not essential[nn] and not faint.after[nn] & cfg.defs[nn]}
+		if not dead: return fun, 0
+		new = _Remove(dead).visit(fun)
+		return restore_locals(new, fun), len(dead)
+
+class _Remove(kast.IterativeTransformer):
+	# visits statements in the same order as _CFGBuilder
+	def __init__(self, dead):
+		super().__init__()
+		self.dead = dead
+		self.count = 0
+	def visit_Assign(self, node):
+		self.count += 1
+		return None if self.count - 1 in self.dead else node
+	def visit_Return(self, node):
+		return node
+	def visit_Block(self, node):
+		body = []
+		for stmt in node.body:
+			stmt = yield stmt
+			if stmt is not None: body.append(stmt)
+		return node.set(body=body)
+	def visit_If(self, node):
+		body = yield node.body
+		elseBody = None if node.elseBody is None else (yield node.elseBody)
+		return node.set(body=ir.Block(body=[]) if body is None else body, elseBody=elseBody)
+	def visit_For(self, node):
+		body = yield node.body
+		return node.set(body=ir.Block(body=[]) if body is None else body)
+	def visit_FuncDef(self, node):
+		body = yield node.body
+		return node.set(body=ir.Block(body=[]) if body is None else body)
+
+def eliminate_dead_assignments(fun, symbols=None):
+	return DeadAssignmentElimination.run(fun, symbols)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# type checking that reuses the results of earlier runs
+#
+# The type checked version of a subtree only depends on
+#  * its structure (statements and expressions are interned, thus the
+#    node itself is the key),
+#  * the types of all names it mentions before it is checked and
+#  * the return type of the function.
+# The result and the declarations it made are cached under these and
+# replayed whenever the same subtree is checked in the same context again.
+# The cache keeps the `max_entries` most recently used results, the names
+# of a subtree are only remembered while the subtree is alive.
+
+import collections, types, weakref
+import typed as kast
+import irtypes as ir
+from typechecker import TypeChecker
+
+class _Entry:
+	__slots__ = ('result', 'declarations')
+	def __init__(self, result, declarations):
+		self.result = result
+		self.declarations = declarations
+
+class IncrementalTypeChecker(TypeChecker):
+	""" keeps a cache across `check` calls and counts hits and misses """
+	def __init__(self, max_entries=1 << 17):
+		super().__init__()
+		# least recently used entries first
+		self.cache = collections.OrderedDict()
+		self.max_entries = max_entries
+		self.hits = 0
+		self.misses = 0
+		# node -> frozenset of all names in the subtree
+		self._names = weakref.WeakKeyDictionary()
+		self._declared = []
+
+	def check(self, ir_code):
+		""" like TypeChecker.analyze, but reuses cached results """
+		self.return_type = None
+		self.symbols = {}
+		self._declared = []
+		self.reset_memo()
+		with kast.validation(self.validation):
+			type_checked_ast = self.visit(ir_code)
+		return (type_checked_ast, self.symbols)
+
+	def clear(self):
+		self.cache.clear()
+		self._names.clear()
+		self.hits = self.misses = 0
+
+	def stats(self):
+		total = self.hits + self.misses
+		return {'hits': self.hits, 'misses': self.misses,
+		        'hit_rate': self.hits / total if total else 0.0,
+		        'entries': len(self.cache)}
+
+	def _declare_sym(self, name, tt):
+		new = name not in self.symbols
+		super()._declare_sym(name, tt)
+		if new: self._declared.append((name, tt))
+
+	def names(self, node):
+		""" all names read or declared in the subtree `node` """
+		if node in self._names: return self._names[node]
+		stack = [(node, False)]
+		while stack:
+			nn, expanded = stack.pop()
+			if nn in self._names: continue
+			children = list(kast.iter_child_nodes(nn))
+			if not expanded:
+				stack.append((nn, True))
+				stack.extend((cc, False) for cc in children if cc not in self._names)
+				continue
+			own = set()
+			if isinstance(nn, ir.Ref): own.add(nn.name)
+			elif isinstance(nn, ir.For): own.add(nn.var)
+			elif isinstance(nn, ir.FuncDef): own.update(nn.args)
+			child_names = [self._names[cc] for cc in children]
+			if not own and len(child_names) == 1:
+				self._names[nn] = child_names[0]
+			else:
+				self._names[nn] = frozenset(own.union(*child_names))
+		return self._names[node]
+
+	def _key(self, node):
+		symbols = self.symbols
+		context = tuple(sorted((name, symbols.get(name)) for name in self.names(node)))
+		return (node, context, self.return_type)
+
+	def _handle(self, node):
+		if not isinstance(node, (ir.Stmt, ir.Expr)):
+			return super()._handle(node)
+		key = self._key(node)
+		entry = self.cache.get(key)
+		if entry is not None:
+			self.hits += 1
+			self.cache.move_to_end(key)
+			for name, tt in entry.declarations:
+				self._declare_sym(name, tt)
+			return entry.result
+		self.misses += 1
+		start = len(self._declared)
+		result = super()._handle(node)
+		if isinstance(result, types.GeneratorType):
+			return self._record_generator(key, start, result)
+		self._record(key, start, result)
+		return result
+
+	def _record(self, key, start, result):
+		self.cache[key] = _Entry(result, tuple(self._declared[start:]))
+		if len(self.cache) > self.max_entries:
+			self.cache.popitem(last=False)
+
+	def _record_generator(self, key, start, handler):
+		result = yield from handler
+		self._record(key, start, result)
+		return result
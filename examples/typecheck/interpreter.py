@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# reference interpreter for type checked FuncDefs
+#
+# Slow, but straight forward. It implements the semantics that are
+# documented in pycompile.py and is used to check the compiled versions.
+
+import operator
+import typed as kast
+import irtypes as ir
+from pycompile import is_typed, local_types, _zero
+from typechecker import TypeChecker
+
+class _Return(Exception):
+	def __init__(self, value):
+		self.value = value
+
+_cmp = {ir.Cop.EQ: operator.eq, ir.Cop.NE: operator.ne, ir.Cop.LT: operator.lt,
+        ir.Cop.GT: operator.gt, ir.Cop.LE: operator.le, ir.Cop.GE: operator.ge}
+_arith = {ir.Bop.Add: operator.add, ir.Bop.Sub: operator.sub, ir.Bop.Mul: operator.mul,
+          ir.Bop.Mod: operator.mod, ir.Bop.And: operator.and_, ir.Bop.Or: operator.or_}
+
+class Interpreter(kast.Visitor):
+	""" executes a FuncDef, array arguments are modified in place """
+	@staticmethod
+	def run(fun, *args):
+		assert isinstance(fun, ir.FuncDef)
+		if not is_typed(fun): fun = TypeChecker.analyze(fun)[0]
+		if len(args) != len(fun.args):
+			raise TypeError("{} expects {} arguments, got {}".format(fun.name, len(fun.args), len(args)))
+		interp = Interpreter()
+		interp.env = {name: _zero[tt] for name, tt in local_types(fun).items() if not tt.is_array()}
+		interp.env.update(zip(fun.args, args))
+		try:
+			interp.visit(fun.body)
+		except _Return as ret:
+			return ret.value
+		return None
+
+	def visit_Block(self, node):
+		for stmt in node.body:
+			self.visit(stmt)
+	def visit_If(self, node):
+		if self.visit(node.cond):
+			self.visit(node.body)
+		elif node.elseBody is not None:
+			self.visit(node.elseBody)
+	def visit_For(self, node):
+		for ii in range(self.visit(node.min), self.visit(node.max)):
+			self.env[node.var] = ii
+			self.visit(node.body)
+	def visit_Assign(self, node):
+		value = self.visit(node.val)
+		if node.ref.index is None:
+			self.env[node.ref.name] = value
+		else:
+			self.env[node.ref.name][self.visit(node.ref.index)] = value
+	def visit_Return(self, node):
+		raise _Return(self.visit(node.val))
+
+	def visit_Ref(self, node):
+		value = self.env[node.name]
+		if node.index is None: return value
+		return value[self.visit(node.index)]
+	def visit_IntConst(self, node): return node.val
+	def visit_FloatConst(self, node): return node.val
+	def visit_BoolConst(self, node): return node.val
+	def visit_VoidConst(self, node): return None
+	def visit_CastToInt(self, node): return int(self.visit(node.expr))
+	def visit_CastToFloat(self, node): return float(self.visit(node.expr))
+	def visit_CastToBool(self, node): return bool(self.visit(node.expr))
+	def visit_BinOp(self, node):
+		left, right = self.visit(node.left), self.visit(node.right)
+		if node.op == ir.Bop.Div:
+			return left // right if node.type == ir.Type.Int else left / right
+		return _arith[node.op](left, right)
+	def visit_CmpOp(self, node):
+		return _cmp[node.op](self.visit(node.left), self.visit(node.right))
+	def visit_UnOp(self, node):
+		value = self.visit(node.e)
+		return -value if node.op == ir.Uop.Neg else not value
+
+	def generic_visit(self, node):
+		raise NotImplementedError("cannot interpret nodes of type {}".format(type(node)))
+
+def interpret(fun, *args):
+	return Interpreter.run(fun, *args)
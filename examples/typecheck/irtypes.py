@@ -54,7 +54,7 @@ class Type(Enum):
 		         Type.BoolArray:  Type.Bool}[self]
 
 ## Exprs ##
-class Expr(kast.AST):
+class Expr(kast.Node, interned=True):
 	# the type of an expression will be determined by the Type"Checker"
 	type = kast.Optional(Type)
 
@@ -98,7 +98,7 @@ class CastToBool(Expr):
 	expr = Expr
 
 ## Stmts ##
-class Stmt(kast.AST):
+class Stmt(kast.Node, interned=True):
 	pass
 
 class Assign(Stmt):
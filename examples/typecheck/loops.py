@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# loop invariant code motion and strength reduction for type checked FuncDefs
+#
+# Loops are optimized innermost first. An optimized loop becomes
+#
+#	lo = min; hi = max
+#	if lo < hi:
+#		<preheader>
+#		for i in range(lo, hi):
+#			<body>
+#			s = s + step
+#
+# thus the preheader only runs if the loop runs at least once. It holds
+#  * Assigns at the top level of the body whose value is loop invariant,
+#    if they are the only assignment to their variable in the loop and the
+#    variable is not read by the statements in front of them,
+#  * temporaries for the invariant subexpressions of the remaining body,
+#  * the start values of induction variables `s` that replace Int
+#    expressions `c * i + d` with invariant `c` and `d`, which the body
+#    updates by adding `c` at the end of every iteration.
+# Values are invariant if they read no scalar that the loop assigns and no
+# array element of a type that the loop writes (arrays of the same type
+# may be the same object). Expressions that can fail (array reads,
+# divisions) are only hoisted as the value of an Assign that every
+# iteration reaches without running anything visible before it, thus
+# errors and array writes stay in order.
+# Vectorizable loops (see vectorize.py) should be vectorized first, the
+# updates of induction variables are scalar assignments in the body.
+
+import collections
+import typed as kast
+import irtypes as ir
+from pycompile import is_typed
+from simplify import Simplifier, _cannot_fail, _is_const, _is_value
+
+def _int(value):
+	return ir.IntConst(val=value, type=ir.Type.Int)
+
+def _add(left, right):
+	if _is_const(left) and _is_const(right): return _int(left.val + right.val)
+	if _is_value(left, 0): return right
+	if _is_value(right, 0): return left
+	return ir.BinOp(op=ir.Bop.Add, left=left, right=right, type=ir.Type.Int)
+
+def _neg(expr):
+	if _is_const(expr): return _int(-expr.val)
+	return ir.UnOp(op=ir.Uop.Neg, e=expr, type=ir.Type.Int)
+
+def _sub(left, right):
+	if _is_value(left, 0): return _neg(right)
+	if _is_const(right): return _add(left, _int(-right.val))
+	return ir.BinOp(op=ir.Bop.Sub, left=left, right=right, type=ir.Type.Int)
+
+def _mul(left, right):
+	if _is_const(left) and _is_const(right): return _int(left.val * right.val)
+	if _is_value(left, 1): return right
+	if _is_value(right, 1): return left
+	return ir.BinOp(op=ir.Bop.Mul, left=left, right=right, type=ir.Type.Int)
+
+def _reads(node):
+	return {nn.name for nn in kast.walk(node) if isinstance(nn, ir.Ref)}
+
+class _Loop:
+	""" what the body of `loop` writes """
+	def __init__(self, loop):
+		self.var = loop.var
+		# scalar name -> number of Assigns and For loops that write it
+		self.assignments = collections.Counter()
+		# element types of the arrays that are written
+		self.written = set()
+		for nn in kast.walk(loop.body):
+			if isinstance(nn, ir.Assign):
+				if nn.ref.index is None: self.assignments[nn.ref.name] += 1
+				else: self.written.add(nn.ref.type.to_scalar())
+			elif isinstance(nn, ir.For):
+				self.assignments[nn.var] += 1
+		# names that may change from one iteration to the next
+		self.assigned = set(self.assignments) | {loop.var}
+
+	def invariant(self, expr):
+		""" True if `expr` has the same value in every iteration """
+		for nn in kast.walk(expr):
+			if not isinstance(nn, ir.Ref): continue
+			if nn.index is None and nn.name in self.assigned: return False
+			if (nn.index is not None or nn.type.is_array()) and nn.type.to_scalar() in self.written:
+				return False
+		return True
+
+	def coefficient(self, expr):
+		""" `c` if `expr` is `c * var + d` with invariant `c` and `d` that
+		    cannot fail, None if it is not """
+		if expr.type != ir.Type.Int: return None
+		if isinstance(expr, ir.Ref) and expr.index is None and expr.name == self.var:
+			# a loop variable that the body assigns is no induction variable
+			return _int(1) if self.assignments[self.var] == 0 else None
+		if self.invariant(expr): return _int(0) if _cannot_fail(expr) else None
+		if isinstance(expr, ir.UnOp) and expr.op == ir.Uop.Neg:
+			cc = self.coefficient(expr.e)
+			return None if cc is None else _neg(cc)
+		if not isinstance(expr, ir.BinOp) or expr.op not in (ir.Bop.Add, ir.Bop.Sub, ir.Bop.Mul):
+			return None
+		left, right = self.coefficient(expr.left), self.coefficient(expr.right)
+		if left is None or right is None: return None
+		if expr.op == ir.Bop.Add: return _add(left, right)
+		if expr.op == ir.Bop.Sub: return _sub(left, right)
+		if _is_value(left, 0): return _mul(expr.left, right)
+		if _is_value(right, 0): return _mul(left, expr.right)
+		return None
+
+class _Substitute(kast.IterativeTransformer):
+	# replaces the loop variable by the start value
+	memoize = True
+	def __init__(self, var, value):
+		super().__init__()
+		self.var = var
+		self.value = value
+	def visit_Ref(self, node):
+		if node.index is None and node.name == self.var: return self.value
+		return node
+
+class _Rewrite(kast.IterativeTransformer):
+	# moves invariant subexpressions and induction variables of the body
+	# of a loop into the preheader
+	memoize = True
+	def __init__(self, optimizer, info, lo):
+		super().__init__()
+		self.optimizer = optimizer
+		self.info = info
+		self.lo = lo
+		# Assigns of the temporaries, in the order they need to run in
+		self.preheader = []
+		# expression -> Ref of its temporary
+		self.temps = {}
+		# (Ref of the induction variable, step)
+		self.inductions = []
+
+	def temp(self, expr):
+		ref = self.temps.get(expr)
+		if ref is None:
+			ref = self.temps[expr] = self.optimizer.fresh(expr.type)
+			self.preheader.append(ir.Assign(ref=ref, val=expr))
+		return ref
+
+	def induction(self, expr, step):
+		ref = self.temps.get(expr)
+		if ref is None:
+			if not _is_const(step) and not isinstance(step, ir.Ref): step = self.temp(step)
+			ref = self.temps[expr] = self.optimizer.fresh(ir.Type.Int)
+			start = Simplifier().visit(_Substitute(self.info.var, self.lo).visit(expr))
+			self.preheader.append(ir.Assign(ref=ref, val=start))
+			self.inductions.append((ref, step))
+		return ref
+
+	def _reducible(self, expr):
+		# worth it if the loop variable is multiplied with something
+		info = self.info
+		return any(isinstance(nn, ir.BinOp) and nn.op == ir.Bop.Mul and not info.invariant(nn)
+		           for nn in kast.walk(expr))
+
+	def visit_Expr(self, node):
+		if _is_const(node) or (isinstance(node, ir.Ref) and node.index is None):
+			return node
+		if self.info.invariant(node) and _cannot_fail(node):
+			# constants are left to the Simplifier
+			return self.temp(node) if _reads(node) else node
+		if node.type == ir.Type.Int and self._reducible(node):
+			step = self.info.coefficient(node)
+			if step is not None and not _is_value(step, 0):
+				return self.induction(node, step)
+		return (yield from self.generic_visit(node))
+
+	def visit_Assign(self, node):
+		# the target itself stays
+		index = node.ref.index
+		if index is not None: index = yield index
+		val = yield node.val
+		return node.set(ref=node.ref.set(index=index), val=val)
+
+	def visit_Return(self, node):
+		return node.set(val=(yield node.val))
+
+class LoopOptimizer(kast.IterativeTransformer):
+	""" invariant code motion and strength reduction for the For loops of a
+	    type checked FuncDef, counts the applied rewrites """
+
+	@staticmethod
+	def run(fun):
+		""" returns the optimized `fun` and the LoopOptimizer, see `stats` """
+		assert isinstance(fun, ir.FuncDef) and is_typed(fun)
+		optimizer = LoopOptimizer(_reads(fun) | set(fun.args) |
+		                          {nn.var for nn in kast.walk(fun) if isinstance(nn, ir.For)})
+		return optimizer.visit(fun), optimizer
+
+	def __init__(self, names):
+		super().__init__()
+		# names that temporaries must not use
+		self.names = set(names)
+		self.counter = 0
+		self.loops = 0
+		self.hoisted = 0
+		self.expressions = 0
+		self.reduced = 0
+
+	def stats(self):
+		return {'loops': self.loops, 'hoisted': self.hoisted,
+		        'expressions': self.expressions, 'reduced': self.reduced}
+
+	def fresh(self, tt):
+		""" Ref to a new local of type `tt` """
+		while True:
+			name = "_loop{}".format(self.counter)
+			self.counter += 1
+			if name not in self.names: break
+		self.names.add(name)
+		return ir.Ref(name=name, index=None, type=tt)
+
+	def _hoistable(self, stmt, info, read, safe):
+		if not isinstance(stmt, ir.Assign) or stmt.ref.index is not None: return False
+		name = stmt.ref.name
+		return (name != info.var and info.assignments[name] == 1 and name not in read and
+		        info.invariant(stmt.val) and (safe or _cannot_fail(stmt.val)))
+
+	def _bound(self, expr, hoisted, bounds):
+		# the bounds are evaluated once, in front of the preheader
+		if _is_const(expr) or (isinstance(expr, ir.Ref) and expr.index is None and expr.name not in hoisted):
+			return expr
+		ref = self.fresh(ir.Type.Int)
+		bounds.append(ir.Assign(ref=ref, val=expr))
+		return ref
+
+	def optimize(self, loop):
+		info = _Loop(loop)
+		body = loop.body.body if isinstance(loop.body, ir.Block) else [loop.body]
+		hoisted, kept = [], []
+		# names read by the statements in `kept`
+		read = set()
+		# True while all statements in `kept` are invisible if they are skipped
+		safe = True
+		for stmt in body:
+			if self._hoistable(stmt, info, read, safe):
+				hoisted.append(stmt)
+				info.assigned.discard(stmt.ref.name)
+				continue
+			kept.append(stmt)
+			read |= _reads(stmt)
+			safe = safe and isinstance(stmt, ir.Assign) and stmt.ref.index is None and _cannot_fail(stmt.val)
+		bounds = []
+		names = {stmt.ref.name for stmt in hoisted}
+		lo = self._bound(loop.min, names, bounds)
+		hi = self._bound(loop.max, names, bounds)
+		rewrite = _Rewrite(self, info, lo)
+		kept = [rewrite.visit(stmt) for stmt in kept]
+		if not hoisted and not rewrite.preheader: return loop
+		self.loops += 1
+		self.hoisted += len(hoisted)
+		self.expressions += len(rewrite.preheader) - len(rewrite.inductions)
+		self.reduced += len(rewrite.inductions)
+		updates = [ir.Assign(ref=ref, val=_add(ref, step)) for ref, step in rewrite.inductions]
+		loop = loop.set(min=lo, max=hi, body=ir.Block(body=kept + updates))
+		preheader = hoisted + rewrite.preheader + [loop]
+		if _is_const(lo) and _is_const(hi) and lo.val < hi.val:
+			return ir.Block(body=bounds + preheader)
+		guard = ir.CmpOp(op=ir.Cop.LT, left=lo, right=hi, type=ir.Type.Bool)
+		return ir.Block(body=bounds + [ir.If(cond=guard, body=ir.Block(body=preheader), elseBody=None)])
+
+	def visit_For(self, node):
+		body = yield node.body
+		return self.optimize(node.set(body=body))
+
+	def visit_Block(self, node):
+		body = []
+		for stmt in node.body:
+			stmt = yield stmt
+			# blocks do not open a scope, thus nested ones can be inlined
+			body += stmt.body if isinstance(stmt, ir.Block) else [stmt]
+		return node.set(body=body)
+
+	def visit_Expr(self, node):
+		# only statements contain loops
+		return node
+
+def optimize_loops(fun):
+	""" optimized version of the type checked `fun` and the statistics """
+	result, optimizer = LoopOptimizer.run(fun)
+	return result, optimizer.stats()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# compiles type checked FuncDefs to Python functions
+#
+# Semantics of the generated code:
+#  * Int is a Python int, Div and Mod on Int are floor division and modulo
+#  * And/Or are bitwise on Int and logical on Bool
+#  * For loops run from `min` (inclusive) to `max` (exclusive)
+#  * array arguments can be any mutable sequence (list, array, numpy array)
+#  * local scalars start out as 0, 0.0 or False
+# IR names that are Python keywords or start with an underscore are
+# renamed, thus they cannot clash with each other or the helpers below.
+
+import ast, keyword
+import astor
+import typed as kast
+import irtypes as ir
+from typechecker import TypeChecker
+
+_zero = {ir.Type.Int: 0, ir.Type.Float: 0.0, ir.Type.Bool: False}
+_cmp = {ir.Cop.EQ: ast.Eq, ir.Cop.NE: ast.NotEq, ir.Cop.LT: ast.Lt,
+        ir.Cop.GT: ast.Gt, ir.Cop.LE: ast.LtE, ir.Cop.GE: ast.GtE}
+_arith = {ir.Bop.Add: ast.Add, ir.Bop.Sub: ast.Sub, ir.Bop.Mul: ast.Mult, ir.Bop.Mod: ast.Mod,
+          ir.Bop.And: ast.BitAnd, ir.Bop.Or: ast.BitOr}
+# builtins are passed in under private names, IR names cannot shadow them
+_helpers = {'_int': int, '_float': float, '_bool': bool, '_range': range}
+
+def py_name(name):
+	if keyword.iskeyword(name) or name.startswith('_'):
+		return '_v_' + name
+	return name
+
+def _load(name): return ast.Name(id=py_name(name), ctx=ast.Load())
+def _store(name): return ast.Name(id=py_name(name), ctx=ast.Store())
+def _call(fun, arg): return ast.Call(func=ast.Name(id=fun, ctx=ast.Load()), args=[arg], keywords=[])
+
+def is_typed(fun):
+	""" True if all expressions of `fun` carry a type """
+	return all(nn.type is not None for nn in kast.walk(fun) if isinstance(nn, ir.Expr))
+
+def local_types(fun):
+	""" name -> type of all names that are assigned in `fun` but are no arguments """
+	symbols = {}
+	for nn in kast.walk(fun):
+		if isinstance(nn, ir.Assign): symbols[nn.ref.name] = nn.ref.type
+		elif isinstance(nn, ir.For): symbols[nn.var] = ir.Type.Int
+	for name in fun.args: symbols.pop(name, None)
+	return symbols
+
+def restore_locals(fun, original):
+	""" `fun` with zero initializations of the locals of `original` that
+	    `fun` still reads but no longer assigns, e.g. because a pass
+	    removed their only assignment """
+	read = {nn.name for nn in kast.walk(fun) if isinstance(nn, ir.Ref)}
+	kept = local_types(fun)
+	lost = [(name, tt) for name, tt in sorted(local_types(original).items())
+	        if name not in kept and name in read]
+	if not lost: return fun
+	init = [ir.Assign(ref=ir.Ref(name=name, index=None, type=tt), val=_constant(tt, _zero[tt])) for name, tt in lost]
+	body = fun.body.body if isinstance(fun.body, ir.Block) else [fun.body]
+	return fun.set(body=ir.Block(body=init + body))
+
+def _constant(tt, value):
+	cls = {ir.Type.Int: ir.IntConst, ir.Type.Float: ir.FloatConst, ir.Type.Bool: ir.BoolConst}[tt]
+	return cls(val=value, type=tt)
+
+class PythonLowering(kast.Visitor):
+	""" translates a type checked FuncDef into a Python ast.Module """
+	def visit_FuncDef(self, node):
+		body = []
+		for name, tt in sorted(local_types(node).items()):
+			if tt.is_array():
+				raise NotImplementedError("local array `{}` needs a size, only arguments can be arrays".format(name))
+			body.append(ast.Assign(targets=[_store(name)], value=ast.Constant(value=_zero[tt])))
+		body += self.stmts(node.body)
+		args = ast.arguments(posonlyargs=[], args=[ast.arg(arg=py_name(aa)) for aa in node.args],
+		                     kwonlyargs=[], kw_defaults=[], defaults=[])
+		fun = ast.FunctionDef(name=py_name(node.name), args=args, body=body or [ast.Pass()],
+		                      decorator_list=[], returns=None)
+		return ast.fix_missing_locations(ast.Module(body=[fun], type_ignores=[]))
+
+	def stmts(self, node):
+		""" list of Python statements, Blocks are flattened and handlers
+		    may return a list of statements """
+		if node is None: return []
+		if isinstance(node, ir.Block):
+			return [ss for stmt in node.body for ss in self.stmts(stmt)]
+		result = self.visit(node)
+		return result if isinstance(result, list) else [result]
+
+	def visit_Assign(self, node):
+		if node.ref.index is None:
+			target = _store(node.ref.name)
+		else:
+			target = ast.Subscript(value=_load(node.ref.name), slice=self.visit(node.ref.index), ctx=ast.Store())
+		return ast.Assign(targets=[target], value=self.visit(node.val))
+
+	def visit_If(self, node):
+		return ast.If(test=self.visit(node.cond), body=self.stmts(node.body) or [ast.Pass()],
+		              orelse=self.stmts(node.elseBody))
+
+	def visit_For(self, node):
+		bounds = ast.Call(func=ast.Name(id='_range', ctx=ast.Load()),
+		                  args=[self.visit(node.min), self.visit(node.max)], keywords=[])
+		return ast.For(target=_store(node.var), iter=bounds,
+		               body=self.stmts(node.body) or [ast.Pass()], orelse=[])
+
+	def visit_Return(self, node):
+		return ast.Return(value=self.visit(node.val))
+
+	def visit_Ref(self, node):
+		if node.index is None: return _load(node.name)
+		return ast.Subscript(value=_load(node.name), slice=self.visit(node.index), ctx=ast.Load())
+
+	def visit_IntConst(self, node): return ast.Constant(value=node.val)
+	def visit_FloatConst(self, node): return ast.Constant(value=node.val)
+	def visit_BoolConst(self, node): return ast.Constant(value=node.val)
+	def visit_VoidConst(self, node): return ast.Constant(value=None)
+	def visit_CastToInt(self, node): return _call('_int', self.visit(node.expr))
+	def visit_CastToFloat(self, node): return _call('_float', self.visit(node.expr))
+	def visit_CastToBool(self, node): return _call('_bool', self.visit(node.expr))
+
+	def visit_BinOp(self, node):
+		if node.op == ir.Bop.Div:
+			op = ast.FloorDiv() if node.type == ir.Type.Int else ast.Div()
+		elif node.op in (ir.Bop.And, ir.Bop.Or) and node.type == ir.Type.Float:
+			raise TypeError("{} is not defined on Float".format(node.op))
+		else:
+			op = _arith[node.op]()
+		return ast.BinOp(left=self.visit(node.left), op=op, right=self.visit(node.right))
+
+	def visit_CmpOp(self, node):
+		return ast.Compare(left=self.visit(node.left), ops=[_cmp[node.op]()], comparators=[self.visit(node.right)])
+
+	def visit_UnOp(self, node):
+		op = ast.USub() if node.op == ir.Uop.Neg else ast.Not()
+		return ast.UnaryOp(op=op, operand=self.visit(node.e))
+
+	def generic_visit(self, node):
+		raise NotImplementedError("cannot compile nodes of type {}".format(type(node)))
+
+class Compiler:
+	""" compiles FuncDefs to Python functions and caches the result
+
+	FuncDefs are interned, thus structurally equal functions share a
+	cache entry and are only compiled once. Functions that are not type
+	checked yet are type checked first.
+	"""
+	lowering = PythonLowering
+	# globals of the generated code
+	helpers = _helpers
+	def __init__(self):
+		self.cache = {}
+		self.compiled = 0
+	def to_module(self, fun):
+		""" Python ast.Module that defines `fun` """
+		assert isinstance(fun, ir.FuncDef)
+		if not is_typed(fun): fun = TypeChecker.analyze(fun)[0]
+		return self.lowering().visit(fun)
+	def source(self, fun):
+		return astor.to_source(self.to_module(fun))
+	def compile(self, fun):
+		compiled = self.cache.get(fun)
+		if compiled is not None: return compiled
+		module = self.to_module(fun)
+		code = compile(module, "<ir {}>".format(fun.name), "exec")
+		namespace = dict(self.helpers)
+		exec(code, namespace)
+		compiled = namespace[py_name(fun.name)]
+		self.cache[fun] = compiled
+		self.compiled += 1
+		return compiled
+	def clear(self):
+		self.cache.clear()
+
+default_compiler = Compiler()
+
+def compile_function(fun):
+	""" returns a Python function that executes `fun` """
+	return default_compiler.compile(fun)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# constant folding and algebraic simplification of type checked FuncDefs
+#
+# All rewrites keep the semantics documented in pycompile.py, including
+# errors: divisions by a constant zero are not folded and operands are
+# only dropped (e.g. `x * 0`) if evaluating them cannot fail, i.e. if they
+# contain no array accesses, divisions or casts from Float to Int.
+
+import operator
+import typed as kast
+import irtypes as ir
+from pycompile import is_typed, restore_locals
+
+_cmp = {ir.Cop.EQ: operator.eq, ir.Cop.NE: operator.ne, ir.Cop.LT: operator.lt,
+        ir.Cop.GT: operator.gt, ir.Cop.LE: operator.le, ir.Cop.GE: operator.ge}
+_arith = {ir.Bop.Add: operator.add, ir.Bop.Sub: operator.sub, ir.Bop.Mul: operator.mul,
+          ir.Bop.And: operator.and_, ir.Bop.Or: operator.or_}
+_constants = {ir.Type.Int: (ir.IntConst, int), ir.Type.Float: (ir.FloatConst, float),
+              ir.Type.Bool: (ir.BoolConst, bool)}
+
+def _is_const(node):
+	return isinstance(node, (ir.IntConst, ir.FloatConst, ir.BoolConst))
+
+def _const(tt, value):
+	cls, conv = _constants[tt]
+	return cls(val=conv(value), type=tt)
+
+def _is_value(node, value):
+	return _is_const(node) and type(node.val) is type(value) and node.val == value
+
+def _cannot_fail(expr):
+	""" True if evaluating `expr` never raises """
+	for nn in kast.walk(expr):
+		if isinstance(nn, ir.Ref) and nn.index is not None: return False
+		if isinstance(nn, ir.BinOp) and nn.op in (ir.Bop.Div, ir.Bop.Mod): return False
+		if isinstance(nn, ir.CastToInt) and nn.expr.type == ir.Type.Float: return False
+	return True
+
+class Simplifier(kast.IterativeTransformer):
+	""" simplifies a type checked FuncDef, counts the applied rewrites """
+	memoize = True
+	# validation level for the nodes built by the pass (None: keep current)
+	validation = None
+
+	@staticmethod
+	def run(fun):
+		""" returns the simplified `fun` and the Simplifier, see `stats` """
+		assert isinstance(fun, ir.FuncDef) and is_typed(fun)
+		simplifier = Simplifier()
+		with kast.validation(Simplifier.validation):
+			result = simplifier.visit(fun)
+		simplifier.nodes_before = kast.count_nodes(fun)
+		simplifier.nodes_after = kast.count_nodes(result)
+		return result, simplifier
+
+	def __init__(self):
+		super().__init__()
+		self.folded = 0
+		self.casts = 0
+		self.identities = 0
+		self.branches = 0
+		self.nodes_before = self.nodes_after = 0
+
+	def stats(self):
+		return {'folded': self.folded, 'casts': self.casts, 'identities': self.identities,
+		        'branches': self.branches, 'nodes_before': self.nodes_before,
+		        'nodes_after': self.nodes_after, 'eliminated': self.nodes_before - self.nodes_after}
+
+	############################################################################
+	# expressions
+
+	def _fold(self, node, compute):
+		""" constant computed by `compute()` with the type of `node`, None
+		    if evaluating it would fail at runtime """
+		try:
+			value = compute()
+		except (ArithmeticError, ValueError):
+			return None
+		self.folded += 1
+		return _const(node.type, value)
+
+	def visit_BinOp(self, node):
+		left = yield node.left
+		right = yield node.right
+		node = node.set(left=left, right=right)
+		op, tt = node.op, node.type
+		if _is_const(left) and _is_const(right):
+			if op in _arith and not (tt == ir.Type.Float and op in (ir.Bop.And, ir.Bop.Or)):
+				folded = self._fold(node, lambda: _arith[op](left.val, right.val))
+			elif op == ir.Bop.Div and tt == ir.Type.Int:
+				folded = self._fold(node, lambda: left.val // right.val)
+			elif op == ir.Bop.Div:
+				folded = self._fold(node, lambda: left.val / right.val)
+			elif op == ir.Bop.Mod:
+				folded = self._fold(node, lambda: left.val % right.val)
+			else:
+				folded = None
+			if folded is not None: return folded
+		return self._identity(node)
+
+	def _identity(self, node):
+		op, left, right, tt = node.op, node.left, node.right, node.type
+		result = None
+		if tt == ir.Type.Int:
+			if op == ir.Bop.Add and _is_value(left, 0): result = right
+			elif op in (ir.Bop.Add, ir.Bop.Sub) and _is_value(right, 0): result = left
+			elif op == ir.Bop.Mul and _is_value(left, 1): result = right
+			elif op in (ir.Bop.Mul, ir.Bop.Div) and _is_value(right, 1): result = left
+			elif op == ir.Bop.Mul and _is_value(left, 0) and _cannot_fail(right): result = left
+			elif op == ir.Bop.Mul and _is_value(right, 0) and _cannot_fail(left): result = right
+		elif tt == ir.Type.Bool and op in (ir.Bop.And, ir.Bop.Or):
+			# neutral element and the one that decides the result
+			neutral = op == ir.Bop.And
+			for const, other in ((left, right), (right, left)):
+				if _is_value(const, neutral): result = other
+				elif _is_value(const, not neutral) and _cannot_fail(other): result = const
+				if result is not None: break
+		if result is None: return node
+		self.identities += 1
+		return result
+
+	def visit_CmpOp(self, node):
+		left = yield node.left
+		right = yield node.right
+		if _is_const(left) and _is_const(right):
+			return self._fold(node, lambda: _cmp[node.op](left.val, right.val))
+		return node.set(left=left, right=right)
+
+	def visit_UnOp(self, node):
+		e = yield node.e
+		if _is_const(e):
+			if node.op == ir.Uop.Neg: return self._fold(node, lambda: -e.val)
+			return self._fold(node, lambda: not e.val)
+		if isinstance(e, ir.UnOp) and e.op == node.op:
+			self.identities += 1
+			return e.e
+		return node.set(e=e)
+
+	def _cast(self, node, tt):
+		expr = yield node.expr
+		# a cast of a Bool to Int or Float is exact, as is one of an Int to
+		# Float that is only tested for zero
+		while isinstance(expr, (ir.CastToInt, ir.CastToFloat)) and (
+				expr.expr.type == ir.Type.Bool or
+				(tt == ir.Type.Bool and isinstance(expr, ir.CastToFloat) and expr.expr.type == ir.Type.Int)):
+			self.casts += 1
+			expr = expr.expr
+		if expr.type == tt:
+			self.casts += 1
+			return expr
+		if _is_const(expr):
+			folded = self._fold(node, lambda: expr.val)
+			if folded is not None: return folded
+		return node.set(expr=expr)
+
+	def visit_CastToInt(self, node): return (yield from self._cast(node, ir.Type.Int))
+	def visit_CastToFloat(self, node): return (yield from self._cast(node, ir.Type.Float))
+	def visit_CastToBool(self, node): return (yield from self._cast(node, ir.Type.Bool))
+
+	############################################################################
+	# statements
+
+	def visit_If(self, node):
+		cond = yield node.cond
+		if isinstance(cond, ir.BoolConst):
+			self.branches += 1
+			taken = node.body if cond.val else node.elseBody
+			if taken is None: return ir.Block(body=[])
+			return (yield taken)
+		body = yield node.body
+		elseBody = None if node.elseBody is None else (yield node.elseBody)
+		if isinstance(elseBody, ir.Block) and not elseBody.body:
+			elseBody = None
+		return node.set(cond=cond, body=body, elseBody=elseBody)
+
+	def visit_For(self, node):
+		start = yield node.min
+		stop = yield node.max
+		if isinstance(start, ir.IntConst) and isinstance(stop, ir.IntConst) and start.val >= stop.val:
+			# the loop never runs
+			self.branches += 1
+			return ir.Block(body=[])
+		body = yield node.body
+		return node.set(min=start, max=stop, body=body)
+
+	def visit_Block(self, node):
+		body = []
+		for stmt in node.body:
+			stmt = yield stmt
+			# blocks do not open a scope, thus nested ones can be inlined
+			body += stmt.body if isinstance(stmt, ir.Block) else [stmt]
+		return node.set(body=body)
+
+	def visit_FuncDef(self, node):
+		body = yield node.body
+		# locals start out as zero, which pruned assignments may have been
+		# the only declaration of
+		return restore_locals(node.set(body=body), node)
+
+	# Assign and Return are rebuilt from their simplified children by
+	# IterativeTransformer.generic_visit
+
+def simplify(fun):
+	""" simplified version of the type checked `fun` and the statistics """
+	result, simplifier = Simplifier.run(fun)
+	return result, simplifier.stats()
@@ -6,8 +6,10 @@
 # This software may be modified and distributed under the terms
 # of the BSD license. See the LICENSE file for details.
 
-import ast
+import ast, pickle
 import astor
+import serialize
+import typed as kast
 import irtypes as ir
 
 def ensure_float(node):
@@ -22,13 +24,34 @@ def ensure_bool(node):
 	if node.type == ir.Type.Bool: return node
 	else: return ir.CastToBool(expr=node, type=ir.Type.Bool)
 
-class TypeChecker(ast.NodeVisitor):
-	@staticmethod
-	def analyze(ir_code):
-		tc = TypeChecker()
-		type_checked_ast = tc.visit(ir_code)
+class TypeChecker(kast.IterativeTransformer):
+	# Handlers that need typed children are generators: `yield node.x`
+	# type checks `node.x` without recursing on the Python stack.
+	# types cannot be redeclared, thus shared expressions only need to be
+	# checked once
+	memoize = True
+	# validation level for the nodes built by the checker (None: keep current)
+	validation = None
+	# identifies the results of this checker in a disk cache
+	version = 1
+
+	@classmethod
+	def analyze(cls, ir_code):
+		tc = cls()
+		with kast.validation(tc.validation):
+			type_checked_ast = tc.visit(ir_code)
 		return (type_checked_ast, tc.symbols)
 
+	@classmethod
+	def analyze_cached(cls, ir_code, cache):
+		""" like analyze, the result is kept in the diskcache.DiskCache `cache` """
+		encode = lambda result: pickle.dumps((serialize.dumps(result[0]), result[1]))
+		def decode(data):
+			fun, symbols = pickle.loads(data)
+			return serialize.loads(fun).root, symbols
+		return cache.cached('typecheck', cls.version, ir_code, lambda: cls.analyze(ir_code),
+		                    encode=encode, decode=decode)
+
 	# Your code here...
 
 	def __init__(self):
@@ -46,8 +69,8 @@ class TypeChecker(ast.NodeVisitor):
 
 	def visit_BinOp(self, node):
 		promote_bool_to_int = (ir.Bop.Add, ir.Bop.Sub, ir.Bop.Mul, ir.Bop.Div, ir.Bop.Mod)
-		left = self.visit(node.left)
-		right = self.visit(node.right)
+		left = yield node.left
+		right = yield node.right
 		if left.type == right.type:
 			if left.type == ir.Type.Bool and node.op in promote_bool_to_int:
 				return node.set(left=ensure_int(left), right=ensure_int(right), type=ir.Type.Int)
@@ -63,8 +86,8 @@ class TypeChecker(ast.NodeVisitor):
 				assert False, "should never get here!"
 
 	def visit_CmpOp(self, node):
-		left = self.visit(node.left)
-		right = self.visit(node.right)
+		left = yield node.left
+		right = yield node.right
 		if left.type == right.type:
 			return node.set(left=left, right=right, type=ir.Type.Bool)
 		else:
@@ -77,7 +100,7 @@ class TypeChecker(ast.NodeVisitor):
 				assert False, "should never get here!"
 
 	def visit_UnOp(self, node):
-		e = self.visit(node.e)
+		e = yield node.e
 		if node.op == ir.Uop.Neg:
 			e = ensure_int(e) if e.type == ir.Type.Bool else e
 		else:
@@ -87,7 +110,7 @@ class TypeChecker(ast.NodeVisitor):
 	def _check_index(self, ref):
 		assert isinstance(ref, ir.Ref)
 		if ref.index is None: return None
-		index = self.visit(ref.index)
+		index = yield ref.index
 		if index.type != ir.Type.Int:
 			raise TypeError("array indices must be 'Int', not '{}'".format(index.type))
 		return index
@@ -96,7 +119,7 @@ class TypeChecker(ast.NodeVisitor):
 		if node.name not in self.symbols:
 			raise NameError("name '{}' is not defined".format(node.name))
 		tt = self.symbols[node.name]
-		index = self._check_index(node)
+		index = yield from self._check_index(node)
 		has_index = index is not None
 		if has_index and not tt.is_array():
 			raise TypeError("'{}' object is not subscriptable".format(tt))
@@ -112,42 +135,43 @@ class TypeChecker(ast.NodeVisitor):
 	def visit_VoidConst(self, node):
 		return node.set(type=ir.Type.Void)
 	def visit_CastToFloat(self, node):
-		expr = self.visit(node.expr)
+		expr = yield node.expr
 		if expr.type == ir.Type.Float:
 			return expr
 		return ir.CastToFloat(expr=expr, type=ir.Type.Float)
 	def visit_CastToInt(self, node):
-		expr = self.visit(node.expr)
+		expr = yield node.expr
 		if expr.type == ir.Type.Int:
 			return expr
 		return ir.CastToInt(expr=expr, type=ir.Type.Int)
 	def visit_CastToBool(self, node):
-		expr = self.visit(node.expr)
+		expr = yield node.expr
 		if expr.type == ir.Type.Bool:
 			return expr
 		return ir.CastToBool(expr=expr, type=ir.Type.Bool)
 
 	def visit_Assign(self, node):
-		val = self.visit(node.val)
+		val = yield node.val
 		if val.type.is_array():
 			raise TypeError("cannot assign arrays!")
-		index = self._check_index(node.ref)
+		index = yield from self._check_index(node.ref)
 		tt = val.type if index is None else val.type.to_array()
 		self._declare_sym(node.ref.name, tt)
 		return ir.Assign(ref=node.ref.set(type=tt, index=index), val=val)
 
 	def visit_For(self, node):
-		start = self.visit(node.min)
+		start = yield node.min
 		if start.type != ir.Type.Int:
 			raise TypeError("Lower loop bound need to be of type 'Int', not '{}'".format(start.type))
-		stop = self.visit(node.max)
+		stop = yield node.max
 		if stop.type != ir.Type.Int:
 			raise TypeError("Upper loop bound need to be of type 'Int', not '{}'".format(stop.type))
 		self._declare_sym(node.var, ir.Type.Int)
-		return node.set(min=start, max=stop, body=self.visit(node.body))
+		body = yield node.body
+		return node.set(min=start, max=stop, body=body)
 
 	def visit_Return(self, node):
-		val = self.visit(node.val)
+		val = yield node.val
 		if self.return_type != val.type:
 			raise TypeError('Cannot return {} as {}'.format(val.type, self.return_type))
 		return ir.Return(val=val, type=val.type)
@@ -156,10 +180,9 @@ class TypeChecker(ast.NodeVisitor):
 		self.return_type = node.return_type
 		for name, tt in zip(node.args, node.arg_types):
 			self._declare_sym(name, tt)
-		typed_fun = node.map(self.visit, [ir.Stmt])
+		typed_fun = node.set(body=(yield node.body))
 		# TODO: if the return type is not None, make sure that there is no fall through
 		return typed_fun
 
-	def generic_visit(self, node):
-		# TODO: remove eventually!
-		return node.map(self.visit, [ir.Stmt, ir.Expr])
+	# all other nodes (Block, If) are rebuilt from their type checked
+	# children by IterativeTransformer.generic_visit
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# compiles For loops without cross-iteration dependencies to NumPy
+#
+# A loop is vectorized if its body only assigns to array elements, every
+# array that is written is only accessed at a single index that is affine
+# in the loop variable with a constant, non-zero stride, divisions only
+# divide by non-zero constants, no Float is cast to Int and the indices of
+# the other arrays do not read written arrays. The loop variable becomes an
+# index vector and every assignment a single NumPy operation over all
+# iterations.
+#
+# At runtime the vectorized version is used if all arrays of the loop are
+# numpy.ndarrays and all indices, read or written, are in bounds, otherwise
+# the scalar loop runs. The scalar loop also runs if an array that is written
+# shares memory with another array of the loop, e.g. the same array is
+# passed for two arguments.
+# Unlike the scalar code, Int arithmetic wraps around at 64 bit.
+
+import ast, copy
+import numpy as np
+import typed as kast
+import irtypes as ir
+from pycompile import PythonLowering, Compiler, compile_function, _helpers, _load, _store, _call, is_typed
+from interpreter import interpret
+from typechecker import TypeChecker
+
+_supported = (ir.Ref, ir.IntConst, ir.FloatConst, ir.BoolConst, ir.BinOp, ir.CmpOp, ir.UnOp,
+              ir.CastToInt, ir.CastToFloat, ir.CastToBool)
+
+def _names(expr):
+	return {nn.name for nn in kast.walk(expr) if isinstance(nn, ir.Ref)}
+
+def _constant(expr):
+	""" value of a (cast) constant, None for other expressions """
+	while isinstance(expr, (ir.CastToInt, ir.CastToFloat, ir.CastToBool)):
+		expr = expr.expr
+	if isinstance(expr, (ir.IntConst, ir.FloatConst, ir.BoolConst)): return expr.val
+	return None
+
+class LoopAnalysis:
+	""" decides whether the iterations of `loop` can run as array operations,
+	    `reason` explains why not """
+	def __init__(self, loop):
+		assert isinstance(loop, ir.For)
+		self.loop = loop
+		self.var = loop.var
+		# array name -> the index expression of all its accesses
+		self.written = {}
+		# names of all arrays that are accessed
+		self.arrays = []
+		# (array, index) of the reads of arrays that are not written, the
+		# reads in an index come before the read that uses it
+		self.reads = []
+		self.reason = self._analyze()
+
+	@property
+	def vectorizable(self):
+		return self.reason is None
+
+	def stride(self, index):
+		""" factor of the loop variable in `index`, None if it is not affine """
+		if self.var not in _names(index) and not (_names(index) & set(self.written)):
+			return 0
+		if isinstance(index, ir.Ref):
+			return 1 if index.name == self.var and index.index is None else None
+		if isinstance(index, ir.UnOp) and index.op == ir.Uop.Neg:
+			ss = self.stride(index.e)
+			return None if ss is None else -ss
+		if not isinstance(index, ir.BinOp): return None
+		left, right = self.stride(index.left), self.stride(index.right)
+		if left is None or right is None: return None
+		if index.op == ir.Bop.Add: return left + right
+		if index.op == ir.Bop.Sub: return left - right
+		if index.op == ir.Bop.Mul:
+			if isinstance(index.left, ir.IntConst): return index.left.val * right
+			if isinstance(index.right, ir.IntConst): return left * index.right.val
+			if left == 0 and right == 0: return 0
+		return None
+
+	def _analyze(self):
+		body = self.loop.body
+		stmts = body.body if isinstance(body, ir.Block) else [body]
+		for stmt in stmts:
+			if not isinstance(stmt, ir.Assign):
+				return "the body contains {}".format(type(stmt).__name__)
+			if stmt.ref.index is None:
+				return "the body assigns to scalar `{}`".format(stmt.ref.name)
+			name = stmt.ref.name
+			if self.written.get(name, stmt.ref.index) != stmt.ref.index:
+				return "`{}` is written at different indices".format(name)
+			self.written[name] = stmt.ref.index
+		for name, index in self.written.items():
+			if not self.stride(index):
+				return "`{}` is not written at an affine index with constant, non-zero stride".format(name)
+		for stmt in stmts:
+			for nn in kast.walk(stmt):
+				if nn is stmt: continue
+				if not isinstance(nn, _supported):
+					return "unsupported expression {}".format(type(nn).__name__)
+				if isinstance(nn, ir.BinOp) and nn.op in (ir.Bop.Div, ir.Bop.Mod):
+					if not _constant(nn.right):
+						return "division by a value that is not a non-zero constant"
+				if isinstance(nn, ir.CastToInt) and nn.expr.type == ir.Type.Float:
+					# NaN and infinity cannot be cast
+					return "a Float is cast to Int"
+				if isinstance(nn, ir.Ref) and nn.index is not None:
+					if self.written.get(nn.name, nn.index) != nn.index:
+						return "`{}` is accessed in other iterations".format(nn.name)
+					if nn.name not in self.arrays: self.arrays.append(nn.name)
+			self._add_reads(stmt.val)
+		for name, index in self.reads:
+			if _names(index) & set(self.written):
+				return "the index of `{}` depends on a written array".format(name)
+		return None
+
+	def _add_reads(self, expr):
+		for nn in kast.walk(expr):
+			if isinstance(nn, ir.Ref) and nn.index is not None and nn.name not in self.written:
+				self._add_reads(nn.index)
+				if (nn.name, nn.index) not in self.reads: self.reads.append((nn.name, nn.index))
+
+class VectorizingLowering(PythonLowering):
+	""" PythonLowering that emits NumPy code for independent loops """
+	def __init__(self):
+		super().__init__()
+		self.loops = 0
+		# (loop variable, index vector, (array, index) -> index variable) of the
+		# loop that is being vectorized
+		self.vector = None
+
+	def visit_For(self, node):
+		if self.vector is not None: return super().visit_For(node)
+		analysis = LoopAnalysis(node)
+		if not analysis.vectorizable: return super().visit_For(node)
+		nn = self.loops
+		self.loops += 1
+		lo, hi, ivec, ok = ("_{}{}".format(prefix, nn) for prefix in ('lo', 'hi', 'i', 'ok'))
+		# (array, index) -> variable of the index vector
+		index = {(name, ix): "_ix{}_{}".format(nn, ii)
+		         for ii, (name, ix) in enumerate(list(analysis.written.items()) + analysis.reads)}
+		name = lambda ident: ast.Name(id=ident, ctx=ast.Load())
+		assign = lambda target, value: ast.Assign(targets=[ast.Name(id=target, ctx=ast.Store())], value=value)
+		helper = lambda fun, *args: ast.Call(func=name(fun), args=list(args), keywords=[])
+		# the bounds are evaluated once, like the arguments of range
+		stmts = [assign(lo, self.visit(node.min)), assign(hi, self.visit(node.max)),
+		         assign(ok, helper('_arrays', ast.List(elts=[_load(aa) for aa in analysis.arrays], ctx=ast.Load()),
+		                           ast.Constant(value=tuple(analysis.arrays.index(aa) for aa in analysis.written))))]
+		self.vector = (node.var, ivec, {})
+		try:
+			checks = []
+			for (array, expr), ix in index.items():
+				checks.append([assign(ix, self.visit(expr)), assign(ok, helper('_in_range', name(ix), _load(array)))])
+				self.vector[2][(array, expr)] = ix
+			# an index vector is only computed if the ones of the reads in it
+			# are in bounds
+			prepare = []
+			for check in reversed(checks):
+				prepare = check + ([ast.If(test=name(ok), body=prepare, orelse=[])] if prepare else [])
+			prepare.insert(0, assign(ivec, helper('_arange', name(lo), name(hi))))
+			vector = self.stmts(node.body)
+		finally:
+			self.vector = None
+		stmts.append(ast.If(test=name(ok), body=prepare, orelse=[]))
+		# like a Python for loop, the loop variable keeps its last value
+		last = ast.If(test=ast.Compare(left=name(hi), ops=[ast.Gt()], comparators=[name(lo)]),
+		              body=[ast.Assign(targets=[_store(node.var)],
+		                               value=ast.BinOp(left=name(hi), op=ast.Sub(), right=ast.Constant(value=1)))],
+		              orelse=[])
+		scalar = ast.For(target=_store(node.var), iter=helper('_range', name(lo), name(hi)),
+		                 body=self.stmts(node.body) or [ast.Pass()], orelse=[])
+		stmts.append(ast.If(test=name(ok), body=vector + [last], orelse=[scalar]))
+		return stmts
+
+	def visit_Ref(self, node):
+		if self.vector is None: return super().visit_Ref(node)
+		var, ivec, index = self.vector
+		if node.index is None:
+			return ast.Name(id=ivec, ctx=ast.Load()) if node.name == var else _load(node.name)
+		ix = index.get((node.name, node.index))
+		if ix is not None:
+			return ast.Subscript(value=_load(node.name), slice=ast.Name(id=ix, ctx=ast.Load()), ctx=ast.Load())
+		return super().visit_Ref(node)
+
+	def visit_Assign(self, node):
+		if self.vector is None: return super().visit_Assign(node)
+		target = ast.Subscript(value=_load(node.ref.name), ctx=ast.Store(),
+		                       slice=ast.Name(id=self.vector[2][(node.ref.name, node.ref.index)], ctx=ast.Load()))
+		return ast.Assign(targets=[target], value=self.visit(node.val))
+
+	def visit_CastToInt(self, node):
+		if self.vector is None: return super().visit_CastToInt(node)
+		return _call('_vint', self.visit(node.expr))
+	def visit_CastToFloat(self, node):
+		if self.vector is None: return super().visit_CastToFloat(node)
+		return _call('_vfloat', self.visit(node.expr))
+	def visit_CastToBool(self, node):
+		if self.vector is None: return super().visit_CastToBool(node)
+		return _call('_vbool', self.visit(node.expr))
+	def visit_UnOp(self, node):
+		if self.vector is None or node.op == ir.Uop.Neg: return super().visit_UnOp(node)
+		return _call('_vnot', self.visit(node.e))
+
+def _arrays(arrays, written):
+	""" True if all `arrays` are ndarrays and the ones at the positions
+	    `written` do not share memory with any other """
+	if not all(isinstance(vv, np.ndarray) for vv in arrays): return False
+	return not any(jj != ii and np.shares_memory(arrays[ii], aa)
+	               for ii in written for jj, aa in enumerate(arrays))
+
+def _in_range(index, array):
+	# reads may use the same index in all iterations
+	index = np.asarray(index)
+	return index.ndim <= 1 and (index.size == 0 or (index.min() >= 0 and index.max() < len(array)))
+
+_vector_helpers = dict(_helpers, _arrays=_arrays, _in_range=_in_range, _arange=np.arange,
+                       _vint=lambda vv: np.asarray(vv).astype(np.int64),
+                       _vfloat=lambda vv: np.asarray(vv).astype(np.float64),
+                       _vbool=lambda vv: np.asarray(vv).astype(np.bool_),
+                       _vnot=np.logical_not)
+
+class VectorCompiler(Compiler):
+	lowering = VectorizingLowering
+	helpers = _vector_helpers
+
+default_vector_compiler = VectorCompiler()
+
+def compile_vectorized(fun):
+	""" returns a Python function that executes `fun` with vectorized loops """
+	return default_vector_compiler.compile(fun)
+
+def vectorization_report(fun):
+	""" LoopAnalysis of every For loop of `fun` """
+	if not is_typed(fun): fun = TypeChecker.analyze(fun)[0]
+	return [LoopAnalysis(nn) for nn in kast.walk(fun) if isinstance(nn, ir.For)]
+
+def _same(a, b):
+	if isinstance(a, (list, np.ndarray)) or isinstance(b, (list, np.ndarray)):
+		return np.array_equal(np.asarray(a), np.asarray(b), equal_nan=True)
+	if isinstance(a, float) or isinstance(b, float):
+		return a == b or (a != a and b != b)
+	return a == b
+
+def check_equivalence(fun, *args):
+	""" runs `fun` in the reference interpreter, compiled and vectorized on
+	    copies of `args` and raises an AssertionError if the return values
+	    or the final contents of the arguments differ """
+	runs = [("interpreter", lambda *aa: interpret(fun, *aa)),
+	        ("scalar", compile_function(fun)), ("vectorized", compile_vectorized(fun))]
+	results = []
+	for name, run in runs:
+		aa = copy.deepcopy(args)
+		results.append((name, run(*aa), aa))
+	ref_name, ref_ret, ref_args = results[0]
+	for name, ret, aa in results[1:]:
+		if not _same(ret, ref_ret):
+			raise AssertionError("{} returned {}, {} returned {}".format(name, ret, ref_name, ref_ret))
+		for arg_name, new, ref in zip(fun.args, aa, ref_args):
+			if not _same(new, ref):
+				raise AssertionError("`{}` differs after {}: {} vs {}".format(arg_name, name, new, ref))
+	return ref_ret
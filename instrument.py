@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# counts node allocations and times passes and visitor handlers
+#
+#	with instrument.profile() as prof:
+#		decoder = DeadCodeEliminationPass(decoder).decoder
+#	print(prof.report())
+#	prof.write_chrome_trace("trace.json")
+#
+# Instrumentation is installed by patching the constructors of all Node
+# classes, a few Node methods and the handler lookup of Visitor when a
+# profile starts and removed again when it ends, thus there is no overhead
+# at all while no profile is active.
+# Node classes that are defined while a profile is active are not counted.
+
+import contextlib, json, os, sys, threading, time, types
+import util.typed as typed
+
+# the profiler that is currently installed, if any
+active = None
+
+# indices into the per-class counters
+_COUNTERS = ('constructed', 'validated', 'copied', 'deduplicated', 'set', 'set_unchanged', 'field_checks')
+_CONSTRUCTED, _VALIDATED, _COPIED, _DEDUPLICATED, _SET, _SET_UNCHANGED, _FIELD_CHECKS = range(len(_COUNTERS))
+
+def _subclasses(cls):
+	todo, found = [cls], []
+	while todo:
+		for sub in todo.pop().__subclasses__():
+			if sub not in found:
+				found.append(sub)
+				todo.append(sub)
+	return found
+
+def _typed_modules():
+	""" util.typed and every other module that was loaded from the same file,
+	    e.g. the examples import it as `typed` """
+	path = os.path.realpath(typed.__file__)
+	modules = [typed]
+	for mod in list(sys.modules.values()):
+		ff = getattr(mod, '__file__', None)
+		if mod is not typed and ff and os.path.realpath(ff) == path:
+			modules.append(mod)
+	return modules
+
+class PassRecord:
+	def __init__(self, name, kind, start, seconds):
+		self.name = name
+		self.kind = kind
+		self.start = start
+		self.seconds = seconds
+	def to_dict(self):
+		return dict(self.__dict__)
+
+class Profiler:
+	""" collects counters and timings while it is installed
+
+	`handlers=False` skips timing visitor handlers, which is the most
+	expensive part. `trace_handlers=True` adds an event for every handler
+	call to the Chrome trace, which can get very large.
+	"""
+	def __init__(self, handlers=True, trace_handlers=False):
+		self.handlers_enabled = handlers
+		self.trace_handlers = trace_handlers
+		# node class -> list of counters, see _COUNTERS
+		self.nodes = {}
+		self.passes = []
+		# "Visitor.handler" -> [calls, seconds]
+		self.handlers = {}
+		self.events = []
+		self._t0 = time.perf_counter()
+		# time spent in nested handlers, per active handler
+		self._child_time = [0.0]
+		self._undo = []
+
+	def _counts(self, cls):
+		counts = self.nodes.get(cls)
+		if counts is None:
+			counts = self.nodes[cls] = [0] * len(_COUNTERS)
+		return counts
+
+	def _event(self, name, cat, start, seconds):
+		self.events.append({'name': name, 'cat': cat, 'ph': 'X', 'pid': os.getpid(),
+		                    'tid': threading.get_ident(),
+		                    'ts': (start - self._t0) * 1e6, 'dur': seconds * 1e6})
+
+	############################################################################
+	# installation
+
+	def _patch(self, obj, name, value):
+		self._undo.append((obj, name, obj.__dict__[name]))
+		setattr(obj, name, value)
+
+	def install(self):
+		for mod in _typed_modules():
+			self._install_nodes(mod)
+			if self.handlers_enabled:
+				self._install_visitors(mod)
+
+	def uninstall(self):
+		while self._undo:
+			obj, name, value = self._undo.pop()
+			setattr(obj, name, value)
+		for mod in _typed_modules():
+			for cls in [mod.Visitor] + _subclasses(mod.Visitor):
+				cls._dispatch.clear()
+
+	def _install_nodes(self, mod):
+		prof, policy = self, mod._policy
+		classes = _subclasses(mod.Node)
+		for cls in classes:
+			self._patch(cls, '__init__', self._counting_init(cls, cls.__dict__['__init__'], policy))
+		node = mod.Node
+		replace, set_, canonical, check = node._replace, node.set, mod._canonical, mod.Field.check
+		def _replace(self, changes):
+			prof._counts(self.__class__)[_COPIED] += 1
+			return replace(self, changes)
+		def set(self, **kwargs):
+			result = set_(self, **kwargs)
+			counts = prof._counts(self.__class__)
+			counts[_SET] += 1
+			if result is self: counts[_SET_UNCHANGED] += 1
+			return result
+		def _canonical(cls, node):
+			result = canonical(cls, node)
+			if result is not node: prof._counts(cls)[_DEDUPLICATED] += 1
+			return result
+		# fields are created per class, thus they identify their class
+		owner = {ff: cls for cls in classes for ff in cls._schema}
+		def field_check(self, value, old=None):
+			if policy.level and self in owner:
+				prof._counts(owner[self])[_FIELD_CHECKS] += 1
+			return check(self, value, old)
+		self._patch(node, '_replace', _replace)
+		self._patch(node, 'set', set)
+		self._patch(mod, '_canonical', _canonical)
+		self._patch(mod.Field, 'check', field_check)
+
+	def _counting_init(self, cls, init, policy):
+		counts = self._counts(cls)
+		def __init__(self, *args, **kwargs):
+			# constructors of subclasses may call this one through super()
+			if self.__class__ is cls:
+				counts[_CONSTRUCTED] += 1
+				if policy.level: counts[_VALIDATED] += 1
+			init(self, *args, **kwargs)
+		__init__.__qualname__ = init.__qualname__
+		return __init__
+
+	def _install_visitors(self, mod):
+		prof = self
+		resolve = mod.Visitor.__dict__['_resolve'].__func__
+		def _resolve(cls, node_cls):
+			handler = prof._timed_handler(cls, resolve(cls, node_cls))
+			cls._dispatch[node_cls] = handler
+			return handler
+		for cls in [mod.Visitor] + _subclasses(mod.Visitor):
+			cls._dispatch.clear()
+		self._patch(mod.Visitor, '_resolve', classmethod(_resolve))
+
+	############################################################################
+	# handler timing
+
+	def _timed_handler(self, visitor_cls, handler):
+		key = "{}.{}".format(visitor_cls.__name__, handler.__name__)
+		stats = self.handlers.setdefault(key, [0, 0.0])
+		def timed(visitor, node):
+			stats[0] += 1
+			result = self._run_timed(key, stats, handler, visitor, node)
+			if isinstance(result, types.GeneratorType):
+				return self._timed_generator(key, stats, result)
+			return result
+		return timed
+
+	def _run_timed(self, key, stats, fun, *args):
+		""" runs `fun` and adds the time spent outside of nested handlers to `stats` """
+		child_time = self._child_time
+		child_time.append(0.0)
+		start = time.perf_counter()
+		try:
+			return fun(*args)
+		finally:
+			elapsed = time.perf_counter() - start
+			own = elapsed - child_time.pop()
+			child_time[-1] += elapsed
+			stats[1] += own
+			if self.trace_handlers: self._event(key, 'handler', start, elapsed)
+
+	def _timed_generator(self, key, stats, gen):
+		# generator handlers of an IterativeTransformer run in steps,
+		# children are handled between the steps
+		value, error = None, None
+		while True:
+			try:
+				if error is None:
+					child = self._run_timed(key, stats, gen.send, value)
+				else:
+					child = self._run_timed(key, stats, gen.throw, error)
+			except StopIteration as stop:
+				return stop.value
+			try:
+				value, error = (yield child), None
+			except Exception as err:
+				value, error = None, err
+
+	############################################################################
+	# passes
+
+	def add_pass(self, name, kind, start, seconds):
+		""" records a pass that started at `start` (time.perf_counter) """
+		self.passes.append(PassRecord(name, kind, start - self._t0, seconds))
+		self._event(name, kind, start, seconds)
+
+	@contextlib.contextmanager
+	def span(self, name, kind='pass'):
+		""" times the body of a `with` block like a pass """
+		start = time.perf_counter()
+		try:
+			yield self
+		finally:
+			self.add_pass(name, kind, start, time.perf_counter() - start)
+
+	############################################################################
+	# reports
+
+	def to_dict(self):
+		nodes = {}
+		for cls, counts in self.nodes.items():
+			if any(counts):
+				nodes["{}.{}".format(cls.__module__, cls.__qualname__)] = dict(zip(_COUNTERS, counts))
+		handlers = {key: {'calls': calls, 'seconds': seconds}
+		            for key, (calls, seconds) in self.handlers.items() if calls}
+		return {'nodes': nodes, 'passes': [pp.to_dict() for pp in self.passes], 'handlers': handlers}
+
+	def report(self, limit=20):
+		""" text report with the `limit` most expensive entries of every table """
+		data = self.to_dict()
+		lines = ["{:<40} {:>11} {:>10} {:>8} {:>8} {:>8} {:>10} {:>8}".format(
+			"node class", "constructed", "validated", "copied", "dedup", "set", "unchanged", "checks")]
+		nodes = sorted(data['nodes'].items(), key=lambda kv: -(kv[1]['constructed'] + kv[1]['copied']))
+		for name, cc in nodes[:limit]:
+			lines.append("{:<40} {:>11} {:>10} {:>8} {:>8} {:>8} {:>10} {:>8}".format(
+				name, cc['constructed'], cc['validated'], cc['copied'], cc['deduplicated'],
+				cc['set'], cc['set_unchanged'], cc['field_checks']))
+		if data['passes']:
+			lines += ["", "{:<40} {:<16} {:>10}".format("pass", "kind", "time [ms]")]
+			for pp in data['passes']:
+				lines.append("{:<40} {:<16} {:>10.3f}".format(pp['name'], pp['kind'], pp['seconds'] * 1e3))
+		if data['handlers']:
+			lines += ["", "{:<56} {:>10} {:>10}".format("handler", "calls", "self [ms]")]
+			handlers = sorted(data['handlers'].items(), key=lambda kv: -kv[1]['seconds'])
+			for key, hh in handlers[:limit]:
+				lines.append("{:<56} {:>10} {:>10.3f}".format(key, hh['calls'], hh['seconds'] * 1e3))
+		return "\n".join(lines)
+
+	def write_json(self, filename):
+		with open(filename, 'w') as ff:
+			json.dump(self.to_dict(), ff, indent=1, sort_keys=True)
+
+	def write_chrome_trace(self, filename):
+		""" trace event file for chrome://tracing or https://ui.perfetto.dev """
+		with open(filename, 'w') as ff:
+			json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, ff)
+
+def enable(**kwargs):
+	""" installs and returns a new Profiler, see Profiler for the arguments """
+	global active
+	if active is not None:
+		raise RuntimeError("instrumentation is already enabled")
+	prof = Profiler(**kwargs)
+	prof.install()
+	active = prof
+	return prof
+
+def disable():
+	""" removes the active Profiler and returns it """
+	global active
+	prof, active = active, None
+	if prof is not None: prof.uninstall()
+	return prof
+
+@contextlib.contextmanager
+def profile(**kwargs):
+	prof = enable(**kwargs)
+	try:
+		yield prof
+	finally:
+		disable()
@@ -7,29 +7,183 @@
 # of the BSD license. See the LICENSE file for details.
 
 
+import array, weakref
 import util.typed as typed
 from util.typed import _typing_aware_isinstance
 
+class NodeIndex:
+	""" assigns dense integer ids to nodes for as long as they are alive
+
+	Metadata columns are indexed by these ids. When a node is collected
+	its id is released, the entries of all columns are dropped and the
+	id is reused for the next node.
+	"""
+	def __init__(self):
+		self._ids = {}      # id(node) -> dense id
+		self._refs = []     # dense id -> weakref to node or None
+		self._free = []
+		self._columns = weakref.WeakSet()
+	def __len__(self):
+		return len(self._ids)
+	def lookup(self, node):
+		""" dense id of `node` or None if it does not have one """
+		return self._ids.get(id(node))
+	def get_id(self, node):
+		""" dense id of `node`, a new one is assigned if necessary """
+		dense = self._ids.get(id(node))
+		if dense is not None: return dense
+		dense = self._free.pop() if self._free else len(self._refs)
+		key = id(node)
+		ref = weakref.ref(node, lambda _, dense=dense, key=key: self._release(dense, key))
+		if dense == len(self._refs): self._refs.append(ref)
+		else: self._refs[dense] = ref
+		self._ids[key] = dense
+		return dense
+	def node(self, dense):
+		ref = self._refs[dense] if dense < len(self._refs) else None
+		return None if ref is None else ref()
+	def _release(self, dense, key):
+		del self._ids[key]
+		self._refs[dense] = None
+		for column in self._columns:
+			column.clear(dense)
+		self._free.append(dense)
+	def register(self, column):
+		self._columns.add(column)
+
+default_index = NodeIndex()
+
+_MISSING = object()
+
+class ObjectColumn:
+	""" stores arbitrary python values """
+	def __init__(self):
+		self.values = []
+	def _grow(self, size):
+		if size > len(self.values):
+			self.values.extend([_MISSING] * (size - len(self.values)))
+	def get(self, dense):
+		return self.values[dense] if dense < len(self.values) else _MISSING
+	def set(self, dense, value):
+		self._grow(dense + 1)
+		self.values[dense] = value
+	def clear(self, dense):
+		if dense < len(self.values): self.values[dense] = _MISSING
+	def __contains__(self, dense):
+		return self.get(dense) is not _MISSING
+	def present(self):
+		return (ii for ii, vv in enumerate(self.values) if vv is not _MISSING)
+
+class WeakColumn(ObjectColumn):
+	""" stores nodes and lists of nodes through weak references, an entry
+	    is missing once one of its nodes was collected """
+	def set(self, dense, value):
+		refs = [weakref.ref(vv) for vv in value] if isinstance(value, list) else weakref.ref(value)
+		super().set(dense, refs)
+	def get(self, dense):
+		refs = super().get(dense)
+		if refs is _MISSING: return refs
+		if not isinstance(refs, list):
+			value = refs()
+			return _MISSING if value is None else value
+		values = [rr() for rr in refs]
+		return _MISSING if any(vv is None for vv in values) else values
+	def present(self):
+		return (ii for ii in super().present() if self.get(ii) is not _MISSING)
+
+class ArrayColumn:
+	""" stores int, float or bool values in an `array.array` """
+	typecodes = {int: 'q', float: 'd', bool: 'B'}
+	def __init__(self, entry_type):
+		self.entry_type = entry_type
+		self.values = array.array(self.typecodes[entry_type])
+		self.valid = bytearray()
+	def _grow(self, size):
+		if size > len(self.valid):
+			missing = size - len(self.valid)
+			self.values.extend([0] * missing)
+			self.valid.extend(bytes(missing))
+	def get(self, dense):
+		if dense < len(self.valid) and self.valid[dense]:
+			return self.entry_type(self.values[dense])
+		return _MISSING
+	def set(self, dense, value):
+		self._grow(dense + 1)
+		self.values[dense] = value
+		self.valid[dense] = 1
+	def clear(self, dense):
+		if dense < len(self.valid): self.valid[dense] = 0
+	def __contains__(self, dense):
+		return dense < len(self.valid) and self.valid[dense] == 1
+	def present(self):
+		return (ii for ii, vv in enumerate(self.valid) if vv)
+
 class MetaDataField:
-	def __init__(self, name, defined_on, entry_type, readonly=True):
+	""" metadata of type `entry_type` attached to nodes of type `defined_on`
+
+	Entries are stored in a column indexed by the dense ids of a NodeIndex,
+	they do not keep their nodes alive and are dropped when the node is
+	collected. `storage='array'` stores int/float/bool entries compactly.
+	An entry that refers back to its node (e.g. the dfa that contains a
+	state) keeps the node alive for as long as the field exists, unless it
+	is stored with `storage='weak'`, which holds entries that are nodes or
+	lists of nodes through weak references.
+	"""
+	def __init__(self, name, defined_on, entry_type, readonly=True, storage='object', index=None):
 		self.name = name
 		self.entry_type = entry_type
 		self.defined_on = defined_on
 		self.readonly = readonly
 		# check invariances
 		assert issubclass(self.defined_on, typed.Node)
+		# describes the entry type like a node field
+		self._entry = typed.Field(name, entry_type)
 		# dynamic data
-		self.entries = {}
+		self.index = default_index if index is None else index
+		if storage == 'object':
+			self.column = ObjectColumn()
+		elif storage == 'array':
+			if entry_type not in ArrayColumn.typecodes:
+				raise TypeError("{} cannot be stored in an array".format(entry_type))
+			self.column = ArrayColumn(entry_type)
+		elif storage == 'weak':
+			element = self._entry.element_type if self._entry.container else self._entry.value_type
+			if self._entry.container not in (None, list) or not issubclass(element, typed.Node):
+				raise TypeError("{} cannot be stored weakly".format(entry_type))
+			self.column = WeakColumn()
+		else:
+			raise ValueError("unknown storage {}".format(storage))
+		self.index.register(self.column)
 
 	def _check_node_type(self, node):
-		if not _typing_aware_isinstance(node, self.defined_on):
+		if not isinstance(node, self.defined_on):
 			raise TypeError("{} not defined on nodes of type {}".format(self.name, type(node)))
 	def _check_writable(self):
 		if self.readonly:
 			raise RuntimeError("trying to write readonly metadata {}".format(self.name))
 	def _check_value_type(self, value):
-		if not _typing_aware_isinstance(value, self.entry_type):
+		try:
+			self._entry.check(value)
+		except TypeError:
 			raise TypeError("{} needs to be of type {} not {}".format(self.name, self.entry_type, type(value)))
+	def _check_value_types(self, values):
+		# the checks only depend on the type of a value (and of its
+		# elements), thus one value per distinct type is checked
+		level = typed.get_validation()
+		if not level: return
+		kinds = {}
+		for value in values: kinds.setdefault(type(value), value)
+		with typed.validation(typed.Validation.Shallow):
+			for value in kinds.values(): self._check_value_type(value)
+		entry = self._entry
+		if entry.container is None or level is not typed.Validation.Full: return
+		elements = {}
+		for value in values:
+			if value is not None:
+				for el in value: elements.setdefault(type(el), el)
+		for el in elements.values():
+			if not isinstance(el, entry.element_type):
+				raise TypeError("{} needs entries of type {} not {}".format(self.name, entry.element_type, type(el)))
 	def _check_is_list(self):
 		if not typed._is_list_type(self.entry_type):
 			raise TypeError("entry type {} of {} is not a list".format(self.entry_type, self.name))
@@ -38,60 +192,123 @@ class MetaDataField:
 		inner = typed._get_list_element_type(self.entry_type)
 		if not _typing_aware_isinstance(value, inner):
 			raise TypeError("{} needs to be of type {} not {}".format(self.name, inner, type(value)))
+	def _missing(self, node):
+		if typed._is_list_type(self.entry_type):
+			return []
+		raise KeyError("{} not set on node {}".format(self.name, node))
 
 	def set(self, node, value):
 		self._check_node_type(node)
 		self._check_value_type(value)
 		self._check_writable()
-		self.entries[node] = value
+		self.column.set(self.index.get_id(node), value)
 		return value
 
 	def get(self, node):
 		self._check_node_type(node)
-		if not node in self.entries:
-			if typed._is_list_type(self.entry_type):
-				return []
-			raise KeyError("{} not set on node {}".format(self.name, node))
-		return self.entries[node]
+		dense = self.index.lookup(node)
+		value = _MISSING if dense is None else self.column.get(dense)
+		if value is _MISSING:
+			return self._missing(node)
+		return value
 
 	def add(self, node, value):
 		self._check_node_type(node)
 		self._check_list_entry_type(value)
 		self._check_writable()
-		if node not in self.entries:
-			self.entries[node] = []
-		self.entries[node].append(value)
+		dense = self.index.get_id(node)
+		entries = self.column.get(dense)
+		if entries is _MISSING: entries = []
+		entries.append(value)
+		# a WeakColumn returns new lists
+		self.column.set(dense, entries)
+
+	def set_many(self, nodes, values):
+		""" sets entries for a batch of nodes, types are checked once per batch """
+		nodes, values = list(nodes), list(values)
+		if len(nodes) != len(values):
+			raise ValueError("{} nodes but {} values".format(len(nodes), len(values)))
+		self._check_writable()
+		wrong = [nn for nn in nodes if not isinstance(nn, self.defined_on)]
+		if wrong: self._check_node_type(wrong[0])
+		self._check_value_types(values)
+		get_id, column_set = self.index.get_id, self.column.set
+		for node, value in zip(nodes, values):
+			column_set(get_id(node), value)
+
+	def get_many(self, nodes):
+		""" returns the entries of a batch of nodes """
+		nodes = list(nodes)
+		wrong = [nn for nn in nodes if not isinstance(nn, self.defined_on)]
+		if wrong: self._check_node_type(wrong[0])
+		lookup, column_get = self.index.lookup, self.column.get
+		values = []
+		for node in nodes:
+			dense = lookup(node)
+			value = _MISSING if dense is None else column_get(dense)
+			values.append(self._missing(node) if value is _MISSING else value)
+		return values
+
+	def __contains__(self, node):
+		dense = self.index.lookup(node)
+		return dense is not None and dense in self.column
+
+	def items(self):
+		""" (node, entry) pairs of all live nodes with an entry """
+		for dense in list(self.column.present()):
+			node = self.index.node(dense)
+			if node is not None:
+				yield node, self.column.get(dense)
+
+	def __len__(self):
+		return sum(1 for _ in self.column.present())
 
 class MetaDataProxy:
 	# the `.meta` object of typed.Node
 	def __init__(self, node, repo):
-		self.node = node
-		self.repo = repo
+		object.__setattr__(self, 'node', node)
+		object.__setattr__(self, 'repo', repo)
 		# check invariances
 		assert isinstance(self.node, typed.Node)
 		assert isinstance(self.repo, MetaRepository)
-	def update_repo(self):
-		self.repo = repo
-		assert isinstance(self.repo, MetaRepository)
+	def update_repo(self, repo):
+		assert isinstance(repo, MetaRepository)
+		object.__setattr__(self, 'repo', repo)
 	def __setattr__(self, name, value):
-		self.repo.get_field(name).set(self, value)
+		self.repo.get_field(name).set(self.node, value)
 	def __getattr__(self, name):
-		self.repo.get_field(name).get(self)
+		return self.repo.get_field(name).get(self.node)
+	def __contains__(self, name):
+		return name in self.repo.fields and self.node in self.repo.fields[name]
 
 
 class MetaRepository:
 	# keeps track of metadata
-	def __init__(self):
+	def __init__(self, index=None):
 		self.fields = {}
+		self.index = default_index if index is None else index
 	def add_field(self, field):
 		assert isinstance(field, MetaDataField)
 		if field.name in self.fields:
 			raise RuntimeError("field {} already defined".format(field.name))
 		self.fields[field.name] = field
+		return field
+	def create_field(self, name, defined_on, entry_type, **kwargs):
+		""" creates a new field that uses the node index of this repository """
+		return self.add_field(MetaDataField(name, defined_on, entry_type, index=self.index, **kwargs))
 	def get_field(self, name):
 		if name not in self.fields:
 			raise KeyError("undefined metadata field {}".format(name))
 		return self.fields[name]
+	def meta(self, node):
+		""" returns the `.meta` proxy of `node` """
+		return MetaDataProxy(node, self)
+
+default_repository = MetaRepository()
+
+# `node.meta` is the proxy of `node` in the default repository, e.g.
+# `node.meta.width = 3` for a field `width` created on default_repository
+typed.Node.meta = property(default_repository.meta)
 
 def to_list(value):
 	if isinstance(value, list): return value
@@ -99,4 +316,3 @@ def to_list(value):
 	return [value]
 def to_set(value):
 	return set(to_list(value))
-
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# runs analyses and transformations over an IR and caches analysis results
+
+import time, weakref
+import util.typed as typed
+import util.instrument as instrument
+
+class Analysis:
+	def __init__(self, name, run, requires, version=None, encode=None, decode=None):
+		self.name = name
+		self.run = run
+		self.requires = list(requires)
+		self.version = version
+		# encode(result, root) -> bytes, decode(bytes, root) -> result
+		self.encode = encode
+		self.decode = decode
+
+class Transformation:
+	def __init__(self, name, run, requires, invalidates, version=None):
+		self.name = name
+		self.run = run
+		self.requires = list(requires)
+		self.version = version
+		# None: invalidates all analyses
+		self.invalidates = None if invalidates is None else set(invalidates)
+
+class PassStats:
+	def __init__(self, name, kind, seconds, nodes_before, nodes_after, cached=False):
+		self.name = name
+		self.kind = kind
+		self.seconds = seconds
+		self.nodes_before = nodes_before
+		self.nodes_after = nodes_after
+		self.cached = cached
+	def to_dict(self):
+		return dict(self.__dict__)
+
+class PassManager:
+	""" Analyses are functions `run(root, **required_analyses)` whose result
+	    is cached per IR root.
+	    Transformations are functions `run(root, **required_analyses)` that
+	    return a new root. Analyses that a transformation does not declare
+	    to invalidate are carried over to the new root.
+	    With a diskcache.DiskCache as `cache`, the results of passes that
+	    have a `version` are stored on disk. Analyses additionally need
+	    functions to encode their result and to decode it for a root.
+	"""
+	def __init__(self, count_nodes=True, cache=None):
+		self.analyses = {}
+		self.transformations = {}
+		self.count_nodes = count_nodes
+		self.cache = cache
+		self.stats = []
+		# root -> {analysis name: result}
+		self._results = weakref.WeakKeyDictionary()
+
+	def _check_name(self, name):
+		if name in self.analyses or name in self.transformations:
+			raise RuntimeError("pass {} already defined".format(name))
+
+	def add_analysis(self, name, run, requires=(), version=None, encode=None, decode=None):
+		self._check_name(name)
+		self.analyses[name] = Analysis(name, run, requires, version, encode, decode)
+
+	def add_transformation(self, name, run, requires=(), invalidates=None, version=None):
+		self._check_name(name)
+		self.transformations[name] = Transformation(name, run, requires, invalidates, version)
+
+	def _count(self, root):
+		return typed.count_nodes(root) if self.count_nodes else None
+
+	def _requirements(self, pp, root):
+		return {name: self.get(name, root) for name in pp.requires}
+
+	def _cached(self, pp):
+		return self.cache is not None and pp.version is not None
+
+	def _run(self, pp, root, args, **cache_args):
+		""" runs pass `pp` on `root` or loads its result from the disk cache,
+		    returns the result and whether it was loaded. The required
+		    analyses `args` are only computed on a cache miss if they are None """
+		if args is not None:
+			return pp.run(root, **args), False
+		run = lambda: pp.run(root, **self._requirements(pp, root))
+		hits = self.cache.hits
+		result = self.cache.cached(pp.name, pp.version, root, run, **cache_args)
+		return result, self.cache.hits > hits
+
+	def get(self, name, root):
+		""" returns the (cached) result of analysis `name` on `root` """
+		if name not in self.analyses:
+			raise KeyError("undefined analysis {}".format(name))
+		results = self._results.setdefault(root, {})
+		if name in results:
+			self.stats.append(PassStats(name, "analysis", 0.0, None, None, cached=True))
+			return results[name]
+		analysis = self.analyses[name]
+		cached = self._cached(analysis) and analysis.encode is not None
+		args = None if cached else self._requirements(analysis, root)
+		start = time.perf_counter()
+		result, loaded = self._run(analysis, root, args, encode=lambda result: analysis.encode(result, root),
+		                           decode=lambda data: analysis.decode(data, root))
+		seconds = time.perf_counter() - start
+		if instrument.active is not None:
+			instrument.active.add_pass(name, "analysis", start, seconds)
+		nodes = self._count(root)
+		self.stats.append(PassStats(name, "analysis", seconds, nodes, nodes, cached=loaded))
+		results[name] = result
+		return result
+
+	def invalidate(self, root, names=None):
+		""" drops cached analysis results of `root` (all if `names` is None) """
+		results = self._results.get(root, {})
+		for name in list(results.keys()):
+			if names is None or name in names:
+				del results[name]
+
+	def run(self, passes, root):
+		""" runs the transformations `passes` in order, returns the new root """
+		for name in passes:
+			if name not in self.transformations:
+				raise KeyError("undefined transformation {}".format(name))
+			tt = self.transformations[name]
+			args = None if self._cached(tt) else self._requirements(tt, root)
+			before = self._count(root)
+			start = time.perf_counter()
+			new_root, loaded = self._run(tt, root, args)
+			seconds = time.perf_counter() - start
+			if instrument.active is not None:
+				instrument.active.add_pass(name, "transformation", start, seconds)
+			self.stats.append(PassStats(name, "transformation", seconds, before, self._count(new_root),
+			                            cached=loaded))
+			if new_root is not root:
+				old = self._results.get(root, {})
+				self._results[new_root] = {nn: rr for nn, rr in old.items()
+				                           if tt.invalidates is not None and nn not in tt.invalidates}
+			root = new_root
+		return root
+
+	def report(self):
+		lines = ["{:<24} {:<23} {:>10} {:>10} {:>10}".format(
+			"pass", "kind", "time [ms]", "nodes in", "nodes out")]
+		fmt = lambda nn: "-" if nn is None else str(nn)
+		for ss in self.stats:
+			kind = ss.kind + (" (cached)" if ss.cached else "")
+			lines.append("{:<24} {:<23} {:>10.3f} {:>10} {:>10}".format(
+				ss.name, kind, ss.seconds * 1e3, fmt(ss.nodes_before), fmt(ss.nodes_after)))
+		return "\n".join(lines)
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# compact binary format for typed.Node trees
+#
+# layout (all integers little endian):
+#   header:  magic, version, root node, offsets of the five pools
+#   pools:   strings, classes, enums, objects, nodes
+#            every pool is a count, the offset width (4 or 8 bytes), a table
+#            of count + 1 offsets and the concatenated entries
+# Node records only contain the field values, their encoding follows from
+# the typed fields of the node class: node references, enums and strings
+# are indices into the respective pool, ints are zigzag varints, floats
+# are doubles and all other values are pickled into the object pool.
+# Values whose type is not exactly the scalar type of their field (e.g. True
+# in an int field) are pickled as well, thus they keep their type. They are
+# flagged by the lowest bit of ints and string indices, by the value 2 of
+# bools and by a leading byte of floats.
+# Nodes are stored children first and every node only once, thus shared
+# subtrees stay shared.
+
+import ast, enum, importlib, mmap, pickle, struct
+
+MAGIC = b'TYIR'
+VERSION = 2
+_header = struct.Struct('<4sHxxQQQQQQ')
+_u64 = struct.Struct('<Q')
+_f64 = struct.Struct('<d')
+
+################################################################################
+# encoding helpers
+
+def _write_varint(out, value):
+	assert value >= 0
+	while value >= 0x80:
+		out.append((value & 0x7f) | 0x80)
+		value >>= 7
+	out.append(value)
+
+def _read_varint(buf, pos):
+	value = shift = 0
+	while True:
+		byte = buf[pos]
+		pos += 1
+		value |= (byte & 0x7f) << shift
+		if byte < 0x80: return value, pos
+		shift += 7
+
+def _zigzag(value): return value * 2 if value >= 0 else -value * 2 - 1
+def _unzigzag(value): return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+def _is_node_class(tt):
+	# the same module can be imported twice (e.g. as `typed` and as
+	# `util.typed`), thus node classes are recognized by their schema
+	return issubclass(tt, ast.AST) and hasattr(tt, '_schema')
+
+def _kind(tt):
+	if _is_node_class(tt): return 'node'
+	if issubclass(tt, enum.Enum): return 'enum'
+	if tt is bool: return 'bool'
+	if tt is int: return 'int'
+	if tt is float: return 'float'
+	if tt is str: return 'str'
+	return 'object'
+
+# kind -> the only type that is stored natively
+_exact = {'bool': bool, 'int': int, 'float': float, 'str': str}
+
+def _field_kinds(cls):
+	""" (field, kind of the scalar values) for every field of `cls` """
+	kinds = cls.__dict__.get('_serialize_kinds')
+	if kinds is None:
+		kinds = [(ff, _kind(ff.element_type if ff.container else ff.value_type))
+		         for ff in cls._schema]
+		cls._serialize_kinds = kinds
+	return kinds
+
+def _class_path(cls):
+	return cls.__module__, cls.__qualname__
+
+def _resolve_class(module, qualname):
+	obj = importlib.import_module(module)
+	for part in qualname.split('.'):
+		obj = getattr(obj, part)
+	return obj
+
+class _Pool:
+	""" collects unique entries while writing """
+	def __init__(self, key=lambda ee: ee):
+		self.entries = []
+		self.index = {}
+		self.key = key
+	def add(self, entry):
+		key = self.key(entry)
+		ii = self.index.get(key)
+		if ii is None:
+			ii = self.index[key] = len(self.entries)
+			self.entries.append(entry)
+		return ii
+
+def _pack_pool(blobs):
+	offsets = [0]
+	for blob in blobs:
+		offsets.append(offsets[-1] + len(blob))
+	# 32 bit offsets unless the pool is larger than 4 GiB
+	code = 'I' if offsets[-1] < 2**32 else 'Q'
+	out = bytearray(_u64.pack(len(blobs)))
+	out += struct.pack('<B7x', struct.calcsize(code))
+	out += struct.pack('<{}{}'.format(len(offsets), code), *offsets)
+	for blob in blobs:
+		out += blob
+	return out
+
+################################################################################
+# writer
+
+def _post_order(root):
+	""" all distinct nodes reachable from `root`, children before parents """
+	order = []
+	index = {}
+	stack = [(root, False)]
+	while stack:
+		node, expanded = stack.pop()
+		if id(node) in index: continue
+		if expanded:
+			index[id(node)] = len(order)
+			order.append(node)
+			continue
+		stack.append((node, True))
+		children = []
+		for ff, kind in _field_kinds(node.__class__):
+			if kind != 'node': continue
+			value = getattr(node, ff.name)
+			if value is None: continue
+			children += value if ff.container else [value]
+		stack.extend((cc, False) for cc in reversed(children) if id(cc) not in index)
+	return order, index
+
+def node_order(root):
+	""" the nodes below `root` in the order in which `dumps` stores them,
+	    i.e. `node_order(root)[ii]` is materialized by `Reader.node(ii)` """
+	return _post_order(root)[0]
+
+def dumps(root):
+	""" serializes the tree (or DAG) below `root` into bytes """
+	nodes, node_index = _post_order(root)
+	strings = _Pool()
+	classes = _Pool()
+	enums = _Pool(key=lambda ee: (ee.__class__, ee.name))
+	objects = _Pool(key=id)
+	records = []
+	def write(out, kind, value):
+		if kind == 'node':    _write_varint(out, node_index[id(value)])
+		elif kind == 'enum':  _write_varint(out, enums.add(value))
+		elif kind == 'object': _write_varint(out, objects.add(value))
+		elif type(value) is not _exact[kind]:
+			# flagged, see the top of the file
+			if kind == 'bool' or kind == 'float':
+				out.append(2 if kind == 'bool' else 1)
+				_write_varint(out, objects.add(value))
+			else:
+				_write_varint(out, objects.add(value) * 2 + 1)
+		elif kind == 'bool':  out.append(1 if value else 0)
+		elif kind == 'int':   _write_varint(out, _zigzag(value) * 2)
+		elif kind == 'float':
+			out.append(0)
+			out += _f64.pack(value)
+		else:                 _write_varint(out, strings.add(value) * 2)
+	for node in nodes:
+		out = bytearray()
+		_write_varint(out, classes.add(node.__class__))
+		for ff, kind in _field_kinds(node.__class__):
+			value = getattr(node, ff.name)
+			if ff.optional:
+				out.append(0 if value is None else 1)
+				if value is None: continue
+			if ff.container:
+				_write_varint(out, len(value))
+				for el in value: write(out, kind, el)
+			else:
+				write(out, kind, value)
+		records.append(out)
+	# classes and enums refer to strings, thus they need to be packed first
+	class_blobs = []
+	for cls in classes.entries:
+		out = bytearray()
+		for part in _class_path(cls): _write_varint(out, strings.add(part))
+		_write_varint(out, len(cls._fields))
+		for name in cls._fields: _write_varint(out, strings.add(name))
+		class_blobs.append(out)
+	enum_blobs = []
+	for ee in enums.entries:
+		out = bytearray()
+		for part in _class_path(ee.__class__) + (ee.name,):
+			_write_varint(out, strings.add(part))
+		enum_blobs.append(out)
+	pools = [
+		[ss.encode('utf-8') for ss in strings.entries],
+		class_blobs, enum_blobs,
+		[pickle.dumps(oo) for oo in objects.entries],
+		records,
+	]
+	data = bytearray(_header.size)
+	offsets = []
+	for blobs in pools:
+		offsets.append(len(data))
+		data += _pack_pool(blobs)
+	_header.pack_into(data, 0, MAGIC, VERSION, len(nodes) - 1, *offsets)
+	return bytes(data)
+
+def dump(root, filename):
+	with open(filename, 'wb') as ff:
+		ff.write(dumps(root))
+
+################################################################################
+# reader
+
+class _PoolView:
+	def __init__(self, buf, offset):
+		self.buf = buf
+		self.count = _u64.unpack_from(buf, offset)[0]
+		self.width = buf[offset + 8]
+		self.entry = struct.Struct('<II' if self.width == 4 else '<QQ')
+		self.table = offset + 16
+		self.data = self.table + self.width * (self.count + 1)
+	def __len__(self): return self.count
+	def span(self, ii):
+		if not 0 <= ii < self.count:
+			raise IndexError("pool index {} out of range".format(ii))
+		start, end = self.entry.unpack_from(self.buf, self.table + self.width * ii)
+		return self.data + start, self.data + end
+
+class Reader:
+	""" decodes nodes from a serialized buffer on demand
+
+	`node(ii)` materializes node `ii` and the nodes below it, every node is
+	only decoded once. `view(ii)` returns a NodeView, which decodes the fields
+	of a single node without materializing its children.
+	"""
+	def __init__(self, buf):
+		self.buf = buf
+		magic, version, self.root_index, *offsets = _header.unpack_from(buf, 0)
+		if magic != MAGIC:
+			raise ValueError("not a serialized typed IR")
+		if version != VERSION:
+			raise ValueError("unsupported version {}".format(version))
+		self.strings, self.classes, self.enums, self.objects, self.nodes = [
+			_PoolView(buf, oo) for oo in offsets]
+		self._cache = {}
+		# id(node) -> index of all materialized nodes
+		self._indices = {}
+
+	def __len__(self): return len(self.nodes)
+
+	def _cached(self, pool, ii, decode):
+		key = (id(pool), ii)
+		if key not in self._cache:
+			self._cache[key] = decode(*pool.span(ii))
+		return self._cache[key]
+
+	def string(self, ii):
+		return self._cached(self.strings, ii,
+			lambda start, end: bytes(self.buf[start:end]).decode('utf-8'))
+
+	def _path(self, start, count):
+		parts = []
+		pos = start
+		for _ in range(count):
+			ss, pos = _read_varint(self.buf, pos)
+			parts.append(self.string(ss))
+		return parts, pos
+
+	def node_class(self, ii):
+		def decode(start, end):
+			(module, qualname), pos = self._path(start, 2)
+			cls = _resolve_class(module, qualname)
+			count, pos = _read_varint(self.buf, pos)
+			names, _ = self._path(pos, count)
+			if names != list(cls._fields):
+				raise ValueError("fields of {} changed: {} vs. {}".format(qualname, names, cls._fields))
+			return cls
+		return self._cached(self.classes, ii, decode)
+
+	def enum(self, ii):
+		def decode(start, end):
+			(module, qualname, name), _ = self._path(start, 3)
+			return getattr(_resolve_class(module, qualname), name)
+		return self._cached(self.enums, ii, decode)
+
+	def object(self, ii):
+		return self._cached(self.objects, ii,
+			lambda start, end: pickle.loads(self.buf[start:end]))
+
+	def _read(self, kind, pos):
+		buf = self.buf
+		if kind == 'node':
+			ii, pos = _read_varint(buf, pos)
+			return _NodeRef(ii), pos
+		if kind == 'bool' or kind == 'float':
+			flag = buf[pos]
+			if kind == 'bool' and flag < 2: return flag != 0, pos + 1
+			if kind == 'float' and flag == 0: return _f64.unpack_from(buf, pos + 1)[0], pos + 9
+			value, pos = _read_varint(buf, pos + 1)
+			return self.object(value), pos
+		value, pos = _read_varint(buf, pos)
+		if kind == 'enum': return self.enum(value), pos
+		if kind == 'object': return self.object(value), pos
+		if value & 1: return self.object(value >> 1), pos
+		if kind == 'int': return _unzigzag(value >> 1), pos
+		return self.string(value >> 1), pos
+
+	def record(self, ii):
+		""" class and raw field values of node `ii`, child nodes are `_NodeRef`s """
+		pos, _ = self.nodes.span(ii)
+		cls_index, pos = _read_varint(self.buf, pos)
+		cls = self.node_class(cls_index)
+		values = {}
+		for ff, kind in _field_kinds(cls):
+			if ff.optional:
+				present = self.buf[pos] != 0
+				pos += 1
+				if not present:
+					values[ff.name] = None
+					continue
+			if ff.container:
+				count, pos = _read_varint(self.buf, pos)
+				items = []
+				for _ in range(count):
+					item, pos = self._read(kind, pos)
+					items.append(item)
+				values[ff.name] = ff.container(items)
+			else:
+				values[ff.name], pos = self._read(kind, pos)
+		return cls, values
+
+	def node(self, ii):
+		""" materializes node `ii` (and all nodes below it) """
+		key = ('node', ii)
+		if key in self._cache: return self._cache[key]
+		# children have smaller indices than their parents, thus
+		# constructing all missing nodes in index order works
+		missing = {}
+		stack = [ii]
+		while stack:
+			jj = stack.pop()
+			if jj in missing or ('node', jj) in self._cache: continue
+			missing[jj] = record = self.record(jj)
+			stack.extend(ref.index for ref in _refs(record[1]))
+		for jj in sorted(missing):
+			cls, values = missing[jj]
+			node = cls(**{name: _resolve(value, self._cache) for name, value in values.items()})
+			self._cache[('node', jj)] = node
+			self._indices.setdefault(id(node), jj)
+		return self._cache[key]
+
+	def index_of(self, node):
+		""" index of a node materialized by this reader, None for other nodes """
+		return self._indices.get(id(node))
+
+	@property
+	def root(self):
+		return self.node(self.root_index)
+
+	def view(self, ii=None):
+		return NodeView(self, self.root_index if ii is None else ii)
+
+	def close(self):
+		if isinstance(self.buf, mmap.mmap):
+			self._cache.clear()
+			self._indices.clear()
+			self.buf.close()
+	def __enter__(self): return self
+	def __exit__(self, *exc): self.close()
+
+class _NodeRef:
+	__slots__ = ('index',)
+	def __init__(self, index): self.index = index
+
+def _refs(values):
+	for value in values.values():
+		items = value if isinstance(value, (list, set)) else [value]
+		for item in items:
+			if isinstance(item, _NodeRef): yield item
+
+def _resolve(value, cache):
+	if isinstance(value, _NodeRef): return cache[('node', value.index)]
+	if isinstance(value, (list, set)):
+		return value.__class__(_resolve(vv, cache) for vv in value)
+	return value
+
+class NodeView:
+	""" read only view of a serialized node, fields are decoded on access and
+	    child nodes are returned as views as well """
+	def __init__(self, reader, index):
+		self._reader = reader
+		self._index = index
+		self._record = None
+	def _values(self):
+		if self._record is None:
+			self._record = self._reader.record(self._index)
+		return self._record
+	@property
+	def node_class(self): return self._values()[0]
+	def materialize(self):
+		return self._reader.node(self._index)
+	def __getattr__(self, name):
+		if name.startswith('_'): raise AttributeError(name)
+		cls, values = self._values()
+		if name not in values:
+			raise AttributeError("{} has no field {}".format(cls.__name__, name))
+		return self._wrap(values[name])
+	def _wrap(self, value):
+		if isinstance(value, _NodeRef): return NodeView(self._reader, value.index)
+		if isinstance(value, (list, set)):
+			return value.__class__(self._wrap(vv) for vv in value)
+		return value
+	def __repr__(self):
+		return "NodeView({}, #{})".format(self.node_class.__name__, self._index)
+
+def materialize(value):
+	""" node for a NodeView, other values are returned unchanged """
+	return value.materialize() if isinstance(value, NodeView) else value
+
+def loads(data):
+	return Reader(data)
+
+def load(filename):
+	""" memory maps `filename`, nodes are only decoded when accessed """
+	with open(filename, 'rb') as ff:
+		buf = mmap.mmap(ff.fileno(), 0, access=mmap.ACCESS_READ)
+	return Reader(buf)
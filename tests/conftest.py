@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# The library is used as the `util` package by the DSL example (which is
+# imported as `midend`) and as plain modules by the typecheck example,
+# thus both are set up here without installing anything.
+
+import os, sys, types
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+examples = os.path.join(root, 'examples')
+
+for path in (root, os.path.join(examples, 'typecheck'), os.path.join(root, 'benchmarks')):
+	if path not in sys.path: sys.path.insert(0, path)
+
+for name, path in (('util', root), ('midend', os.path.join(examples, 'dsl'))):
+	if name not in sys.modules:
+		package = types.ModuleType(name)
+		package.__path__ = [path]
+		sys.modules[name] = package
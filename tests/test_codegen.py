@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+import pytest
+import util.typed as typed
+import midend.ir as ir
+from midend.codegen import DecoderCompiler, compile_decoder
+from midend.simulate import Simulator
+from midend.trace import stream, write_trace
+from generators import random_decoder, random_trace
+
+seeds = range(12)
+
+def _decoder(seed):
+	# only odd seeds have DelayedEvents
+	return random_decoder(ir, dfas=8, states=6, transitions=3, inputs=4, outputs=3, seed=seed,
+	                      delayed=0.3 if seed % 2 else 0.0, compound=0.3)
+
+def _step_all(step, trace):
+	emitted = []
+	for sample in zip(*trace):
+		emitted += step(sample)
+	return emitted
+
+@pytest.mark.parametrize('seed', seeds)
+def test_step(seed):
+	decoder = _decoder(seed)
+	trace = random_trace(decoder.inputs, 500, toggle=0.2, seed=seed)
+	initial = [seed % 2] * len(decoder.inputs)
+	expected = Simulator(decoder, initial).run(trace, chunk_size=64)
+	assert _step_all(compile_decoder(decoder, initial), trace) == expected
+
+@pytest.mark.parametrize('seed', seeds)
+def test_chunk_boundaries(seed):
+	# `step` keeps its state between calls like the Simulator between chunks
+	decoder = _decoder(seed)
+	trace = random_trace(decoder.inputs, 500, toggle=0.2, seed=seed)
+	step, sim, start = compile_decoder(decoder), Simulator(decoder), 0
+	for size in (1, 5, 64, 130, 300):
+		piece = [cc[start:start + size] for cc in trace]
+		assert _step_all(step, piece) == sim.run(piece, chunk_size=7)
+		start += size
+
+@pytest.mark.parametrize('seed', range(4))
+def test_stream(seed, tmpdir):
+	decoder = _decoder(2 * seed + 1)
+	trace = random_trace(decoder.inputs, 800, toggle=0.2, seed=seed)
+	filename = str(tmpdir.join('trace.bin'))
+	write_trace(filename, decoder, trace)
+	assert _step_all(compile_decoder(decoder), trace) == list(stream(decoder, filename, window=50))
+
+def test_cache():
+	# equal decoders share the code, but every step function has its own
+	# state and emits the tokens of its own decoder
+	compiler = DecoderCompiler()
+	first, second = _decoder(1), _decoder(1)
+	trace = random_trace(first.inputs, 300, toggle=0.2)
+	steps = [compiler.compile(first), compiler.compile(second), compiler.compile(first)]
+	assert compiler.compiled == 1
+	for step, decoder in zip(steps, [first, second, first]):
+		emitted = _step_all(step, trace)
+		assert emitted == Simulator(decoder).run(trace)
+		tokens = {id(nn.token) for nn in typed.walk(decoder) if isinstance(nn, ir.Action)}
+		assert all(id(ee.token) in tokens for ee in emitted)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+import irtypes
+import util.typed as typed
+import midend.ir as ir
+from util.diskcache import DiskCache
+from generators import random_decoder
+from typechecker import TypeChecker
+
+def _deep_funcdef(depth):
+	""" returns a + 1 + 1 + ... as a chain of `depth` BinOps """
+	expr = irtypes.Ref(name='a')
+	for _ in range(depth):
+		expr = irtypes.BinOp(op=irtypes.Bop.Add, left=expr, right=irtypes.IntConst(val=1))
+	return irtypes.FuncDef(name='f', args=['a'], arg_types=[irtypes.Type.Int],
+	                       body=irtypes.Block(body=[irtypes.Return(val=expr)]),
+	                       return_type=irtypes.Type.Int)
+
+def _cached_twice(cache, name, root, compute=None):
+	results = [cache.cached(name, 1, root, compute or (lambda: root)) for _ in range(2)]
+	assert (cache.misses, cache.hits) == (1, 1)
+	return results
+
+def test_deep_tree(tmpdir):
+	fun = _deep_funcdef(5000)
+	computed, loaded = _cached_twice(DiskCache(str(tmpdir)), 'deep', fun)
+	assert computed is fun
+	assert typed.content_hash(loaded) == typed.content_hash(fun)
+
+def test_typecheck(tmpdir):
+	cache = DiskCache(str(tmpdir))
+	fun = _deep_funcdef(5000)
+	results = [TypeChecker.analyze_cached(fun, cache) for _ in range(2)]
+	assert (cache.misses, cache.hits) == (1, 1)
+	(checked, symbols), (loaded, loaded_symbols) = results
+	assert loaded_symbols == symbols
+	assert typed.content_hash(loaded) == typed.content_hash(checked)
+
+def test_shared_nodes(tmpdir):
+	decoder = random_decoder(ir, dfas=10, seed=3)
+	_, loaded = _cached_twice(DiskCache(str(tmpdir)), 'decoder', decoder)
+	assert typed.content_hash(loaded) == typed.content_hash(decoder)
+	# channels and tokens have no structural identity, every reference to
+	# one has to load as the same object
+	inputs = {id(cc) for cc in loaded.inputs}
+	tokens = {id(nn.token) for nn in typed.walk(loaded) if isinstance(nn, ir.Action)}
+	assert all(id(nn.channel) in inputs for nn in typed.walk(loaded)
+	           if isinstance(nn, (ir.Append, ir.ExternalEvent, ir.Sample)))
+	assert len(tokens) == len({id(nn.token) for nn in typed.walk(decoder) if isinstance(nn, ir.Action)})
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+import gc, random, weakref
+import pytest
+import midend.ir as ir
+import midend.passes as passes
+import util.meta as meta
+from midend.simulate import simulate
+from typing import List
+from generators import random_decoder, random_trace
+
+seeds = range(20)
+
+def _decoder(seed):
+	return random_decoder(ir, dfas=6, states=5, transitions=3, inputs=4, outputs=2, seed=seed,
+	                      delayed=0.3, compound=0.3)
+
+def _few_triggers(decoder, seed):
+	""" `decoder` with the triggers of every dfa replaced by two of its
+	    triggers and two DelayedEvents, thus many states only differ in
+	    their actions, delays and destinations """
+	rnd = random.Random(seed)
+	dfas = []
+	for dfa in decoder.dfas:
+		triggers = [tran.trigger for tran in dfa.transitions[:2]]
+		triggers += [ir.DelayedEvent(cycles=1), ir.DelayedEvent(cycles=3)]
+		dfas.append(dfa.set(transitions=[tran.set(trigger=rnd.choice(triggers)) for tran in dfa.transitions]))
+	return decoder.set(dfas=dfas)
+
+def _differ(tran, token):
+	""" `tran` with another delay or another action """
+	if isinstance(tran.trigger, ir.DelayedEvent):
+		return tran.set(trigger=ir.DelayedEvent(cycles=tran.trigger.cycles + 1))
+	return tran.set(actions=tran.actions + [ir.Emit(token=token)])
+
+def _redundant(decoder, seed):
+	""" `decoder` with three copies of every state: a twin with the same
+	    outgoing transitions, a near twin whose first outgoing transition
+	    has another delay or action and a far twin whose first outgoing
+	    transition leads to the near twin of its destination instead.
+	    Transitions lead to any of them or the original state, and every
+	    dfa has an unreachable state. """
+	rnd = random.Random(seed)
+	dfas = []
+	for dfa in decoder.dfas:
+		twins, near, far = ({ss: ir.State(name="{}{}".format(ss.name, mark)) for ss in dfa.states}
+		                    for mark in "'~^")
+		copies = lambda ss: [ss, twins[ss], near[ss], far[ss]]
+		transitions = [tran.set(destination=rnd.choice(copies(tran.destination))) for tran in dfa.transitions]
+		added, first = [], set()
+		for orig, tran in zip(dfa.transitions, transitions):
+			to_near, to_far = tran.set(source=near[tran.source]), tran.set(source=far[tran.source])
+			if tran.source not in first:
+				first.add(tran.source)
+				to_near = _differ(to_near, decoder.outputs[0])
+				to_far = to_far.set(destination=near[orig.destination])
+			added += [tran.set(source=twins[tran.source]), to_near, to_far]
+		dead = ir.State(name="dead")
+		added.append(ir.Transition(source=dead, destination=dfa.start,
+		                           trigger=dfa.transitions[0].trigger, actions=[]))
+		states = [cc for ss in dfa.states for cc in copies(ss)]
+		dfas.append(dfa.set(states=states + [dead], transitions=transitions + added))
+	return decoder.set(dfas=dfas)
+
+def _check_minimized(decoder, seed):
+	minimized = passes.MinimizeDFAPass(decoder)
+	trace = random_trace(decoder.inputs, 600, seed=seed)
+	emitted = simulate(decoder, trace)
+	assert simulate(minimized.decoder, trace) == emitted
+	return minimized, emitted
+
+@pytest.mark.parametrize('seed', seeds)
+def test_minimize(seed):
+	_check_minimized(_decoder(seed), seed)
+
+@pytest.mark.parametrize('seed', seeds)
+def test_minimize_few_triggers(seed):
+	_check_minimized(_few_triggers(_decoder(seed), seed), seed)
+
+@pytest.mark.parametrize('seed', seeds)
+def test_minimize_redundant(seed):
+	decoder = _redundant(_few_triggers(_decoder(seed), seed), seed)
+	minimized, _ = _check_minimized(decoder, seed)
+	# every dfa has its dead state, twins that are reached are merged
+	assert all(reachable < states for states, reachable, _ in minimized.counts)
+	assert sum(reachable - after for _, reachable, after in minimized.counts) > 0
+
+def test_state_info_collected():
+	decoder = _decoder(0)
+	info = passes.StateInfoPass(decoder)
+	state = decoder.dfas[0].states[0]
+	assert info.dfa.get(state) is decoder.dfas[0]
+	assert info.outgoing.get(state) == [tt for tt in decoder.dfas[0].transitions if tt.source is state]
+	ref = weakref.ref(state)
+	del decoder, state
+	gc.collect()
+	assert ref() is None
+	assert len(info.dfa) == len(info.outgoing) == len(info.incoming) == 0
+
+def test_weak_field():
+	with pytest.raises(TypeError):
+		meta.MetaDataField('weak', ir.State, int, storage='weak')
+	field = meta.MetaDataField('weak', ir.State, List[ir.State], readonly=False, storage='weak')
+	state, other = ir.State(name="a"), ir.State(name="b")
+	field.add(state, state)
+	field.add(state, other)
+	assert field.get(state) == [state, other]
+	del other
+	gc.collect()
+	assert state not in field and field.get(state) == []
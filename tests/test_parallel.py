@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+import pytest
+import util.typed as typed
+import midend.ir as ir
+import midend.passes as passes
+import midend.parallel as parallel
+from generators import random_decoder
+
+def _decoder(seed):
+	return random_decoder(ir, dfas=30, states=5, transitions=3, inputs=6, seed=seed, delayed=0.2, compound=0.2)
+
+@pytest.fixture(scope='module', params=[1, 2])
+def driver(request):
+	# chunks of a few dfas, thus every worker gets several
+	return parallel.ParallelDriver(max_workers=request.param, chunk_size=4)
+
+def _dfa(info, state):
+	try:
+		return info.dfa.get(state)
+	except KeyError:
+		return None
+
+def _same_nodes(left, right):
+	return len(left) == len(right) and all(ll is rr for ll, rr in zip(left, right))
+
+@pytest.mark.parametrize('seed', range(3))
+def test_state_info(driver, seed):
+	decoder = _decoder(seed)
+	serial, result = passes.StateInfoPass(decoder), parallel.state_info(decoder, driver)
+	for node in typed.walk(decoder):
+		if not isinstance(node, ir.State): continue
+		for field in ('outgoing', 'incoming'):
+			assert _same_nodes(getattr(result, field).get(node), getattr(serial, field).get(node))
+		assert _dfa(result, node) is _dfa(serial, node)
+
+@pytest.mark.parametrize('seed', range(3))
+def test_dead_code_elimination(driver, seed):
+	decoder = _decoder(seed)
+	serial = passes.DeadCodeEliminationPass(decoder).decoder
+	result = parallel.dead_code_elimination(decoder, driver).decoder
+	assert typed.content_hash(result) == typed.content_hash(serial)
+	assert _same_nodes(result.inputs, serial.inputs)
+	assert _same_nodes(result.outputs, serial.outputs)
+	assert len(result.dfas) < len(decoder.dfas)
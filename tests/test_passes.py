@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+# differential tests: the interpreter has to give the same results before
+# and after a pass for random FuncDefs
+
+import copy
+import pytest
+import irtypes as ir
+from generators import random_funcdef
+from interpreter import interpret
+from typechecker import TypeChecker
+from simplify import simplify
+from dataflow import eliminate_dead_assignments
+from loops import optimize_loops
+
+seeds = range(40)
+argument_sets = ([list(range(-8, 8)), 3, 1.5, True], [list(range(16)), 0, -2.0, False])
+
+def _typed(seed):
+	return TypeChecker.analyze(random_funcdef(ir, width=6, depth=2, seed=seed))
+
+def _outcome(fun, args):
+	""" return value or exception type and the final argument values """
+	args = copy.deepcopy(args)
+	try:
+		result = interpret(fun, *args)
+	except Exception as ee:
+		result = type(ee)
+	return repr(result), repr(args)
+
+def _check(before, after):
+	for args in argument_sets:
+		assert _outcome(after, args) == _outcome(before, args)
+
+@pytest.mark.parametrize('seed', seeds)
+def test_simplify(seed):
+	fun, _ = _typed(seed)
+	_check(fun, simplify(fun)[0])
+
+@pytest.mark.parametrize('seed', seeds)
+def test_eliminate_dead_assignments(seed):
+	fun, symbols = _typed(seed)
+	_check(fun, eliminate_dead_assignments(fun, symbols)[0])
+	# without symbols, on the output of simplify
+	fun = simplify(fun)[0]
+	_check(fun, eliminate_dead_assignments(fun)[0])
+
+@pytest.mark.parametrize('seed', seeds)
+def test_optimize_loops(seed):
+	fun, _ = _typed(seed)
+	_check(fun, optimize_loops(fun)[0])
+
+def _strided_loop(lo, hi):
+	""" k = n * n; s += a[n * i + 1]; a[i] = n * i + k for i in [lo, hi) """
+	i, n, s = ir.Ref(name='i'), ir.Ref(name='n'), ir.Ref(name='s')
+	mul = lambda left, right: ir.BinOp(op=ir.Bop.Mul, left=left, right=right)
+	add = lambda left, right: ir.BinOp(op=ir.Bop.Add, left=left, right=right)
+	body = ir.Block(body=[
+		ir.Assign(ref=ir.Ref(name='k'), val=mul(n, n)),
+		ir.Assign(ref=s, val=add(s, ir.Ref(name='a', index=add(mul(n, i), ir.IntConst(val=1))))),
+		ir.Assign(ref=ir.Ref(name='a', index=i), val=add(mul(n, i), ir.Ref(name='k')))])
+	return ir.FuncDef(name='f', args=['a', 'n'], arg_types=[ir.Type.IntArray, ir.Type.Int],
+	                  body=ir.Block(body=[ir.Assign(ref=s, val=ir.IntConst(val=0)),
+	                                      ir.For(var='i', min=ir.IntConst(val=lo), max=ir.IntConst(val=hi), body=body),
+	                                      ir.Return(val=s)]),
+	                  return_type=ir.Type.Int)
+
+@pytest.mark.parametrize('lo, hi', [(0, 6), (3, 3), (4, 2), (0, 12)])
+@pytest.mark.parametrize('n', [-1, 0, 1, 2])
+def test_optimize_loops_strided(lo, hi, n):
+	fun, _ = TypeChecker.analyze(_strided_loop(lo, hi))
+	new, stats = optimize_loops(fun)
+	assert stats['hoisted'] == 1 and stats['reduced'] > 0
+	for values in (list(range(16)), list(range(-8, 8))):
+		assert _outcome(new, [values, n]) == _outcome(fun, [values, n])
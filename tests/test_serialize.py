@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+import numpy as np
+import pytest
+import irtypes
+import util.typed as typed
+import util.serialize as serialize
+import midend.ir as ir
+from generators import random_decoder, random_funcdef
+
+def _round_trip(root):
+	return serialize.loads(serialize.dumps(root)).root
+
+def _same_structure(left, right):
+	return typed.content_hash(left) == typed.content_hash(right)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_decoder(seed):
+	decoder = random_decoder(ir, dfas=10, states=5, seed=seed, delayed=0.2, compound=0.2)
+	loaded = _round_trip(decoder)
+	assert _same_structure(loaded, decoder)
+	# shared nodes stay shared
+	assert all(any(tran.source is ss for ss in dfa.states) for dfa in loaded.dfas for tran in dfa.transitions)
+	assert len(serialize.node_order(loaded)) == len(serialize.node_order(decoder))
+
+@pytest.mark.parametrize('seed', range(5))
+def test_funcdef(seed):
+	fun = random_funcdef(irtypes, width=8, depth=2, seed=seed)
+	assert _same_structure(_round_trip(fun), fun)
+
+@pytest.mark.parametrize('value', [True, False, 1, 0, -5, 1 << 70])
+def test_int_types(value):
+	loaded = _round_trip(irtypes.IntConst(val=value)).val
+	assert loaded == value and type(loaded) is type(value)
+
+@pytest.mark.parametrize('value', [0.0, -0.0, 1.5, float('inf'), np.float64(2.5)])
+def test_float_types(value):
+	loaded = _round_trip(irtypes.FloatConst(val=value)).val
+	assert type(loaded) is type(value)
+	assert loaded.hex() == value.hex()
+
+def test_bool_and_int_stay_apart():
+	block = irtypes.Block(body=[irtypes.Return(val=irtypes.IntConst(val=vv)) for vv in (1, True, 0, False)])
+	values = [stmt.val.val for stmt in _round_trip(block).body]
+	assert [type(vv) for vv in values] == [int, bool, int, bool]
+	assert values == [1, True, 0, False]
+
+def test_view(monkeypatch):
+	decoder = random_decoder(ir, dfas=10, states=5)
+	reader = serialize.loads(serialize.dumps(decoder))
+	decoded = []
+	record = reader.record
+	monkeypatch.setattr(reader, 'record', lambda ii: decoded.append(ii) or record(ii))
+	view = reader.view()
+	assert view.node_class is ir.Decoder
+	dfa = view.dfas[3]
+	assert isinstance(dfa, serialize.NodeView) and dfa.node_class is ir.DFA
+	assert [tt.width for tt in view.outputs] == [tt.width for tt in decoder.outputs]
+	assert dfa.states[2].name == decoder.dfas[3].states[2].name
+	# only the nodes that were accessed are decoded
+	assert len(decoded) < 20 < len(reader)
+	with pytest.raises(AttributeError):
+		view.no_such_field
+	# materialized nodes are shared with the ones of other views
+	node = serialize.materialize(dfa)
+	assert _same_structure(node, decoder.dfas[3])
+	assert serialize.materialize(view).dfas[3] is node
+	assert serialize.materialize(5) == 5
+
+def test_file(tmpdir):
+	decoder = random_decoder(ir, dfas=5, states=4)
+	filename = str(tmpdir.join('decoder.bin'))
+	serialize.dump(decoder, filename)
+	with serialize.load(filename) as reader:
+		assert _same_structure(reader.root, decoder)
+
+def test_not_serialized():
+	with pytest.raises(ValueError):
+		serialize.loads(b'\0' * 64)
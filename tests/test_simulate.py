@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+import pytest
+import midend.ir as ir
+from midend.simulate import Emitted, Simulator
+from generators import random_decoder, random_trace
+
+def reference(decoder, columns, initial=None):
+	""" decodes `columns` one sample at a time, straight from the semantics
+	    in midend.simulate """
+	column = {ch: ii for ii, ch in enumerate(decoder.inputs)}
+	prev = [0] * len(columns) if initial is None else list(initial)
+	states = [dfa.start for dfa in decoder.dfas]
+	entered = [0] * len(decoder.dfas)
+	# token -> [value, start]
+	buffers = {}
+	emitted = []
+	for now in range(len(columns[0]) if columns else 0):
+		current = [cc[now] for cc in columns]
+		def holds(cond):
+			if isinstance(cond, ir.High): return current[column[cond.channel]] != 0
+			if isinstance(cond, ir.Low): return current[column[cond.channel]] == 0
+			if isinstance(cond, ir.ConstantCondition): return cond.value
+			return holds(cond.left) and holds(cond.right)
+		def fires(event, dd):
+			if isinstance(event, ir.ExternalEvent):
+				high, was_high = current[column[event.channel]] != 0, prev[column[event.channel]] != 0
+				return high and not was_high if event.edge == ir.Edge.Rising else was_high and not high
+			if isinstance(event, ir.InternalEvent):
+				return fires(event.trigger, dd) and (event.guard is None or holds(event.guard))
+			if isinstance(event, ir.Sample): return fires(event.trigger, dd)
+			return now == entered[dd] + event.cycles
+		actions = []
+		for dd, dfa in enumerate(decoder.dfas):
+			for tran in dfa.transitions:
+				if tran.source is states[dd] and fires(tran.trigger, dd):
+					states[dd], entered[dd] = tran.destination, now
+					actions += tran.actions
+					break
+		for action in actions:
+			buf = buffers.setdefault(action.token, [0, None])
+			if isinstance(action, ir.Append):
+				if buf[1] is None: buf[1] = now
+				width = action.channel.width
+				buf[0] = (buf[0] << width) | (current[column[action.channel]] & ((1 << width) - 1))
+			elif isinstance(action, ir.Emit):
+				value = buf[0] & ((1 << action.token.width) - 1)
+				emitted.append(Emitted(action.token, value, now if buf[1] is None else buf[1], now))
+				buf[:] = [0, None]
+			elif isinstance(action, ir.Start):
+				buf[:] = [0, now]
+			else:
+				buf[:] = [0, None]
+		prev = current
+	return emitted
+
+seeds = range(12)
+
+def _decoder(seed):
+	# only odd seeds have DelayedEvents, thus both ways to advance dfas are used
+	return random_decoder(ir, dfas=8, states=6, transitions=3, inputs=4, outputs=3, seed=seed,
+	                      delayed=0.3 if seed % 2 else 0.0, compound=0.3)
+
+@pytest.mark.parametrize('seed', seeds)
+@pytest.mark.parametrize('chunk_size', [1, 7, 1 << 16])
+def test_run(seed, chunk_size):
+	decoder = _decoder(seed)
+	trace = random_trace(decoder.inputs, 500, toggle=0.2, seed=seed)
+	assert Simulator(decoder).run(trace, chunk_size=chunk_size) == reference(decoder, trace)
+
+@pytest.mark.parametrize('seed', seeds)
+def test_pieces(seed):
+	# state carries over between calls of `run`
+	decoder = _decoder(seed)
+	trace = random_trace(decoder.inputs, 500, toggle=0.2, seed=seed)
+	initial = [1] * len(decoder.inputs)
+	sim, emitted, start = Simulator(decoder, initial), [], 0
+	for size in (1, 2, 30, 0, 97, 370):
+		emitted += sim.run([cc[start:start + size] for cc in trace], chunk_size=16)
+		start += size
+	assert emitted == reference(decoder, trace, initial)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+import numpy as np
+import pytest
+import midend.ir as ir
+from midend.simulate import Simulator
+from midend.trace import TraceFile, stream, write_trace
+from generators import random_decoder, random_trace
+
+def _decoder(seed):
+	return random_decoder(ir, dfas=8, states=6, transitions=3, inputs=4, outputs=3, seed=seed,
+	                      delayed=0.3, compound=0.3)
+
+@pytest.fixture(params=range(4))
+def recorded(request, tmpdir):
+	""" decoder, trace and the name of the file the trace is written to """
+	decoder = _decoder(request.param)
+	trace = random_trace(decoder.inputs, 1000, toggle=0.2, seed=request.param)
+	filename = str(tmpdir.join('trace.bin'))
+	# written in two parts
+	write_trace(filename, decoder, [cc[:300] for cc in trace])
+	write_trace(filename, decoder, [cc[300:] for cc in trace], append=True)
+	return decoder, trace, filename
+
+@pytest.mark.parametrize('window', [1, 13, 256, 1 << 16])
+def test_stream(recorded, window):
+	decoder, trace, filename = recorded
+	assert list(stream(decoder, filename, window=window)) == Simulator(decoder).run(trace)
+
+def test_resume(recorded):
+	decoder, trace, filename = recorded
+	sim = Simulator(decoder)
+	# stops in the middle of the trace, e.g. while a DelayedEvent is pending
+	emitted = sim.run([cc[:421] for cc in trace])
+	emitted += stream(decoder, filename, window=100, start=421, simulator=sim)
+	assert emitted == Simulator(decoder).run(trace)
+
+def test_widths(tmpdir):
+	channels = [ir.Channel(width=width) for width in (1, 8, 12, 33)]
+	trace = random_trace(channels, 50, toggle=0.5)
+	filename = str(tmpdir.join('trace.bin'))
+	write_trace(filename, channels, trace)
+	traced = TraceFile(filename, channels)
+	assert len(traced) == 50
+	assert [cc.tolist() for cc in traced.read(0, 50)] == trace
+	assert [cc.tolist() for cc in traced.read(45, 10)] == [cc[45:] for cc in trace]
+	assert [np.concatenate(parts).tolist() for parts in zip(*traced.windows(7))] == trace
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2017, 2018, Kevin Laeufer <laeufer@eecs.berkeley.edu>
+
+# This software may be modified and distributed under the terms
+# of the BSD license. See the LICENSE file for details.
+
+import numpy as np
+import pytest
+import irtypes as ir
+from interpreter import interpret
+from pycompile import compile_function
+from vectorize import check_equivalence, compile_vectorized, vectorization_report
+
+def _int(value): return ir.IntConst(val=value)
+def _ref(name, index=None): return ir.Ref(name=name, index=index)
+def _add(left, right): return ir.BinOp(op=ir.Bop.Add, left=left, right=right)
+def _mul(left, right): return ir.BinOp(op=ir.Bop.Mul, left=left, right=right)
+
+def _loop(target, value, lo=_int(0), hi=_ref('n')):
+	""" `for i in range(lo, hi): a[target] = value` with arrays `a` and `b` """
+	loop = ir.For(var='i', min=lo, max=hi, body=ir.Assign(ref=_ref('a', target), val=value))
+	return ir.FuncDef(name='f', args=['a', 'b', 'n'],
+	                  arg_types=[ir.Type.IntArray, ir.Type.IntArray, ir.Type.Int],
+	                  body=ir.Block(body=[loop]), return_type=ir.Type.Void)
+
+i = _ref('i')
+# a[i] = b[i] * 3 + i
+vectorizable = _loop(i, _add(_mul(_ref('b', i), _int(3)), i))
+# a[2 * i + 1] = b[i] + a[2 * i + 1]
+strided = _loop(_add(_mul(_int(2), i), _int(1)), _add(_ref('b', i), _ref('a', _add(_mul(_int(2), i), _int(1)))))
+# a[i + 1] = a[i] + 1 depends on the previous iteration
+dependent = _loop(_add(i, _int(1)), _add(_ref('a', i), _int(1)))
+# a[i + 1] = b[i] + 1 has no dependency unless `a` and `b` overlap
+shifted = _loop(_add(i, _int(1)), _add(_ref('b', i), _int(1)))
+# a[i] = b[i + 1] reads one element ahead
+ahead = _loop(i, _ref('b', _add(i, _int(1))))
+# a[i] = b[b[i]] + b[2]
+indirect = _loop(i, _add(_ref('b', _ref('b', i)), _ref('b', _int(2))))
+# a[i] = int(c[i]) fails for NaN
+cast = ir.FuncDef(name='f', args=['a', 'c', 'n'], arg_types=[ir.Type.IntArray, ir.Type.FloatArray, ir.Type.Int],
+                  body=ir.Block(body=[ir.For(var='i', min=_int(0), max=_ref('n'),
+                                             body=ir.Assign(ref=_ref('a', i), val=ir.CastToInt(expr=_ref('c', i))))]),
+                  return_type=ir.Type.Void)
+
+def _arrays(size=8):
+	values = np.arange(size, dtype=np.int64)
+	return values * values - 3, values * 2
+
+def test_report():
+	assert [aa.vectorizable for aa in vectorization_report(vectorizable)] == [True]
+	assert [aa.vectorizable for aa in vectorization_report(strided)] == [True]
+	assert [aa.vectorizable for aa in vectorization_report(ahead)] == [True]
+	assert [aa.vectorizable for aa in vectorization_report(indirect)] == [True]
+	assert [aa.vectorizable for aa in vectorization_report(dependent)] == [False]
+	assert [aa.vectorizable for aa in vectorization_report(cast)] == [False]
+
+@pytest.mark.parametrize('fun', [vectorizable, strided, dependent, shifted, ahead, indirect])
+@pytest.mark.parametrize('n', [0, 1, 3])
+def test_equivalent(fun, n):
+	a, b = _arrays()
+	check_equivalence(fun, a, b, n)
+
+@pytest.mark.parametrize('fun', [vectorizable, shifted])
+def test_lists(fun):
+	a, b = _arrays()
+	check_equivalence(fun, list(a), list(b), 5)
+
+def _check_failure(fun, exception, *args):
+	""" all versions of `fun` raise `exception` and leave the same elements
+	    of the first argument written """
+	results = []
+	for run in (lambda *aa: interpret(fun, *aa), compile_function(fun), compile_vectorized(fun)):
+		aa = [np.copy(arg) if isinstance(arg, np.ndarray) else arg for arg in args]
+		with pytest.raises(exception):
+			run(*aa)
+		results.append(aa[0])
+	assert all(np.array_equal(aa, results[0]) for aa in results[1:])
+
+@pytest.mark.parametrize('fun, n', [(vectorizable, 8), (strided, 4), (shifted, 7), (ahead, 7), (indirect, 4)])
+def test_out_of_bounds(fun, n):
+	# an index out of bounds, written or read, makes the vectorized version
+	# fall back to the scalar loop, which raises in the same iteration
+	check_equivalence(fun, *_arrays(), n)
+	_check_failure(fun, IndexError, *_arrays(), n + 1)
+
+def test_nan():
+	a, _ = _arrays()
+	c = np.array([0.5, 2.0, np.nan, 3.0, 1.0, 0.0, 1.0, 2.0])
+	check_equivalence(cast, a, c, 2)
+	_check_failure(cast, ValueError, a, c, 4)
+
+@pytest.mark.parametrize('fun', [vectorizable, strided, shifted])
+def test_aliased(fun):
+	a, _ = _arrays()
+	check_equivalence(fun, a, a, 3)
+
+def test_overlapping_views():
+	# deepcopy does not keep views of the same array together, thus the
+	# versions are run by hand
+	results = []
+	for run in (lambda *aa: interpret(shifted, *aa), compile_function(shifted), compile_vectorized(shifted)):
+		a, _ = _arrays(12)
+		run(a[1:], a[:-1], 6)
+		results.append(a)
+	assert all(np.array_equal(aa, results[0]) for aa in results[1:])
@@ -8,7 +8,7 @@
 
 # support for typed IR nodes
 
-import ast, typing
+import ast, contextlib, enum, hashlib, pickle, types, typing, weakref
 
 class Optional:
 	def __init__(self, field_type):
@@ -23,24 +23,26 @@ def _get_list_element_type(tt):
 	assert len(tt.__args__) == 1
 	return tt.__args__[0]
 
+def _container_type(tt):
+	""" returns `list` or `set` for `typing.List[..]` / `typing.Set[..]`, else None """
+	if _is_list_type(tt): return list
+	if _is_set_type(tt): return set
+	return None
+
 def _typing_aware_isinstance(obj, tt):
 	""" this tries to work around some issues with using typing types """
 	# https://github.com/python/mypy/issues/3060
-	try:
-		return isinstance(obj, tt)
-	except TypeError as err:
-		assert str(err) == "Parameterized generics cannot be used with class or instance checks"
-		# handle type checking for typing.List[type]
-		# this is very hacky and I would love for someone to show me how
-		# to correctly use the typing library
-		if _is_list_type(tt):
-			if not isinstance(obj, list): return False
-		elif _is_set_type(tt):
-			if not isinstance(obj, set): return False
-		else:
+	# parameterized generics cannot be used with isinstance, thus we need
+	# to check the container and all elements by hand
+	container = _container_type(tt)
+	if container is None:
+		try:
+			return isinstance(obj, tt)
+		except TypeError:
 			raise TypeError("unknown type {}".format(tt))
-		inner_type = _get_list_element_type(tt)
-		return all(isinstance(el, inner_type) for el in obj)
+	if not isinstance(obj, container): return False
+	inner_type = _get_list_element_type(tt)
+	return all(isinstance(el, inner_type) for el in obj)
 
 def _local_isinstance(obj, tt):
 	if isinstance(tt, Optional):
@@ -48,11 +50,16 @@ def _local_isinstance(obj, tt):
 		tt = tt.field_type
 	return _typing_aware_isinstance(obj, tt)
 
-def get_fields_of_class(cls):
-	""" returns the fields of a single class """
+def _field_declarations(namespace):
 	# this relies on https://www.python.org/dev/peps/pep-0520
 	# and Python 3.6 (see Note in PEP520)
-	return [(n,v) for n,v in cls.__dict__.items() if not n[0] == '_']
+	return [(n,v) for n,v in namespace.items() if not n[0] == '_']
+
+def get_fields_of_class(cls):
+	""" returns the fields of a single class """
+	# compact classes replace their field declarations with slots
+	if '_own_fields' in cls.__dict__: return list(cls._own_fields)
+	return _field_declarations(cls.__dict__)
 
 def get_fields(cls):
 	""" returns fields of the class and all ancestor classes """
@@ -73,7 +80,7 @@ def parse_args(names, args, kwargs):
 	return aa
 
 def is_type_list(ll):
-	return isinstance(ll, list) and all(type(t) == type for t in ll)
+	return isinstance(ll, list) and all(isinstance(t, type) for t in ll)
 def is_str_list(ll):
 	return isinstance(ll, list) and all(type(t) == str for t in ll)
 
@@ -83,57 +90,306 @@ def matches_types(types, tt):
 	if isinstance(tt, Optional): return matches_types(types, tt.field_type)
 	return False
 
-class Node(ast.AST):
+################################################################################
+# validation policy
+
+class Validation(enum.IntEnum):
+	Off = 0      # no type checks, only for trusted passes
+	Shallow = 1  # check field and container types, but not list/set elements
+	Full = 2     # check everything
+
+class _ValidationPolicy:
+	def __init__(self):
+		self.level = Validation.Full
+_policy = _ValidationPolicy()
+
+def get_validation():
+	return _policy.level
+
+def set_validation(level):
+	""" sets the validation level used for node construction globally """
+	_policy.level = Validation(level)
+
+class validation(contextlib.ContextDecorator):
+	""" changes the validation level for the duration of a `with` block
+	    or of a decorated function, `None` keeps the current level """
+	def __init__(self, level):
+		self.level = None if level is None else Validation(level)
+		self._saved = []
+	def __enter__(self):
+		self._saved.append(_policy.level)
+		if self.level is not None:
+			_policy.level = self.level
+		return self
+	def __exit__(self, *exc):
+		_policy.level = self._saved.pop()
+		return False
+
+################################################################################
+# per-class schema and generated constructors
+
+class _Missing:
+	def __repr__(self): return "<missing>"
+_MISSING = _Missing()
+
+class Field:
+	""" schema entry describing a single typed field of a Node class """
+	def __init__(self, name, field_type):
+		self.name = name
+		self.field_type = field_type
+		self.optional = isinstance(field_type, Optional)
+		self.value_type = field_type.field_type if self.optional else field_type
+		self.container = _container_type(self.value_type)
+		self.element_type = None
+		if self.container is not None:
+			self.element_type = _get_list_element_type(self.value_type)
+		elif not isinstance(self.value_type, type):
+			raise TypeError("unknown type {}".format(self.value_type))
+	def __repr__(self):
+		return "Field({}, {})".format(self.name, self.field_type)
+	def check(self, value, old=None):
+		""" validates `value` according to the current validation level,
+		    list elements that are identical to the ones in `old` are skipped """
+		level = _policy.level
+		if not level or (value is None and self.optional): return
+		if self.container is None:
+			ok = isinstance(value, self.value_type)
+		else:
+			ok = isinstance(value, self.container)
+			if ok and level is Validation.Full:
+				new = value
+				if isinstance(old, list) and isinstance(value, list):
+					new = [vv for ii, vv in enumerate(value) if ii >= len(old) or vv is not old[ii]]
+				ok = all(isinstance(el, self.element_type) for el in new)
+		if not ok:
+			raise _type_error(self.name, self.field_type, value)
+
+def _type_error(name, field_type, value):
+	return TypeError("Field `{}` requires values of type `{}` not `{}`".format(
+		name, field_type, type(value)))
+
+def _init_field_source(ii, ff):
+	""" generates the checks for a single field (argument `ff.name`) """
+	n = ff.name
+	lines = []
+	if ff.optional:
+		lines.append("if {0} is _MISSING or {0} is None: {0} = None".format(n))
+		check = "elif"
+	else:
+		lines.append("if {} is _MISSING:".format(n))
+		lines.append("\traise _TypeError({!r})".format("Missing value for field `{}`".format(n)))
+		check = "if"
+	fail = "\traise _type_error({!r}, _fields[{}].field_type, {})".format(n, ii, n)
+	# `_v` is the validation level that was active when __init__ was entered
+	if ff.container is None:
+		lines += ["{} _v and not _isinstance({}, _t{}):".format(check, n, ii), fail]
+	else:
+		lines += ["{} _v and not _isinstance({}, _c{}):".format(check, n, ii), fail]
+		lines.append("{} _v is _FULL:".format(check))
+		lines.append("\tfor _e in {}:".format(n))
+		lines.append("\t\tif not _isinstance(_e, _t{}):".format(ii))
+		lines.append("\t\t" + fail)
+	return lines
+
+def _compile_init(cls, fields):
+	""" generates a specialized `__init__` for the schema `fields` """
+	names = [ff.name for ff in fields]
+	args = "".join(", {}=_MISSING".format(n) for n in names)
+	body = ["_v = _policy.level"] if fields else []
+	for ii, ff in enumerate(fields):
+		body += _init_field_source(ii, ff)
+	if cls._compact:
+		body += ["_s{}(_self, {})".format(ii, n) for ii, n in enumerate(names)]
+	else:
+		body.append("_d = _self.__dict__")
+		body += ["_d[{0!r}] = {0}".format(n) for n in names]
+	src = "def __init__(_self{}):\n".format(args) + "".join("\t" + ll + "\n" for ll in body)
+	namespace = {
+		'_MISSING': _MISSING, '_TypeError': TypeError, '_isinstance': isinstance,
+		'_type_error': _type_error, '_fields': fields,
+		'_policy': _policy, '_FULL': Validation.Full,
+	}
+	for ii, ff in enumerate(fields):
+		if cls._compact:
+			namespace['_s{}'.format(ii)] = getattr(cls, ff.name).__set__
+		namespace['_t{}'.format(ii)] = ff.element_type if ff.container else ff.value_type
+		namespace['_c{}'.format(ii)] = ff.container
+	exec(compile(src, "<{}.__init__>".format(cls.__qualname__), "exec"), namespace)
+	init = namespace['__init__']
+	init.__qualname__ = cls.__qualname__ + ".__init__"
+	init.__module__ = cls.__module__
+	init._source = src
+	return init
+
+def _install_schema(cls):
+	""" computes the field schema of `cls` once and generates its constructor """
+	typed_fields = get_fields(cls) if cls is not Node else []
+	cls._schema = [Field(name, tt) for name, tt in typed_fields]
+	cls._schema_by_name = {ff.name: ff for ff in cls._schema}
+	# shared by all instances, ast.iter_fields only needs the class attribute
+	cls._fields = [ff.name for ff in cls._schema]
+	cls._typed_fields = typed_fields
+	if '__init__' not in cls.__dict__ or cls is Node:
+		cls.__init__ = _compile_init(cls, cls._schema)
+
+################################################################################
+# hash-consing
+
+def _freeze(value):
+	# values that compare equal but differ in type (1 and True) or sign
+	# (0.0 and -0.0) must not share a node
+	tt = type(value)
+	if tt is float: return (tt, value.hex())
+	if tt is list or tt is tuple: return (tt, tuple(_freeze(vv) for vv in value))
+	if tt is set or tt is frozenset: return (tt, frozenset(_freeze(vv) for vv in value))
+	return (tt, value)
+
+def structural_key(node):
+	""" tuple of (hashable) field values that identifies an interned node """
+	return tuple(_freeze(getattr(node, name)) for name in node._fields)
+
+def _interned_eq(self, other):
+	if self is other: return True
+	if type(self) is not type(other) or self._hash != other._hash: return False
+	return structural_key(self) == structural_key(other)
+
+def _interned_hash(self):
+	return self._hash
+
+################################################################################
+
+class NodeMeta(type):
+	""" allows Node subclasses to opt into compact, slot based storage
+	    and/or into hash-consing:
+
+	class Channel(Node, compact=True):
+		width = int
+	class IntConst(Expr, interned=True):
+		val = int
+
+	Field declarations of compact classes are moved out of the class
+	namespace and replaced by slots.
+	Structurally equal instances of interned classes are shared through
+	a weak valued intern table and compare/hash by structure.
+	Both settings are inherited.
+	"""
+	def __new__(mcls, name, bases, namespace, compact=None, interned=None, **kwargs):
+		if compact is None:
+			compact = any(getattr(b, '_compact', False) for b in bases)
+		if interned is None:
+			interned = any(getattr(b, '_interned', False) for b in bases)
+		namespace = dict(namespace)
+		namespace['_compact'] = compact
+		namespace['_interned'] = interned
+		slotted = lambda n: any(isinstance(getattr(b, n, None), types.MemberDescriptorType)
+		                        for b in bases)
+		if compact:
+			own = _field_declarations(namespace)
+			for n, _ in own: del namespace[n]
+			namespace['_own_fields'] = own
+			inherited = [ff for b in bases if isinstance(b, NodeMeta) and b is not Node
+			             for ff in get_fields(b)]
+			slots = [n for n, _ in own + inherited if not slotted(n)]
+			if interned and not slotted('_hash'):
+				slots.append('_hash')
+			if interned and not any(b.__weakrefoffset__ for b in bases):
+				slots.append('__weakref__')
+			namespace['__slots__'] = tuple(slots)
+		if interned:
+			mcls = InternedNodeMeta
+			namespace['_intern_table'] = weakref.WeakValueDictionary()
+			if '__eq__' not in namespace:
+				namespace['__eq__'] = _interned_eq
+				namespace['__hash__'] = _interned_hash
+		return super().__new__(mcls, name, bases, namespace, **kwargs)
+
+def _canonical(cls, node):
+	""" returns the interned instance that is structurally equal to `node` """
+	key = structural_key(node)
+	canonical = cls._intern_table.get(key)
+	if canonical is not None: return canonical
+	object.__setattr__(node, '_hash', hash((cls, key)))
+	cls._intern_table[key] = node
+	return node
+
+class InternedNodeMeta(NodeMeta):
+	""" returns the canonical instance for structurally equal nodes """
+	def __call__(cls, *args, **kwargs):
+		return _canonical(cls, super().__call__(*args, **kwargs))
+
+def _unchanged(new, old):
+	if new is old: return True
+	# a rebuilt list with the very same elements does not require a new node
+	return (type(new) is list and type(old) is list and len(new) == len(old)
+	        and all(a is b for a, b in zip(new, old)))
+
+# (class, types) -> names of the fields that `Node.map` applies to
+_map_field_cache = {}
+
+class Node(ast.AST, metaclass=NodeMeta):
 	""" type checking replacement for ast.AST"""
-	def __init__(self, *args, **kwargs):
-		fields = get_fields(type(self))
-		field_names = [ff[0] for ff in fields]
-		aa = parse_args(field_names, args, kwargs)
-		# check completeness
-		for name, value in fields:
-			if not name in aa and not isinstance(value, Optional):
-				raise TypeError("Missing value for field `{}`".format(name))
-		# check types
-		types = {ff[0]: ff[1] for ff in fields}
-		for name, value in aa.items():
-			if not _local_isinstance(value, types[name]):
-				raise TypeError("Field `{}` requires values of type `{}` not `{}`".format(
-					name, types[name], type(value)))
-		# accept field values
-		for name in field_names:
-			object.__setattr__(self, name, aa.get(name, None))
-		# fake _fields
-		object.__setattr__(self, "_fields", field_names)
-		# remember field types
-		object.__setattr__(self, "_typed_fields", fields)
+	def __init_subclass__(cls, **kwargs):
+		super().__init_subclass__(**kwargs)
+		_install_schema(cls)
 	def __setattr__(self, name, value):
 		raise AttributeError("kAST nodes are immutable!")
-	def _map(self, fun, filt):
+	def __reduce__(self):
+		# ast.AST would pickle the instance __dict__, which is empty for
+		# compact nodes and cannot be passed to the generated constructor
+		return (self.__class__, tuple(getattr(self, name) for name in self._fields))
+	def _replace(self, changes):
+		""" fast path: copy of this node with `changes` which need to be validated already """
+		cls = self.__class__
+		node = cls.__new__(cls)
+		if cls._compact:
+			for name in self._fields:
+				value = changes[name] if name in changes else getattr(self, name)
+				object.__setattr__(node, name, value)
+		else:
+			state = node.__dict__
+			state.update(self.__dict__)
+			state.update(changes)
+		return _canonical(cls, node) if cls._interned else node
+	def _update(self, values):
+		""" returns self if no value changed, otherwise a node with only the changed fields validated """
+		changes = {}
+		for name, value in values.items():
+			old = getattr(self, name)
+			if not _unchanged(value, old):
+				self._schema_by_name[name].check(value, old)
+				changes[name] = value
+		if not changes: return self
+		return self._replace(changes)
+	def _map_fields(self, fun, names):
 		new_values = {}
-		for name, tt in self._typed_fields:
-			old = self.__getattribute__(name)
-			if filt(name, tt) and old is not None:
+		for name in names:
+			old = getattr(self, name)
+			if old is not None:
 				if isinstance(old, list):
 					new_values[name] = [fun(o) for o in old]
 				else:
 					new_values[name] = fun(old)
-			else:
-				new_values[name] = self.__getattribute__(name)
-		return self.__class__(**new_values)
+		return self._update(new_values)
+	def _map(self, fun, filt):
+		return self._map_fields(fun, [name for name, tt in self._typed_fields if filt(name, tt)])
 	def map(self, fun, types):
-		if is_type_list(types):
-			filt = lambda name, tt: matches_types(types=types, tt=tt)
-		elif is_str_list(types):
-			file = lambda name, tt: name in types
-		else:
-			assert False, "types needs to be a list of types are of field names!"
-		return self._map(fun, filt)
+		cls = self.__class__
+		key = (cls, tuple(types))
+		names = _map_field_cache.get(key)
+		if names is None:
+			if is_type_list(types):
+				filt = lambda name, tt: matches_types(types=types, tt=tt)
+			elif is_str_list(types):
+				filt = lambda name, tt: name in types
+			else:
+				assert False, "types needs to be a list of types are of field names!"
+			names = [name for name, tt in cls._typed_fields if filt(name, tt)]
+			_map_field_cache[key] = names
+		return self._map_fields(fun, names)
 	def set(self, **kwargs):
 		if len(kwargs) < 1: return self
-		field_names = set(self._fields)
 		assert set(kwargs.keys()).issubset(set(self._fields))
-		new_values = { name: kwargs.get(name, self.__getattribute__(name)) for name in self._fields }
-		return self.__class__(**new_values)
+		return self._update(kwargs)
 	def __str__(self):
 		desc = self.__class__.__name__ + "("
 		fields = []
@@ -142,3 +398,249 @@ class Node(ast.AST):
 			fields.append(str(getattr(self, name)))
 		return self.__class__.__name__ + "(" + ", ".join(fields) + ")"
 	def __repr__(self): return str(self)
+
+_install_schema(Node)
+
+################################################################################
+# visitors with cached dispatch
+
+class Visitor:
+	""" replacement for ast.NodeVisitor
+
+	Handlers are looked up once per (visitor class, node class) and
+	resolved along the MRO of the node class, i.e. `visit_Event` also
+	handles `ExternalEvent` nodes unless there is a `visit_ExternalEvent`.
+	Nodes without a handler are passed to `generic_visit`.
+
+	With `memoize = True` every distinct node (by identity) is only
+	handled once per visitor instance and all other references to it
+	get the same result, so shared subtrees stay shared and a DAG is
+	processed in time linear in its size.
+	"""
+	_dispatch = {}
+	memoize = False
+	def __init_subclass__(cls, **kwargs):
+		super().__init_subclass__(**kwargs)
+		cls._dispatch = {}
+	@classmethod
+	def _resolve(cls, node_cls):
+		handler = cls.generic_visit
+		for klass in node_cls.__mro__:
+			method = getattr(cls, 'visit_' + klass.__name__, None)
+			if method is not None:
+				handler = method
+				break
+		cls._dispatch[node_cls] = handler
+		return handler
+	def _memo(self):
+		try:
+			return self._memo_table
+		except AttributeError:
+			# id(node) -> (node, result), the node is kept alive to keep its id unique
+			self._memo_table = {}
+			return self._memo_table
+	def reset_memo(self):
+		self._memo_table = {}
+	def visit(self, node):
+		if self.memoize and isinstance(node, ast.AST):
+			memo = self._memo()
+			entry = memo.get(id(node))
+			if entry is not None: return entry[1]
+		try:
+			handler = self._dispatch[node.__class__]
+		except KeyError:
+			handler = self._resolve(node.__class__)
+		result = handler(self, node)
+		if self.memoize and isinstance(node, ast.AST):
+			memo[id(node)] = (node, result)
+		return result
+	def generic_visit(self, node):
+		if not isinstance(node, ast.AST): return
+		for name in node._fields:
+			value = getattr(node, name, None)
+			if isinstance(value, list):
+				for item in value:
+					if isinstance(item, ast.AST):
+						self.visit(item)
+			elif isinstance(value, ast.AST):
+				self.visit(value)
+
+class Transformer(Visitor):
+	""" Visitor whose handlers return replacement nodes, by default all
+	    child nodes are visited and the node is rebuilt copy-on-write """
+	def generic_visit(self, node):
+		if not isinstance(node, Node): return node
+		changes = {}
+		for name in node._fields:
+			value = getattr(node, name)
+			if isinstance(value, Node):
+				changes[name] = self.visit(value)
+			elif isinstance(value, list):
+				changes[name] = [self.visit(item) if isinstance(item, Node) else item for item in value]
+		return node._update(changes)
+
+################################################################################
+# non-recursive traversal
+
+def iter_child_nodes(node):
+	""" yields all direct child nodes of `node` in field order """
+	for name in node._fields:
+		value = getattr(node, name, None)
+		if isinstance(value, ast.AST):
+			yield value
+		elif isinstance(value, list):
+			for item in value:
+				if isinstance(item, ast.AST):
+					yield item
+
+def walk(node, order="pre"):
+	""" iterates over `node` and all of its descendants using an explicit
+	    stack, `order` is either "pre" or "post" """
+	assert order in ("pre", "post"), "unknown order {}".format(order)
+	if order == "pre":
+		stack = [node]
+		while stack:
+			nn = stack.pop()
+			yield nn
+			stack.extend(reversed(list(iter_child_nodes(nn))))
+	else:
+		stack = [(node, False)]
+		while stack:
+			nn, expanded = stack.pop()
+			if expanded:
+				yield nn
+			else:
+				stack.append((nn, True))
+				stack.extend((cc, False) for cc in reversed(list(iter_child_nodes(nn))))
+
+class IterativeTransformer(Transformer):
+	""" Transformer that keeps its state on an explicit stack instead of
+	    recursing through Python frames.
+
+	Handlers can be plain functions or generators: inside a generator
+	handler `child = yield node.child` visits the child and returns its
+	replacement, which replaces recursive `self.visit(node.child)` calls.
+	The default `generic_visit` rebuilds nodes bottom up.
+	"""
+	def _handle(self, node):
+		memoized = self.memoize and isinstance(node, ast.AST)
+		if memoized:
+			entry = self._memo().get(id(node))
+			if entry is not None: return entry[1]
+		try:
+			handler = self._dispatch[node.__class__]
+		except KeyError:
+			handler = self._resolve(node.__class__)
+		result = handler(self, node)
+		if not memoized: return result
+		if isinstance(result, types.GeneratorType):
+			return self._memoize_generator(node, result)
+		self._memo()[id(node)] = (node, result)
+		return result
+	def _memoize_generator(self, node, handler):
+		result = yield from handler
+		self._memo()[id(node)] = (node, result)
+		return result
+	def visit(self, node):
+		stack = []
+		pending = self._handle(node)
+		while True:
+			if isinstance(pending, types.GeneratorType):
+				stack.append(pending)
+				value = None
+			else:
+				value = pending
+				if not stack: return value
+			pending = self._resume(stack, stack[-1].send, value)
+	def _resume(self, stack, resume, arg):
+		""" advances the handler on top of the stack and returns the result of
+		    the next child handler or the value the top handler returned """
+		while True:
+			try:
+				child = resume(arg)
+			except StopIteration as stop:
+				stack.pop()
+				return stop.value
+			except Exception as err:
+				# the handler failed, pass the error on to its parent
+				stack.pop()
+				if not stack: raise
+				resume, arg = stack[-1].throw, err
+				continue
+			try:
+				return self._handle(child)
+			except Exception as err:
+				resume, arg = stack[-1].throw, err
+	def generic_visit(self, node):
+		if not isinstance(node, Node): return node
+		changes = {}
+		for name in node._fields:
+			value = getattr(node, name)
+			if isinstance(value, Node):
+				changes[name] = yield value
+			elif isinstance(value, list):
+				items = []
+				for item in value:
+					items.append((yield item) if isinstance(item, Node) else item)
+				changes[name] = items
+		return node._update(changes)
+
+def count_nodes(node):
+	""" number of distinct nodes reachable from `node` """
+	seen = set()
+	stack = [node]
+	while stack:
+		nn = stack.pop()
+		if id(nn) in seen: continue
+		seen.add(id(nn))
+		stack.extend(iter_child_nodes(nn))
+	return len(seen)
+
+def _hash_value(value, index, out):
+	if isinstance(value, ast.AST):
+		out.append("#{};".format(index[id(value)]).encode())
+	elif isinstance(value, (list, tuple)):
+		out.append(b'[')
+		for item in value: _hash_value(item, index, out)
+		out.append(b']')
+	elif isinstance(value, (set, frozenset)):
+		items = []
+		for item in value: _hash_value(item, index, items)
+		out += [b'{'] + sorted(items) + [b'}']
+	elif isinstance(value, enum.Enum):
+		out.append("{}.{};".format(type(value).__qualname__, value.name).encode())
+	elif value is None or isinstance(value, (bool, int, float, str)):
+		out.append("{}:{!r};".format(type(value).__name__, value).encode())
+	else:
+		out.append(b'P' + pickle.dumps(value, protocol=4))
+
+def content_hash(node):
+	""" sha256 hex digest of the structure of `node`, equal for equal trees
+	    in every process. Like in serialize, every node is hashed once and
+	    referenced by its index, thus which nodes are shared is part of the
+	    structure, e.g. two different states of a dfa never hash the same
+	    as a single one. """
+	index = {}
+	hasher = hashlib.sha256()
+	# (node, field values), the values are None until the node is expanded
+	stack = [(node, None)]
+	while stack:
+		nn, values = stack.pop()
+		if id(nn) in index: continue
+		if values is None:
+			values = [getattr(nn, name, None) for name in nn._fields]
+			stack.append((nn, values))
+			for value in reversed(values):
+				if isinstance(value, ast.AST):
+					if id(value) not in index: stack.append((value, None))
+				elif isinstance(value, (list, tuple, set, frozenset)):
+					stack.extend((cc, None) for cc in reversed(list(value))
+					             if isinstance(cc, ast.AST) and id(cc) not in index)
+			continue
+		out = [type(nn).__qualname__.encode(), b'(']
+		for value in values:
+			_hash_value(value, index, out)
+		out.append(b')')
+		hasher.update(b''.join(out))
+		index[id(nn)] = len(index)
+	return hasher.hexdigest()